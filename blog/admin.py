@@ -1,26 +1,221 @@
-from django.contrib import admin
+from django.contrib import admin, messages
+from django.core.cache import cache
+from django.core.exceptions import PermissionDenied
+from django.core.paginator import Paginator
+from django.shortcuts import redirect
+from django.template.response import TemplateResponse
+from django.urls import path
+from django.utils.functional import cached_property
+from django.utils.text import Truncator
 
 # Register your models here.
-from .models  import Post, Comment
+from . import caching, moderation
+from .models  import Post, Comment, OutboundEmail
+from .pagination import KeysetPaginator
+
+# comments on each page of the moderation queue
+MODERATION_PER_PAGE = 50
+
+
+class CachedCountPaginator(Paginator):
+    """
+    Paginator that keeps the COUNT(*) of a changelist page in the cache
+    until one of the versions it was taken under is bumped.
+    """
+
+    def __init__(self, *args, version_names=(), **kwargs):
+        super().__init__(*args, **kwargs)
+        self.version_names = version_names
+
+    @cached_property
+    def count(self):
+        current = caching.versions(*self.version_names)
+        key = caching.make_key('admin_count', str(self.object_list.query), *sorted(current.items()))
+        count = cache.get(key)
+        if count is None:
+            count = super().count
+            cache.set(key, count, caching.timeout())
+        return count
+
+
+class CachedFacetsMixin:
+    """
+    Caches the facet counts of a list filter under the count_versions of its ModelAdmin.
+
+    The key is the SQL the counts are taken over, so every combination
+    of the other filters and the search gets its own counts.
+    """
+
+    def get_facet_queryset(self, changelist):
+        filtered_qs = changelist.get_queryset(self.request, exclude_parameters=self.expected_parameters())
+        current = caching.versions(*changelist.model_admin.count_versions)
+        key = caching.make_key(
+            'admin_facets', type(self).__name__, *self.expected_parameters(),
+            str(filtered_qs.query), *sorted(current.items()),
+        )
+        counts = cache.get(key)
+        if counts is None:
+            counts = filtered_qs.aggregate(**self.get_facet_counts(changelist.pk_attname, filtered_qs))
+            cache.set(key, counts, caching.timeout())
+        return counts
+
+
+def cached_facets(filter_class):
+    """
+    The list filter class with its facet counts cached, for list_filter tuples.
+    """
+    return type(f'Cached{filter_class.__name__}', (CachedFacetsMixin, filter_class), {})
+
+
+class CachedCountsAdmin(admin.ModelAdmin):
+    """
+    Keeps the changelist COUNT(*) and facet counts in the cache until
+    the versions named in count_versions are bumped.
+
+    Attributes:
+        count_versions (tuple): The caching versions the model's rows change under.
+    """
+    count_versions = ()
+    # the unfiltered total is another COUNT(*) over the whole table
+    show_full_result_count = False
+
+    def get_paginator(self, request, queryset, per_page, orphans=0, allow_empty_first_page=True):
+        return CachedCountPaginator(
+            queryset, per_page, orphans, allow_empty_first_page, version_names=self.count_versions,
+        )
+
 
 @admin.register(Post)
-class PostAdmin(admin.ModelAdmin):
+class PostAdmin(CachedCountsAdmin):
     '''a class the tells django adminstration how to display our database model'''
     list_display = ['title', 'slug', 'author', 'publish', 'status']
-    list_filter = ['status', 'created', 'publish', 'author']
+    list_filter = [
+        ('status', cached_facets(admin.ChoicesFieldListFilter)),
+        ('created', cached_facets(admin.DateFieldListFilter)),
+        ('publish', cached_facets(admin.DateFieldListFilter)),
+        ('author', cached_facets(admin.RelatedFieldListFilter)),
+    ]
+    list_select_related = ['author']
     search_fields = ['title', 'body']
     # prepopulated_fields = {'slug': ('title',)}
     # raw_id_fields = ['author']
-    date_hierarchy = 'publish'
+    # no date_hierarchy, its list of years truncates the date of every post on each load,
+    # the publish filter offers the same ranges with cached counts
     ordering = ['status', 'publish']
     show_facets =admin.ShowFacets.ALWAYS
+    count_versions = ('posts',)
+    actions = ['publish_posts', 'unpublish_posts']
+
+    def get_queryset(self, request):
+        # the list never shows the body
+        return super().get_queryset(request).defer('body', 'body_html')
+
+    @admin.action(description='Publish selected posts', permissions=['change'])
+    def publish_posts(self, request, queryset):
+        count, caught_up = moderation.set_posts_status(queryset, Post.Status.PUBLISHED)
+        self.message_user(request, f'Published {count} posts.')
+        self.warn_unless_caught_up(request, caught_up)
+
+    @admin.action(description='Unpublish selected posts', permissions=['change'])
+    def unpublish_posts(self, request, queryset):
+        count, caught_up = moderation.set_posts_status(queryset, Post.Status.DRAFT)
+        self.message_user(request, f'Unpublished {count} posts.')
+        self.warn_unless_caught_up(request, caught_up)
+
+    def warn_unless_caught_up(self, request, caught_up):
+        if not caught_up:
+            commands = ', '.join(f'`python manage.py {name}`' for name in moderation.REBUILD_COMMANDS)
+            self.message_user(
+                request, f'Search, similar posts and tag pages are not updated yet for this many posts, run {commands}.',
+                messages.WARNING,
+            )
 
 
 @admin.register(Comment)
-class CommentAdmin(admin.ModelAdmin):
+class CommentAdmin(CachedCountsAdmin):
     '''a class the tells django adminstration how to display our database model'''
-    list_display = ['name', 'email', 'body', 'created', 'active']
-    list_filter = ['active', 'created', 'updated']
+    list_display = ['name', 'email', 'short_body', 'post', 'created', 'active']
+    list_filter = [
+        ('active', cached_facets(admin.BooleanFieldListFilter)),
+        ('created', cached_facets(admin.DateFieldListFilter)),
+        ('updated', cached_facets(admin.DateFieldListFilter)),
+    ]
+    list_select_related = ['post']
     search_fields = ['name', 'email', 'body']
+    raw_id_fields = ['post', 'parent']
+    count_versions = ('comments',)
+    actions = ['approve_comments', 'hide_comments']
+
+    def get_queryset(self, request):
+        # only the post's title is shown next to each comment
+        return super().get_queryset(request).defer('post__body', 'post__body_html', 'post__excerpt')
+
+    @admin.display(description='body')
+    def short_body(self, comment):
+        return Truncator(comment.body).chars(80)
+
+    @admin.action(description='Approve selected comments', permissions=['change'])
+    def approve_comments(self, request, queryset):
+        count = moderation.set_comments_active(queryset, True)
+        self.message_user(request, f'Approved {count} comments.')
+
+    @admin.action(description='Hide selected comments', permissions=['change'])
+    def hide_comments(self, request, queryset):
+        count = moderation.set_comments_active(queryset, False)
+        self.message_user(request, f'Hid {count} comments.')
+
+    def get_urls(self):
+        return [
+            path('moderation/', self.admin_site.admin_view(self.moderation_view), name='blog_comment_moderation'),
+            *super().get_urls(),
+        ]
+
+    def moderation_view(self, request):
+        """
+        The hidden comments waiting for review, newest first, a page at a time.
+
+        Keyset paginated on a partial index of the hidden comments, so neither
+        a deep page nor a large table of approved comments slows it down.
+        Selected comments are approved with one UPDATE, or deleted.
+        """
+        if not self.has_view_permission(request):
+            raise PermissionDenied
+        if request.method == 'POST':
+            selected = Comment.objects.filter(active=False, pk__in=request.POST.getlist('selected'))
+            action = request.POST.get('action')
+            if action == 'approve' and self.has_change_permission(request):
+                count = moderation.set_comments_active(selected, True)
+                self.message_user(request, f'Approved {count} comments.')
+            elif action == 'delete' and self.has_delete_permission(request):
+                count = len(selected)
+                selected.delete()
+                self.message_user(request, f'Deleted {count} comments.')
+            else:
+                raise PermissionDenied
+            return redirect(request.get_full_path())
+
+        # the post's title and link are shown next to each comment, fetched with it
+        queue = (
+            self.get_queryset(request).filter(active=False).select_related('post')
+            .only('id', 'name', 'email', 'body', 'created', 'post__id', 'post__title', 'post__slug', 'post__publish')
+        )
+        page = KeysetPaginator(queue, MODERATION_PER_PAGE, ordering=('-created', '-id')).get_page(
+            request.GET.get('cursor')
+        )
+        return TemplateResponse(request, 'admin/blog/comment/moderation.html', {
+            **self.admin_site.each_context(request),
+            'title': 'Moderation queue',
+            'opts': self.model._meta,
+            'page': page,
+            'has_change_permission': self.has_change_permission(request),
+            'has_delete_permission': self.has_delete_permission(request),
+        })
 
 
+@admin.register(OutboundEmail)
+class OutboundEmailAdmin(admin.ModelAdmin):
+    '''shows the outbound mail queue and the delivery status of each message'''
+    list_display = ['subject', 'to', 'status', 'attempts', 'next_attempt', 'sent']
+    list_filter = ['status']
+    search_fields = ['subject', 'to']
+    readonly_fields = ['attempts', 'last_error', 'created', 'sent']
@@ -0,0 +1,249 @@
+import hashlib
+import json
+from collections import defaultdict
+
+from django.contrib.contenttypes.models import ContentType
+from django.core.cache import cache
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Value
+from django.http import Http404, HttpResponse
+from django.shortcuts import get_object_or_404
+from django.urls import reverse
+from django.utils.cache import get_conditional_response, patch_cache_control
+from taggit.models import Tag, TaggedItem
+
+from . import caching
+from .models import Comment, Post, TagStats
+from .pagination import InvalidCursor, KeysetPaginator
+
+# posts or comments on a page unless ?limit= asks for fewer or more, up to API_MAX_LIMIT
+API_PAGE_SIZE = 20
+API_MAX_LIMIT = 100
+# how long clients and proxies may reuse a response without asking, the server copy lasts until a change
+API_MAX_AGE = 60
+CONTENT_TYPE = 'application/json'
+
+# public field name: the values() column it is read from, None for fields computed from other columns
+POST_FIELDS = {
+    'id': 'id',
+    'title': 'title',
+    'slug': 'slug',
+    'author': 'author__username',
+    'publish': 'publish',
+    'updated': 'updated',
+    'excerpt': 'excerpt',
+    'word_count': 'word_count',
+    'reading_time': 'reading_time',
+    'body_html': 'body_html',
+    'url': None,
+    'tags': None,
+}
+POST_LIST_FIELDS = ('id', 'title', 'slug', 'author', 'publish', 'excerpt', 'reading_time', 'tags', 'url')
+POST_DETAIL_FIELDS = (*POST_LIST_FIELDS, 'updated', 'word_count', 'body_html')
+COMMENT_FIELDS = {'id': 'id', 'parent': 'parent_id', 'name': 'name', 'body': 'body', 'created': 'created'}
+TAG_FIELDS = {
+    'name': 'tag__name', 'slug': 'tag__slug', 'post_count': 'post_count',
+    'latest_publish': 'latest_publish', 'url': None,
+}
+
+
+class BadRequest(Exception):
+    """
+    Raised for query parameters the API can't answer, sent back as a 400.
+    """
+
+
+def _error(message, status=400):
+    return HttpResponse(json.dumps({'error': message}), status=status, content_type=CONTENT_TYPE)
+
+
+def requested_fields(request, available, default):
+    """
+    The fields named by ``?fields=a,b``, the default ones without it.
+    """
+    value = request.GET.get('fields')
+    if not value:
+        return list(default)
+    fields = [name.strip() for name in value.split(',') if name.strip()]
+    unknown = [name for name in fields if name not in available]
+    if unknown or not fields:
+        raise BadRequest(f'Unknown fields: {", ".join(unknown) or value}. Available: {", ".join(available)}.')
+    return list(dict.fromkeys(fields))
+
+
+def _limit(request):
+    try:
+        limit = int(request.GET.get('limit', API_PAGE_SIZE))
+    except ValueError:
+        raise BadRequest('limit must be a number.')
+    return max(1, min(limit, API_MAX_LIMIT))
+
+
+def _page(paginator, request):
+    # a client sent a cursor it wasn't given, unlike a reader following a stale link
+    try:
+        return paginator.page(request.GET.get('cursor'))
+    except InvalidCursor:
+        raise BadRequest('Invalid cursor.')
+
+
+def _columns(fields, mapping, *needed):
+    # the values() columns behind the fields, plus those the paging or computed fields read
+    columns = [mapping[name] for name in fields if mapping[name]]
+    return list(dict.fromkeys([*columns, *needed]))
+
+
+def _url_template(request, name, **markers):
+    """
+    The absolute URL of the named route as a str.format() template, one reverse() for a whole page of rows.
+    Markers are sample values of each argument, ints for int converters, swapped for ``{argument}``.
+    """
+    url = request.build_absolute_uri(reverse(name, kwargs=markers))
+    for argument, marker in markers.items():
+        url = url.replace(str(marker), f'{{{argument}}}')
+    return url
+
+
+def _tag_names(post_ids):
+    names = defaultdict(list)
+    links = (
+        TaggedItem.objects.filter(content_type=ContentType.objects.get_for_model(Post), object_id__in=post_ids)
+        .order_by('tag__name')
+        .values_list('object_id', 'tag__name')
+    )
+    for post_id, name in links:
+        names[post_id].append(name)
+    return names
+
+
+def _posts(request, rows, fields):
+    """
+    Turns values() rows into the API's post objects with only the requested fields.
+    """
+    url = _url_template(request, 'blog:post_detail', id=918273645, post='api-url-slug') if 'url' in fields else ''
+    names = _tag_names([row['id'] for row in rows]) if 'tags' in fields else {}
+    posts = []
+    for row in rows:
+        post = {}
+        for name in fields:
+            if name == 'url':
+                post[name] = url.format(id=row['id'], post=row['slug'])
+            elif name == 'tags':
+                post[name] = names.get(row['id'], [])
+            else:
+                post[name] = row[POST_FIELDS[name]]
+        posts.append(post)
+    return posts
+
+
+def _page_links(request, page):
+    def link(cursor):
+        if cursor is None:
+            return None
+        query = request.GET.copy()
+        query['cursor'] = cursor
+        return request.build_absolute_uri(f'{request.path}?{query.urlencode()}')
+    return {'next': link(page.next_cursor), 'previous': link(page.previous_cursor)}
+
+
+def post_list(request):
+    """
+    Published posts, newest first, a page at a time. Takes ``tag``, ``fields``, ``limit`` and ``cursor``.
+    """
+    fields = requested_fields(request, POST_FIELDS, POST_LIST_FIELDS)
+    posts = Post.published.all()
+    ordering = ('-publish', '-id')
+    if request.GET.get('tag'):
+        tag = get_object_or_404(Tag, slug=request.GET['tag'])
+        # off the (tag, publish) index, like the tag pages
+        posts = posts.tagged(tag)
+        ordering = ('-tag_publish', '-tag_post')
+    columns = _columns(fields, POST_FIELDS, 'id', 'slug', *(name.lstrip('-') for name in ordering))
+    page = _page(KeysetPaginator(posts.values(*columns), _limit(request), ordering=ordering), request)
+    return {'results': _posts(request, page.object_list, fields), **_page_links(request, page)}
+
+
+def post_detail(request, id):
+    """
+    One published post, its rendered body included.
+    """
+    fields = requested_fields(request, POST_FIELDS, POST_DETAIL_FIELDS)
+    row = Post.published.filter(id=id).values(*_columns(fields, POST_FIELDS, 'id', 'slug')).first()
+    if row is None:
+        raise Http404('No such post.')
+    return _posts(request, [row], fields)[0]
+
+
+def comment_list(request, id):
+    """
+    The visible comments of a published post, oldest first, a page at a time.
+    """
+    fields = requested_fields(request, COMMENT_FIELDS, COMMENT_FIELDS)
+    if not Post.published.filter(id=id).exists():
+        raise Http404('No such post.')
+    # off the (post, active, created) index, active is compared to a value as SQLite
+    # can't seek on a bare boolean column and would sort every comment of the post instead
+    comments = (
+        Comment.objects.filter(post=id, active=Value(True))
+        .values(*_columns(fields, COMMENT_FIELDS, 'id', 'created'))
+    )
+    page = _page(KeysetPaginator(comments, _limit(request), ordering=('created', 'id')), request)
+    results = [{name: row[COMMENT_FIELDS[name]] for name in fields} for row in page.object_list]
+    return {'results': results, **_page_links(request, page)}
+
+
+def tag_list(request):
+    """
+    Every tag in use with its post count, read from TagStats. Sorted by name, or by count with ``?sort=popular``.
+    """
+    fields = requested_fields(request, TAG_FIELDS, TAG_FIELDS)
+    ordering = ('-post_count', 'tag__name') if request.GET.get('sort') == 'popular' else ('tag__name',)
+    rows = (
+        TagStats.objects.filter(post_count__gt=0).order_by(*ordering)
+        .values(*_columns(fields, TAG_FIELDS, 'tag__slug'))
+    )
+    url = _url_template(request, 'blog:post_list_by_tag', tag_slug='api-url-slug')
+    return {'results': [
+        {
+            name: url.format(tag_slug=row['tag__slug']) if name == 'url' else row[TAG_FIELDS[name]]
+            for name in fields
+        }
+        for row in rows
+    ]}
+
+
+def response(request, name, build, version_names, *args):
+    """
+    Serves build(request, *args) as JSON, cached under the versions it depends on.
+
+    Every reader gets the same document for a URL, so one cached copy is shared
+    by all of them and its ETag is the hash of the body. A matching If-None-Match
+    is answered with 304 off the cache without touching the database.
+
+    Args:
+        name (str): Name used for the hit and miss counters.
+        build: Callable returning the data, may raise BadRequest or Http404.
+        version_names (list): The caching versions the data changes with.
+    """
+    current = caching.versions(*version_names)
+    key = caching.make_key(f'api:{name}', request.build_absolute_uri(), *sorted(current.items()))
+    found = cache.get(key)
+    if found is not None:
+        caching.record(f'api_{name}', hit=True)
+    else:
+        caching.record(f'api_{name}', hit=False)
+        try:
+            content = json.dumps(build(request, *args), cls=DjangoJSONEncoder, separators=(',', ':'))
+        except BadRequest as exc:
+            return _error(str(exc))
+        except Http404 as exc:
+            return _error(str(exc), status=404)
+        found = (f'"{hashlib.sha256(content.encode()).hexdigest()[:32]}"', content)
+        if caching.settled(current):
+            cache.set(key, found, caching.timeout())
+
+    etag, content = found
+    result = get_conditional_response(request, etag=etag) or HttpResponse(content, content_type=CONTENT_TYPE)
+    result.headers['ETag'] = etag
+    patch_cache_control(result, public=True, max_age=API_MAX_AGE)
+    return result
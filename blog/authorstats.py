@@ -0,0 +1,58 @@
+from django.db.models import Count, Max, Q, Sum
+from django.db.models.functions import Coalesce
+
+from .models import AuthorStats, Post
+
+PUBLISHED = Q(status=Post.Status.PUBLISHED)
+
+
+def summarize(author_id):
+    """
+    Totals over every post of an author, in a single query.
+
+    Comments are summed from the posts' comment_count, joining them
+    to the posts would count every post's words once per comment.
+    """
+    # from the primary, totals taken off a lagging replica would be kept as current
+    return (
+        Post.objects.using('default')
+        .filter(author_id=author_id)
+        .aggregate(
+            post_count=Count('id'),
+            published_count=Count('id', filter=PUBLISHED),
+            word_count=Coalesce(Sum('word_count'), 0),
+            comment_count=Coalesce(Sum('comment_count'), 0),
+            last_published=Max('publish', filter=PUBLISHED),
+        )
+    )
+
+
+def refresh(author_id):
+    """
+    Recomputes and saves the totals of an author. Returns the AuthorStats.
+    """
+    stats, _ = AuthorStats.objects.update_or_create(
+        author_id=author_id, defaults={**summarize(author_id), 'stale': False},
+    )
+    return stats
+
+
+def for_author(author):
+    """
+    The totals of an author, recomputed first if they are missing or stale.
+    """
+    stats = AuthorStats.objects.filter(author=author, stale=False).first()
+    if stats is None:
+        stats = refresh(author.pk)
+    return stats
+
+
+def mark_stale(*author_ids):
+    AuthorStats.objects.filter(author__in=[author_id for author_id in author_ids if author_id]).update(stale=True)
+
+
+def mark_post_stale(*post_ids):
+    """
+    Marks the totals of the posts' authors, without loading the posts.
+    """
+    AuthorStats.objects.filter(author__blog_posts__in=post_ids).update(stale=True)
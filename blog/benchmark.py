@@ -0,0 +1,238 @@
+import http.client
+import math
+import socket
+import threading
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+
+from django.db import connection
+from django.db.models import Count
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from taggit.models import Tag
+
+from . import ratelimit, views
+from .models import Post
+from .pagination import KeysetPaginator
+
+
+def percentile(samples, pct):
+    """
+    Nearest-rank percentile of a list of numbers, None when it is empty.
+    """
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    rank = max(1, math.ceil(pct / 100 * len(ordered)))
+    return ordered[rank - 1]
+
+
+def summarize(latencies, elapsed, errors=0):
+    """
+    Sums up a load run.
+
+    Args:
+        latencies (list): Seconds taken by each successful request.
+        elapsed (float): Wall time of the whole run in seconds.
+        errors (int): Number of failed requests.
+    """
+    ms = [latency * 1000 for latency in latencies]
+    return {
+        'requests': len(latencies) + errors,
+        'errors': errors,
+        'seconds': round(elapsed, 3),
+        'rps': round(len(latencies) / elapsed, 1) if elapsed else None,
+        'p50_ms': _round(percentile(ms, 50)),
+        'p95_ms': _round(percentile(ms, 95)),
+        'p99_ms': _round(percentile(ms, 99)),
+        'max_ms': _round(max(ms) if ms else None),
+    }
+
+
+def _round(value):
+    return None if value is None else round(value, 2)
+
+
+def wait_for_port(host, port, timeout=30):
+    """
+    Blocks until something accepts connections on host:port. Returns False on timeout.
+    """
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            with socket.create_connection((host, port), timeout=1):
+                return True
+        except OSError:
+            time.sleep(0.1)
+    return False
+
+
+def run_load(url, requests, concurrency, host_header=None, timeout=30):
+    """
+    Sends GET requests to url from `concurrency` threads, each over its own keep-alive connection.
+
+    Returns the summary from summarize(), only 200 responses count as successful.
+    """
+    parts = urlsplit(url)
+    path = parts.path or '/'
+    if parts.query:
+        path = f'{path}?{parts.query}'
+    headers = {'Host': host_header or parts.netloc}
+
+    remaining = [requests]
+    lock = threading.Lock()
+    latencies = []
+    errors = [0]
+
+    def take():
+        with lock:
+            if remaining[0] <= 0:
+                return False
+            remaining[0] -= 1
+            return True
+
+    def worker():
+        connection = http.client.HTTPConnection(parts.hostname, parts.port, timeout=timeout)
+        own, failed = [], 0
+        while take():
+            start = time.perf_counter()
+            try:
+                connection.request('GET', path, headers=headers)
+                response = connection.getresponse()
+                response.read()
+                ok = response.status == 200
+                if response.getheader('Connection', '').lower() == 'close':
+                    connection.close()
+            except (OSError, http.client.HTTPException):
+                ok = False
+                connection.close()
+            if ok:
+                own.append(time.perf_counter() - start)
+            else:
+                failed += 1
+        connection.close()
+        with lock:
+            latencies.extend(own)
+            errors[0] += failed
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        for _ in range(concurrency):
+            executor.submit(worker)
+    return summarize(latencies, time.perf_counter() - start, errors[0])
+
+
+class Scenario:
+    """
+    One request the benchmark repeats.
+
+    Args:
+        name (str): Name the results are reported under.
+        path (str): Url path, with its query string.
+        data (dict, optional): Form data, the request is then a POST.
+    """
+
+    def __init__(self, name, path, data=None):
+        self.name = name
+        self.path = path
+        self.data = data
+
+    @property
+    def method(self):
+        return 'POST' if self.data is not None else 'GET'
+
+
+def default_scenarios():
+    """
+    Builds the standard scenarios from whatever data is in the database:
+    the post list, a deep page, a search, the busiest tag, the most commented
+    post and posting a comment to it.
+    """
+    post_list = reverse('blog:post_list')
+    scenarios = [Scenario('post_list', post_list)]
+
+    deep = Post.published.order_by('-publish', '-id').only('id', 'publish')[50 * views.POSTS_PER_PAGE:][:1]
+    for post in deep:
+        cursor = KeysetPaginator(Post.published.all(), views.POSTS_PER_PAGE).encode_cursor(post)
+        scenarios.append(Scenario('post_list_page_50', f'{post_list}?cursor={cursor}'))
+
+    busiest = Post.published.annotate(n=Count('comments')).order_by('-n', '-id').only('id', 'slug', 'title').first()
+    if busiest is not None:
+        word = busiest.title.split()[0]
+        scenarios.append(Scenario('search', f'{post_list}?q={word}'))
+
+    tag = Tag.objects.annotate(n=Count('taggit_taggeditem_items')).order_by('-n').first()
+    if tag is not None:
+        scenarios.append(Scenario('tag', reverse('blog:post_list_by_tag', args=[tag.slug])))
+
+    if busiest is not None:
+        detail = busiest.get_absolute_url()
+        scenarios.append(Scenario('post_detail', detail))
+        scenarios.append(Scenario('comment', detail, {
+            'name': 'Benchmark', 'email': 'benchmark@example.com', 'body': 'Measuring comment submission.',
+        }))
+    return scenarios
+
+
+def measure(client, scenario, requests, samples=5, warmup=3):
+    """
+    Drives one scenario through the Django test client in this process.
+
+    Latency is timed on plain requests. Queries and peak Python memory are
+    taken from a few extra samples, so their bookkeeping doesn't skew the timings.
+    """
+    def send():
+        if scenario.data is None:
+            response = client.get(scenario.path)
+        else:
+            response = client.post(scenario.path, scenario.data)
+        return response.status_code < 400
+
+    for _ in range(warmup):
+        send()
+
+    latencies, errors = [], 0
+    start = time.perf_counter()
+    for _ in range(requests):
+        began = time.perf_counter()
+        if send():
+            latencies.append(time.perf_counter() - began)
+        else:
+            errors += 1
+    summary = summarize(latencies, time.perf_counter() - start, errors)
+
+    queries, peaks = [], []
+    for _ in range(samples):
+        tracemalloc.start()
+        with CaptureQueriesContext(connection) as captured:
+            send()
+        peaks.append(tracemalloc.get_traced_memory()[1])
+        tracemalloc.stop()
+        queries.append(len(captured))
+    summary['queries'] = round(sum(queries) / len(queries), 2) if queries else None
+    summary['peak_kb'] = round(max(peaks) / 1024, 1) if peaks else None
+    return summary
+
+
+def ratelimit_overhead(checks=10000):
+    """
+    Times the rate limiter's check on its own against the configured cache, in microseconds.
+
+    Every check counts against the same client with a limit it never reaches,
+    like a normal visitor's requests, which is what each limited request pays.
+    """
+    limit, period = checks * 2, 60
+    ident = f'benchmark:{time.time()}'
+    latencies = []
+    for _ in range(checks):
+        began = time.perf_counter()
+        ratelimit.hit('benchmark', ident, limit, period)
+        latencies.append((time.perf_counter() - began) * 1_000_000)
+    return {
+        'checks': checks,
+        'mean_us': round(sum(latencies) / checks, 1),
+        'p50_us': round(percentile(latencies, 50), 1),
+        'p99_us': round(percentile(latencies, 99), 1),
+    }
@@ -0,0 +1,222 @@
+import hashlib
+import threading
+import time
+from collections import Counter
+from functools import wraps
+
+from asgiref.sync import iscoroutinefunction, sync_to_async
+from django.conf import settings
+from django.contrib.messages import get_messages
+from django.core.cache import cache
+from django.http import HttpResponse
+from django.middleware.csrf import get_token
+
+from . import routing
+
+# stands in for the CSRF token in cached pages, swapped for the reader's own token on every hit
+CSRF_PLACEHOLDER = 'BLOG-CACHED-CSRF-TOKEN'
+
+_stats_lock = threading.Lock()
+_hits = Counter()
+_misses = Counter()
+
+
+def timeout():
+    return getattr(settings, 'BLOG_CACHE_TIMEOUT', 600)
+
+
+def _version_key(name):
+    return f'blog:version:{name}'
+
+
+def versions(*names):
+    """
+    Returns the current version of each name, e.g. ``versions('posts', 'comments:3')``.
+
+    Versions are nanosecond timestamps so a version evicted from the cache
+    comes back as a new value and can never match stale entries.
+    """
+    keys = {_version_key(name): name for name in names}
+    found = cache.get_many(keys)
+    result = {}
+    for key, name in keys.items():
+        if key not in found:
+            cache.add(key, time.time_ns(), None)
+            found[key] = cache.get(key)
+        result[name] = found[key]
+    return result
+
+
+async def aversions(*names):
+    """
+    Async version of versions().
+    """
+    keys = {_version_key(name): name for name in names}
+    found = await cache.aget_many(keys)
+    result = {}
+    for key, name in keys.items():
+        if key not in found:
+            await cache.aadd(key, time.time_ns(), None)
+            found[key] = await cache.aget(key)
+        result[name] = found[key]
+    return result
+
+
+def bump(*names):
+    """
+    Invalidates everything cached under the given versions.
+    """
+    now = time.time_ns()
+    cache.set_many({_version_key(name): now for name in names}, None)
+
+
+def make_key(prefix, *parts):
+    digest = hashlib.md5(':'.join(str(part) for part in parts).encode()).hexdigest()
+    return f'blog:{prefix}:{digest}'
+
+
+def stream_and_store(key, chunks, timeout=None):
+    """
+    Passes the chunks of a streamed response through, caching them joined once the last one is out.
+    Nothing is cached if the stream is abandoned partway.
+    """
+    parts = []
+    for chunk in chunks:
+        parts.append(chunk)
+        yield chunk
+    cache.set(key, ''.join(parts), timeout)
+
+
+def record(name, hit):
+    with _stats_lock:
+        if hit:
+            _hits[name] += 1
+        else:
+            _misses[name] += 1
+
+
+def stats():
+    """
+    Returns the hit and miss counters of this process, per page or fragment name.
+    """
+    with _stats_lock:
+        names = sorted(set(_hits) | set(_misses))
+        return {
+            name: {
+                'hits': _hits[name],
+                'misses': _misses[name],
+                'hit_ratio': round(_hits[name] / ((_hits[name] + _misses[name]) or 1), 4),
+            }
+            for name in names
+        }
+
+
+def reset_stats():
+    with _stats_lock:
+        _hits.clear()
+        _misses.clear()
+
+
+def _cacheable(request):
+    """
+    Only anonymous reads with no pending flash messages share a cached page.
+    """
+    if not getattr(settings, 'BLOG_PAGE_CACHE', True):
+        return False
+    if request.method not in ('GET', 'HEAD'):
+        return False
+    if request.user.is_authenticated:
+        return False
+    return len(get_messages(request)) == 0
+
+
+async def _acacheable(request):
+    if not getattr(settings, 'BLOG_PAGE_CACHE', True):
+        return False
+    if request.method not in ('GET', 'HEAD'):
+        return False
+    user = await request.auser()
+    if user.is_authenticated:
+        return False
+    # message storage may read the session from the database
+    return await sync_to_async(len)(get_messages(request)) == 0
+
+
+def settled(current):
+    """
+    False for anything read from a replica soon after one of its versions was bumped,
+    the replica may not have the change yet, so it shouldn't be cached. See blog/routing.py.
+    """
+    if routing.current_replica() is None:
+        return True
+    lag = getattr(settings, 'BLOG_REPLICA_MAX_LAG', 5)
+    changed = max((version for version in current.values() if version is not None), default=0)
+    return time.time_ns() - changed > lag * 1_000_000_000
+
+
+def _store(key, request, response, current):
+    """
+    Caches a freshly rendered page and returns it with the reader's CSRF token filled in.
+    """
+    if response.streaming:
+        return response
+    content = response.content.decode(response.charset)
+    if (
+        response.status_code == 200 and not response.cookies
+        and len(get_messages(request)) == 0 and settled(current)
+    ):
+        cache.set(key, content, timeout())
+    response.content = content.replace(CSRF_PLACEHOLDER, get_token(request))
+    return response
+
+
+def cache_page_for_readers(name, version_names):
+    """
+    Caches the whole rendered page for anonymous readers.
+
+    The key is built from the full path and the current versions returned by
+    ``version_names(*args, **kwargs)``, so bumping any of them serves a fresh page.
+    The CSRF token is rendered as a placeholder and filled in per request.
+    Works on both sync and async views.
+
+    Args:
+        name (str): Name used for the hit and miss counters.
+        version_names: Callable taking the view arguments and returning version names.
+    """
+    def decorator(view):
+        if iscoroutinefunction(view):
+            @wraps(view)
+            async def async_wrapper(request, *args, **kwargs):
+                if not await _acacheable(request):
+                    return await view(request, *args, **kwargs)
+
+                current = await aversions(*version_names(*args, **kwargs))
+                key = make_key(f'page:{name}', request.get_full_path(), *sorted(current.items()))
+                content = await cache.aget(key)
+                if content is not None:
+                    record(name, hit=True)
+                    return HttpResponse(content.replace(CSRF_PLACEHOLDER, get_token(request)))
+
+                record(name, hit=False)
+                request.blog_csrf_placeholder = True
+                response = await view(request, *args, **kwargs)
+                return await sync_to_async(_store)(key, request, response, current)
+            return async_wrapper
+
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            if not _cacheable(request):
+                return view(request, *args, **kwargs)
+
+            current = versions(*version_names(*args, **kwargs))
+            key = make_key(f'page:{name}', request.get_full_path(), *sorted(current.items()))
+            content = cache.get(key)
+            if content is not None:
+                record(name, hit=True)
+                return HttpResponse(content.replace(CSRF_PLACEHOLDER, get_token(request)))
+
+            record(name, hit=False)
+            request.blog_csrf_placeholder = True
+            return _store(key, request, view(request, *args, **kwargs), current)
+        return wrapper
+    return decorator
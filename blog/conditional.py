@@ -0,0 +1,129 @@
+import hashlib
+from functools import wraps
+
+from asgiref.sync import iscoroutinefunction, sync_to_async
+from django.contrib.messages import get_messages
+from django.core.cache import cache
+from django.db.models import Max, OuterRef, Subquery
+from django.utils.cache import get_conditional_response, patch_cache_control, patch_vary_headers
+from django.utils.http import http_date
+
+from . import caching
+from .models import Comment, Post
+
+
+def post_state(request, id, post):
+    """
+    What a post page shows, in one indexed query: when the post was last edited,
+    its latest visible comment and how many there are. None when there is no such post.
+    """
+    comments = Comment.objects.filter(post=OuterRef('pk'), active=True).values('post')
+    row = (
+        Post.published.filter(id=id, slug=post)
+        .annotate(last_comment=Subquery(comments.annotate(latest=Max('created')).values('latest')))
+        .values_list('updated', 'last_comment', 'comment_count')
+        .first()
+    )
+    if row is None:
+        return None
+    updated, last_comment, comment_count = row
+    return max(updated, last_comment or updated), [updated, last_comment, comment_count]
+
+
+def list_state(request, tag_slug=None):
+    """
+    What the post lists show: the latest edit to any post, and how many there are so deletions count too.
+
+    Taken over every post rather than just the page's, the indexed max stays cheap
+    for any tag, and unpublishing a post (which edits it) changes it as well.
+    Search results aren't validated, their matches would have to be found twice.
+    """
+    if request.GET.get('q'):
+        return None
+    updated = Post.objects.aggregate(latest=Max('updated'))['latest']
+    if updated is None:
+        return None
+    return updated, [updated, Post.objects.count()]
+
+
+def _validators(request, state, version_names, args, kwargs):
+    # a page showing a flash message is a one-off, it must not be reused later
+    if request.method not in ('GET', 'HEAD') or len(get_messages(request)):
+        return None
+    # the state only changes with the versions the page cache uses, so
+    # revalidating a cached page stays free of queries too
+    current = caching.versions(*version_names(*args, **kwargs), 'tags')
+    key = caching.make_key('state', request.get_full_path(), *sorted(current.items()))
+    found = cache.get(key)
+    if found is None:
+        found = (state(request, *args, **kwargs),)
+        if caching.settled(current):
+            cache.set(key, found, caching.timeout())
+    if found[0] is None:
+        return None
+    last_modified, parts = found[0]
+    # tag names are shown on both pages but don't touch the posts,
+    # and the page carries the reader's name, a copy cached under another login must not be reused
+    return last_modified, [*parts, current['tags'], request.user.pk]
+
+
+def _etag(request, parts):
+    # forms on the page carry a CSRF token tied to the reader's cookie
+    digest = hashlib.sha256(repr([*parts, request.META.get('CSRF_COOKIE')]).encode()).hexdigest()[:32]
+    return f'W/"{digest}"'
+
+
+def _not_modified(request, last_modified, parts):
+    return get_conditional_response(
+        request, etag=_etag(request, parts), last_modified=int(last_modified.timestamp()),
+    )
+
+
+def _finish(request, response, last_modified, parts):
+    if response.status_code in (200, 304):
+        # taken after the view, which may have handed out a new CSRF cookie
+        response.headers['ETag'] = _etag(request, parts)
+        response.headers['Last-Modified'] = http_date(int(last_modified.timestamp()))
+        # browsers check back every time, the page differs per reader
+        patch_cache_control(response, private=True, no_cache=True)
+        patch_vary_headers(response, ('Cookie',))
+    return response
+
+
+def conditional_page(state, version_names):
+    """
+    Answers a conditional GET with 304 Not Modified before the view runs, so
+    none of its queries, fragments or templates are touched.
+
+    ``state(request, *args, **kwargs)`` returns ``(last_modified, parts)``, or None
+    to skip validation. It is cached under the versions returned by
+    ``version_names(*args, **kwargs)``, like cache_page_for_readers(). The ETag covers the parts plus who is reading and their
+    CSRF cookie, so a cached copy is only reused by the reader it was rendered for.
+    Pages with pending flash messages and anything but GET and HEAD are left alone.
+    Works on both sync and async views.
+    """
+    def decorator(view):
+        if iscoroutinefunction(view):
+            @wraps(view)
+            async def async_wrapper(request, *args, **kwargs):
+                # messages and the reader may load the session, and state queries the database
+                current = await sync_to_async(_validators)(request, state, version_names, args, kwargs)
+                if current is None:
+                    return await view(request, *args, **kwargs)
+                response = _not_modified(request, *current)
+                if response is None:
+                    response = await view(request, *args, **kwargs)
+                return _finish(request, response, *current)
+            return async_wrapper
+
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            current = _validators(request, state, version_names, args, kwargs)
+            if current is None:
+                return view(request, *args, **kwargs)
+            response = _not_modified(request, *current)
+            if response is None:
+                response = view(request, *args, **kwargs)
+            return _finish(request, response, *current)
+        return wrapper
+    return decorator
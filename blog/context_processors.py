@@ -0,0 +1,10 @@
+from .caching import CSRF_PLACEHOLDER
+
+
+def cached_csrf(request):
+    """
+    Renders the CSRF token as a placeholder while a page is rendered for the page cache.
+    """
+    if getattr(request, 'blog_csrf_placeholder', False):
+        return {'csrf_token': CSRF_PLACEHOLDER}
+    return {}
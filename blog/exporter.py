@@ -0,0 +1,208 @@
+import csv
+import json
+import zlib
+from collections import defaultdict
+from datetime import timedelta
+from itertools import islice
+
+from django.contrib.contenttypes.models import ContentType
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import HttpResponse, StreamingHttpResponse
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from taggit.models import Tag, TaggedItem
+
+from .models import Comment, Post, Subscriber
+
+# rows fetched from the database at a time
+CHUNK_SIZE = 2000
+# output collected before it is handed on (and compressed), so the writes aren't one per row
+BUFFER_SIZE = 64 * 1024
+# the fastest level, about a fifth of the CPU of the default for a fifth more bytes
+GZIP_LEVEL = 1
+FORMATS = {'jsonl': 'application/x-ndjson', 'csv': 'text/csv'}
+# incremental exports reach this far back before their since watermark. A row is stamped when it
+# is saved but only seen once its transaction commits, which may be after the previous export ended
+WATERMARK_OVERLAP = timedelta(minutes=5)
+
+
+class Dataset:
+    """
+    A table that can be exported.
+
+    Attributes:
+        model: The model the rows come from.
+        columns (tuple): Names passed to values(), in the order CSV writes them.
+        watermark (str): The timestamp incremental exports filter on,
+            None for tables that are always exported whole.
+        renames (dict): Output names for columns that span relations.
+    """
+
+    def __init__(self, model, columns, watermark=None, renames=None):
+        self.model = model
+        self.columns = columns
+        self.watermark = watermark
+        self.renames = renames or {}
+
+    def header(self):
+        return [self.renames.get(column, column) for column in self.columns]
+
+    def queryset(self, since=None, until=None):
+        queryset = self.model.objects.order_by('pk')
+        if self.watermark and since is not None:
+            queryset = queryset.filter(**{f'{self.watermark}__gte': since - WATERMARK_OVERLAP})
+        if self.watermark and until is not None:
+            queryset = queryset.filter(**{f'{self.watermark}__lte': until})
+        return queryset.values(*self.columns)
+
+    def rows(self, values, chunk_size):
+        for row in values:
+            for column, name in self.renames.items():
+                row[name] = row.pop(column)
+            yield row
+
+
+class PostDataset(Dataset):
+    """
+    Posts with their tag names, in the shape import_posts reads back.
+    """
+
+    def header(self):
+        return super().header() + ['tags']
+
+    def rows(self, values, chunk_size):
+        content_type = ContentType.objects.get_for_model(Post)
+        values = super().rows(values, chunk_size)
+        # the tags of each chunk of posts in one query, like prefetch_related() with iterator()
+        while chunk := list(islice(values, chunk_size)):
+            names = defaultdict(list)
+            links = (
+                TaggedItem.objects.filter(content_type=content_type, object_id__in=[row['id'] for row in chunk])
+                .order_by('tag__name')
+                .values_list('object_id', 'tag__name')
+            )
+            for post_id, name in links:
+                names[post_id].append(name)
+            for row in chunk:
+                row['tags'] = names[row['id']]
+                yield row
+
+
+DATASETS = {
+    'posts': PostDataset(Post, (
+        'id', 'title', 'slug', 'author__username', 'status', 'body_format', 'publish',
+        'created', 'updated', 'word_count', 'body',
+    ), watermark='updated', renames={'author__username': 'author'}),
+    'comments': Dataset(Comment, (
+        'id', 'post_id', 'parent_id', 'name', 'email', 'body', 'active', 'created', 'updated',
+    ), watermark='updated'),
+    # subscribers are never edited, only added
+    'subscribers': Dataset(Subscriber, ('id', 'email', 'created'), watermark='created'),
+    'tags': Dataset(Tag, ('id', 'name', 'slug', 'stats__post_count'), renames={'stats__post_count': 'post_count'}),
+}
+
+
+def parse_since(value):
+    """
+    The aware datetime of a ``since`` watermark, None when it can't be read.
+    """
+    try:
+        moment = parse_datetime(value)
+    except ValueError:
+        return None
+    if moment is not None and timezone.is_naive(moment):
+        moment = timezone.make_aware(moment)
+    return moment
+
+
+def rows(name, since=None, until=None, chunk_size=CHUNK_SIZE):
+    """
+    Yields the rows of a dataset as dicts, in primary key order.
+
+    The rows are read with iterator(), a server-side cursor on PostgreSQL,
+    so only chunk_size of them are held in memory at once. With since and
+    until only rows changed in [since - WATERMARK_OVERLAP, until] are
+    exported. The overlap catches rows whose transaction committed after
+    the previous export, so consumers may see a row again and should
+    upsert on id. Deleted rows leave no trace, an incremental export never
+    removes anything.
+    """
+    dataset = DATASETS[name]
+    return dataset.rows(dataset.queryset(since, until).iterator(chunk_size=chunk_size), chunk_size)
+
+
+class _Echo:
+    # csv.writer writes to this and gets back the line it would have written
+    def write(self, value):
+        return value
+
+
+def encode(name, rows, export_format='jsonl'):
+    """
+    Yields the rows as lines of JSON Lines or CSV, CSV with a header first.
+    """
+    if export_format == 'jsonl':
+        for row in rows:
+            yield json.dumps(row, cls=DjangoJSONEncoder) + '\n'
+        return
+    writer = csv.writer(_Echo())
+    header = DATASETS[name].header()
+    yield writer.writerow(header)
+    for row in rows:
+        yield writer.writerow([
+            ','.join(value) if isinstance(value, list) else value
+            for value in (row[column] for column in header)
+        ])
+
+
+def stream(lines, compress=False, buffer_size=BUFFER_SIZE):
+    """
+    Joins lines into bytes of about buffer_size each, gzipped on the fly when compress is set.
+    """
+    compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, zlib.MAX_WBITS | 16) if compress else None
+    buffer, size = [], 0
+    for line in lines:
+        data = line.encode()
+        buffer.append(data)
+        size += len(data)
+        if size >= buffer_size:
+            data = b''.join(buffer)
+            buffer, size = [], 0
+            data = compressor.compress(data) if compressor else data
+            if data:
+                yield data
+    data = b''.join(buffer)
+    if compressor:
+        data = compressor.compress(data) + compressor.flush()
+    if data:
+        yield data
+
+
+def export_response(request, name):
+    """
+    Streams a dataset as a download.
+
+    Takes ``format`` (jsonl or csv), ``gzip=1`` and a ``since`` watermark from
+    the query string. The watermark to pass next time is sent in the
+    X-Export-Watermark header, it is fixed before the first row is read.
+    Rows changed shortly before since are sent again, see rows().
+    """
+    export_format = request.GET.get('format', 'jsonl')
+    if export_format not in FORMATS:
+        return HttpResponse('Unknown format.', status=400, content_type='text/plain')
+    since = None
+    if request.GET.get('since'):
+        since = parse_since(request.GET['since'])
+        if since is None:
+            return HttpResponse('Unreadable since.', status=400, content_type='text/plain')
+    compress = request.GET.get('gzip') in ('1', 'true')
+    until = timezone.now()
+
+    filename = f'{name}.{export_format}.gz' if compress else f'{name}.{export_format}'
+    content = stream(encode(name, rows(name, since, until), export_format), compress=compress)
+    response = StreamingHttpResponse(
+        content, content_type='application/gzip' if compress else FORMATS[export_format],
+    )
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    response['X-Export-Watermark'] = until.isoformat()
+    return response
@@ -0,0 +1,108 @@
+from io import StringIO
+
+from django.core.cache import cache
+from django.db.models import Max
+from django.http import HttpResponse, StreamingHttpResponse
+from django.urls import reverse
+from django.utils.feedgenerator import Atom1Feed, Rss201rev2Feed
+from django.utils.xmlutils import SimplerXMLGenerator
+
+from . import caching
+from .models import Post
+
+# newest posts in each feed
+FEED_ITEMS = 20
+SITE_TITLE = 'NACOS Blog'
+
+
+class StreamingFeedMixin:
+    """
+    Writes a feed one item at a time instead of building the whole document in memory.
+
+    Attributes:
+        closing (str): Markup closing the document, the items go just before it.
+        latest (datetime): Last change to the feed, the generators would otherwise take it from the items.
+    """
+
+    closing = ''
+    latest = None
+
+    def latest_post_date(self):
+        return self.latest or super().latest_post_date()
+
+    def stream(self, items):
+        """
+        Yields the document in pieces. items is an iterable of add_item() keyword arguments.
+        """
+        self.items = []
+        empty = self.writeString('utf-8')
+        yield empty[:-len(self.closing)]
+        for item in items:
+            self.items = []
+            self.add_item(**item)
+            buffer = StringIO()
+            self.write_items(SimplerXMLGenerator(buffer, 'utf-8', short_empty_elements=True))
+            yield buffer.getvalue()
+        yield self.closing
+
+
+class StreamingRssFeed(StreamingFeedMixin, Rss201rev2Feed):
+    closing = '</channel></rss>'
+
+
+class StreamingAtomFeed(StreamingFeedMixin, Atom1Feed):
+    closing = '</feed>'
+
+
+FEED_FORMATS = {'rss': StreamingRssFeed, 'atom': StreamingAtomFeed}
+
+
+def _items(posts, base):
+    for post in posts:
+        url = base + post.get_absolute_url()
+        yield {
+            'title': post.title,
+            'link': url,
+            'unique_id': url,
+            'description': post.excerpt,
+            'author_name': post.author.get_full_name() or post.author.username,
+            'pubdate': post.publish,
+            'updateddate': post.updated,
+            'categories': [tag.name for tag in post.tags.all()],
+        }
+
+
+def feed_response(request, feed_format, tag=None):
+    """
+    The newest published posts as an RSS or Atom feed, all of them or those with one tag.
+
+    Streamed from an iterator over the posts, and cached until a post or tag changes.
+    """
+    feed_class = FEED_FORMATS[feed_format]
+    current = caching.versions('posts', 'tags')
+    key = caching.make_key('feed', request.build_absolute_uri(), *sorted(current.items()))
+    content = cache.get(key)
+    if content is not None:
+        caching.record('feed', hit=True)
+        return HttpResponse(content, content_type=feed_class.content_type)
+    caching.record('feed', hit=False)
+
+    posts = Post.published.for_cards().order_by('-publish', '-id')
+    if tag is None:
+        title, link = SITE_TITLE, reverse('blog:post_list')
+    else:
+        posts = posts.tagged(tag).order_by('-tag_publish', '-tag_post')
+        title, link = f'{SITE_TITLE}: {tag.name}', reverse('blog:post_list_by_tag', args=[tag.slug])
+
+    base = request.build_absolute_uri('/').rstrip('/')
+    feed = feed_class(
+        title=title, link=base + link, feed_url=request.build_absolute_uri(),
+        description=f'The latest posts on {title}.', language='en',
+    )
+    # the newest change anywhere, a single index lookup
+    feed.latest = Post.objects.aggregate(latest=Max('updated'))['latest']
+    items = _items(posts[:FEED_ITEMS].iterator(chunk_size=FEED_ITEMS), base)
+    return StreamingHttpResponse(
+        caching.stream_and_store(key, feed.stream(items), caching.timeout()),
+        content_type=feed_class.content_type,
+    )
@@ -29,7 +29,13 @@ class CommentForm(forms.ModelForm):
     """
     class Meta:
         model = Comment
-        fields = ('name', 'email', 'body')
+        fields = ('name', 'email', 'body', 'parent')
+        widgets = {'parent': forms.HiddenInput}
+
+    def __init__(self, post, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # replies only to the visible comments of the same post
+        self.fields['parent'].queryset = post.comments.filter(active=True)
 
 
 # form for login
@@ -0,0 +1,164 @@
+import atexit
+import logging
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.db import connection, transaction
+from django.utils import timezone
+from PIL import Image, ImageOps
+
+from . import caching
+from .models import Post
+
+logger = logging.getLogger(__name__)
+
+VARIANT_DIR = 'images/blog/variants'
+FORMATS = {
+    'webp': ('WEBP', {'quality': 80, 'method': 4}),
+    'jpeg': ('JPEG', {'quality': 82, 'optimize': True, 'progressive': True}),
+}
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def widths():
+    return sorted(getattr(settings, 'BLOG_IMAGE_WIDTHS', [480, 960, 1600]))
+
+
+def formats():
+    return getattr(settings, 'BLOG_IMAGE_FORMATS', ['webp', 'jpeg'])
+
+
+def generate_variants(source_path, media_root, stem, target_widths, target_formats):
+    """
+    Writes resized copies of an image and returns their details.
+
+    Runs in a worker process, so it only touches the file system and Pillow.
+    Widths larger than the original are skipped, an original smaller than
+    every width still gets one copy per format at its own size.
+
+    Returns:
+        A (width, height, variants) tuple for the original and the list of variants,
+        each a dict with the storage name, format, width and height.
+    """
+    variants = []
+    with Image.open(source_path) as original:
+        image = ImageOps.exif_transpose(original)
+        width, height = image.size
+        sizes = [w for w in target_widths if w < width] or [width]
+
+        os.makedirs(os.path.join(media_root, VARIANT_DIR), exist_ok=True)
+        for target in sizes:
+            resized = image if target == width else image.resize(
+                (target, max(1, round(height * target / width))), Image.LANCZOS,
+            )
+            for fmt in target_formats:
+                pil_format, options = FORMATS[fmt]
+                frame = resized
+                if pil_format == 'JPEG' and frame.mode != 'RGB':
+                    # JPEG has no alpha, flatten transparent images onto white
+                    background = Image.new('RGB', frame.size, 'white')
+                    converted = frame.convert('RGBA')
+                    background.paste(converted, mask=converted.getchannel('A'))
+                    frame = background
+                elif frame.mode not in ('RGB', 'RGBA'):
+                    frame = frame.convert('RGBA' if 'A' in frame.getbands() else 'RGB')
+                name = f'{VARIANT_DIR}/{stem}-{target}.{fmt}'
+                frame.save(os.path.join(media_root, name), pil_format, **options)
+                variants.append({'name': name, 'format': fmt, 'width': frame.width, 'height': frame.height})
+    return width, height, variants
+
+
+def job_arguments(post):
+    """
+    Arguments for generate_variants() for a post's current image.
+    """
+    stem = f'{post.pk}-{os.path.splitext(os.path.basename(post.image.name))[0]}'
+    return (default_storage.path(post.image.name), str(settings.MEDIA_ROOT), stem, widths(), formats())
+
+
+def save_variants(post_id, image_name, result, old_variants):
+    """
+    Stores the generated variants on the post and deletes the files they replace.
+    Returns False if the post's image changed in the meantime, the variants are then discarded.
+    """
+    width, height, variants = result
+    updated = Post.objects.filter(pk=post_id, image=image_name).update(
+        image_width=width, image_height=height, image_variants=variants, updated=timezone.now(),
+    )
+    if updated:
+        keep = {variant['name'] for variant in variants}
+        stale = [variant for variant in old_variants if variant['name'] not in keep]
+        caching.bump('posts')
+    else:
+        stale = variants
+    for variant in stale:
+        default_storage.delete(variant['name'])
+    return bool(updated)
+
+
+def _get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ProcessPoolExecutor(max_workers=getattr(settings, 'BLOG_IMAGE_WORKERS', 2))
+            atexit.register(_executor.shutdown, wait=False)
+        return _executor
+
+
+def process_post(post):
+    """
+    Generates the variants of a post's image right away. Returns True on success.
+    """
+    try:
+        result = generate_variants(*job_arguments(post))
+    except (OSError, Image.DecompressionBombError) as exc:
+        logger.warning('Could not generate image variants for post %s: %s', post.pk, exc)
+        return False
+    return save_variants(post.pk, post.image.name, result, post.image_variants or [])
+
+
+def schedule(post):
+    """
+    Generates the variants of a post's image in the process pool once the
+    current transaction commits, so the upload request isn't held up.
+    With BLOG_IMAGE_WORKERS = 0 the work is done inline instead.
+    """
+    if not getattr(settings, 'BLOG_IMAGE_WORKERS', 2):
+        transaction.on_commit(lambda: process_post(post))
+        return
+
+    post_id, image_name, old_variants = post.pk, post.image.name, list(post.image_variants or [])
+
+    def submit():
+        future = _get_executor().submit(generate_variants, *job_arguments(post))
+        # saved from a short-lived thread, never from the request thread that submitted
+        future.add_done_callback(lambda done: threading.Thread(
+            target=_finish, args=(post_id, image_name, done, old_variants), daemon=True,
+        ).start())
+
+    transaction.on_commit(submit)
+
+
+def _finish(post_id, image_name, future, old_variants):
+    # runs on its own thread, which opens its own database connection
+    try:
+        save_variants(post_id, image_name, future.result(), old_variants)
+    except Exception:
+        logger.exception('Could not generate image variants for post %s', post_id)
+    finally:
+        connection.close()
+
+
+def clear(post):
+    """
+    Removes the variants of a post whose image was removed.
+    """
+    for variant in post.image_variants or []:
+        default_storage.delete(variant['name'])
+    Post.objects.filter(pk=post.pk).update(image_variants=[], image_width=None, image_height=None)
+    post.image_variants = []
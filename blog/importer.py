@@ -0,0 +1,314 @@
+import json
+import os
+from datetime import datetime
+
+from django.contrib.auth.models import User
+from django.contrib.contenttypes.models import ContentType
+from django.db import transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+from django.utils.text import slugify
+from taggit.models import Tag, TaggedItem
+
+from . import caching, moderation, sitemaps
+from .models import AuthorStats, Post
+
+SLUG_LENGTH = Post._meta.get_field('slug').max_length
+TAG_SLUG_LENGTH = Tag._meta.get_field('slug').max_length
+
+STATUSES = {
+    'published': Post.Status.PUBLISHED, 'publish': Post.Status.PUBLISHED, 'pb': Post.Status.PUBLISHED,
+    'draft': Post.Status.DRAFT, 'df': Post.Status.DRAFT,
+}
+FORMATS = {
+    'markdown': Post.BodyFormat.MARKDOWN, 'md': Post.BodyFormat.MARKDOWN,
+    'plain': Post.BodyFormat.PLAIN, 'text': Post.BodyFormat.PLAIN, 'pl': Post.BodyFormat.PLAIN,
+}
+
+
+class InvalidRecord(ValueError):
+    """
+    Raised for a record that can't be imported, with where it was read from.
+    """
+
+
+def _scalar(value):
+    value = value.strip()
+    if len(value) >= 2 and value[0] == value[-1] and value[0] in '"\'':
+        return value[1:-1]
+    return value
+
+
+def parse_front_matter(text):
+    """
+    Splits a Markdown file into (fields, body).
+
+    Understands the simple YAML front matter blogs export between ``---`` lines:
+    ``key: value`` pairs, quoted strings and lists written as ``[a, b]``
+    or as ``- item`` lines. Files without front matter are all body.
+    """
+    lines = text.lstrip('\ufeff').splitlines()
+    if not lines or lines[0].strip() != '---':
+        return {}, text
+    try:
+        end = next(i for i, line in enumerate(lines[1:], 1) if line.strip() in ('---', '...'))
+    except StopIteration:
+        raise InvalidRecord('front matter is never closed')
+
+    fields, key = {}, None
+    for line in lines[1:end]:
+        if not line.strip() or line.lstrip().startswith('#'):
+            continue
+        if line.lstrip().startswith('- ') and key is not None:
+            if not isinstance(fields[key], list):
+                fields[key] = []
+            fields[key].append(_scalar(line.lstrip()[2:]))
+            continue
+        if ':' not in line:
+            raise InvalidRecord(f'unreadable front matter line {line!r}')
+        key, value = line.split(':', 1)
+        key, value = key.strip().lower(), value.strip()
+        if value.startswith('[') and value.endswith(']'):
+            fields[key] = [_scalar(item) for item in value[1:-1].split(',') if item.strip()]
+        else:
+            fields[key] = _scalar(value)
+    return fields, '\n'.join(lines[end + 1:]).strip('\n')
+
+
+def read_markdown(directory):
+    """
+    Yields (where, fields) for each .md file in the directory tree, in a fixed order.
+    """
+    paths = []
+    for root, dirs, files in os.walk(directory):
+        dirs.sort()
+        paths += [os.path.join(root, name) for name in sorted(files) if name.endswith(('.md', '.markdown'))]
+    for path in paths:
+        with open(path, encoding='utf-8') as handle:
+            try:
+                fields, body = parse_front_matter(handle.read())
+            except InvalidRecord as exc:
+                raise InvalidRecord(f'{path}: {exc}')
+        fields['body'] = body
+        fields.setdefault('format', 'markdown')
+        if not fields.get('title'):
+            fields['title'] = os.path.splitext(os.path.basename(path))[0].replace('-', ' ').replace('_', ' ')
+        yield path, fields
+
+
+def read_jsonl(path):
+    """
+    Yields (where, fields) for each line of a JSON Lines file.
+    """
+    with open(path, encoding='utf-8') as handle:
+        for number, line in enumerate(handle, 1):
+            if not line.strip():
+                continue
+            try:
+                fields = json.loads(line)
+            except ValueError as exc:
+                raise InvalidRecord(f'{path}:{number}: {exc}')
+            if not isinstance(fields, dict):
+                raise InvalidRecord(f'{path}:{number}: expected an object')
+            yield f'{path}:{number}', {key.lower(): value for key, value in fields.items()}
+
+
+def read_source(source):
+    return read_markdown(source) if os.path.isdir(source) else read_jsonl(source)
+
+
+def _moment(value, where):
+    if not value:
+        return timezone.now()
+    if isinstance(value, datetime):
+        moment = value
+    else:
+        moment = parse_datetime(str(value))
+        if moment is None:
+            day = parse_date(str(value))
+            if day is None:
+                raise InvalidRecord(f'{where}: unreadable date {value!r}')
+            moment = datetime(day.year, day.month, day.day)
+    if timezone.is_naive(moment):
+        moment = timezone.make_aware(moment)
+    return moment
+
+
+def _tags(value):
+    if not value:
+        return []
+    if isinstance(value, str):
+        value = value.split(',')
+    names = []
+    for name in value:
+        name = str(name).strip()[:100]
+        if name and name not in names:
+            names.append(name)
+    return names
+
+
+class SlugIndex:
+    """
+    Every slug in use, so collisions are resolved in memory instead of by failed INSERTs.
+    Duplicates get the first free ``-2``, ``-3`` ... suffix, cut to fit the column.
+    """
+
+    def __init__(self, taken, length):
+        self.taken = set(taken)
+        self.length = length
+
+    def claim(self, wanted, fallback='post'):
+        base = slugify(wanted)[:self.length].strip('-') or fallback
+        slug, number = base, 1
+        while slug in self.taken:
+            number += 1
+            suffix = f'-{number}'
+            slug = base[:self.length - len(suffix)].rstrip('-') + suffix
+        self.taken.add(slug)
+        return slug
+
+
+class Importer:
+    """
+    Writes posts read by read_source() to the database in batches.
+
+    Each batch is one transaction: the posts with bulk_create, then any new
+    tags and the tagged item rows. Nothing goes through Post.save() or the
+    signals, finish() catches up on what they would have done.
+
+    Args:
+        default_author (User): Author of records that don't name one, or name an unknown user.
+        batch_size (int): Posts written per transaction.
+    """
+
+    def __init__(self, default_author=None, batch_size=500):
+        self.default_author = default_author
+        self.batch_size = batch_size
+        self.content_type = ContentType.objects.get_for_model(Post)
+        self.slugs = SlugIndex(Post.objects.values_list('slug', flat=True).iterator(), SLUG_LENGTH)
+        self.tag_slugs = SlugIndex(Tag.objects.values_list('slug', flat=True).iterator(), TAG_SLUG_LENGTH)
+        self.tag_ids = {}
+        self.author_ids = {}
+        # written by this run, None once it resumed an earlier one
+        self.post_ids = []
+
+    def build(self, where, fields):
+        """
+        Returns an unsaved Post, its author's username and its tag names for one record.
+        """
+        title = str(fields.get('title') or '').strip()
+        body = fields.get('body', fields.get('content'))
+        if not title or body is None:
+            raise InvalidRecord(f'{where}: a post needs a title and a body')
+        status = STATUSES.get(str(fields.get('status', 'published')).lower())
+        body_format = FORMATS.get(str(fields.get('format', fields.get('body_format', 'plain'))).lower())
+        if status is None or body_format is None:
+            raise InvalidRecord(f'{where}: unknown status or format')
+
+        post = Post(
+            title=title[:Post._meta.get_field('title').max_length],
+            slug=self.slugs.claim(fields.get('slug') or title),
+            body=str(body),
+            body_format=body_format,
+            status=status,
+            publish=_moment(fields.get('publish') or fields.get('date'), where),
+        )
+        # what save() would have filled in
+        post.render()
+        return post, str(fields.get('author') or ''), _tags(fields.get('tags'))
+
+    def _resolve_authors(self, batch, built):
+        wanted = {username for _, username, _ in built if username and username not in self.author_ids}
+        if wanted:
+            self.author_ids.update(User.objects.filter(username__in=wanted).values_list('username', 'id'))
+        for (where, _), (post, username, _) in zip(batch, built):
+            author_id = self.author_ids.get(username)
+            if author_id is None:
+                if self.default_author is None:
+                    raise InvalidRecord(f'{where}: unknown author {username!r}, pass a default author')
+                author_id = self.default_author.pk
+            post.author_id = author_id
+
+    def _resolve_tags(self, names):
+        missing = [name for name in names if name not in self.tag_ids]
+        if not missing:
+            return
+        self.tag_ids.update(Tag.objects.filter(name__in=missing).values_list('name', 'id'))
+        new = [
+            Tag(name=name, slug=self.tag_slugs.claim(name, fallback='tag'))
+            for name in missing if name not in self.tag_ids
+        ]
+        Tag.objects.bulk_create(new)
+        self.tag_ids.update(Tag.objects.filter(name__in=[tag.name for tag in new]).values_list('name', 'id'))
+
+    def write(self, batch):
+        """
+        Saves a batch of (where, fields) records in one transaction. Returns the number of posts.
+        """
+        built = [self.build(where, fields) for where, fields in batch]
+        self._resolve_authors(batch, built)
+        posts = [post for post, _, _ in built]
+        with transaction.atomic():
+            Post.objects.bulk_create(posts, batch_size=self.batch_size)
+            self._resolve_tags({name for _, _, names in built for name in names})
+            TaggedItem.objects.bulk_create([
+                TaggedItem(content_type=self.content_type, object_id=post.pk, tag_id=self.tag_ids[name])
+                for post, _, names in built for name in names
+            ], batch_size=self.batch_size)
+        if self.post_ids is not None:
+            self.post_ids += [post.pk for post in posts]
+        return len(posts)
+
+    def run(self, records, skip=0):
+        """
+        Imports the records after the first skip of them, a batch at a time.
+        Yields the number of records done so far after every committed batch.
+        """
+        done, batch = skip, []
+        if skip:
+            self.post_ids = None
+        for index, record in enumerate(records):
+            if index < skip:
+                continue
+            batch.append(record)
+            if len(batch) == self.batch_size:
+                done += self.write(batch)
+                batch = []
+                yield done
+        if batch:
+            done += self.write(batch)
+            yield done
+
+    def finish(self):
+        """
+        Catches up on what the signals would have kept up to date.
+        """
+        moderation.catch_up(self.post_ids)
+        # everything, a resumed run doesn't know which authors and months the earlier runs touched
+        AuthorStats.objects.update(stale=True)
+        sitemaps.bump(*sitemaps.months())
+        caching.bump('posts', 'tags')
+
+
+def load_checkpoint(path, source):
+    """
+    The number of records an earlier run of the same source committed, 0 without a checkpoint.
+    """
+    try:
+        with open(path) as handle:
+            checkpoint = json.load(handle)
+    except FileNotFoundError:
+        return 0
+    except ValueError:
+        raise InvalidRecord(f'{path}: unreadable checkpoint')
+    if checkpoint.get('source') != os.path.abspath(source):
+        raise InvalidRecord(f'{path}: checkpoint belongs to {checkpoint.get("source")}')
+    return int(checkpoint.get('done', 0))
+
+
+def save_checkpoint(path, source, done):
+    # written aside and renamed, a crash mid-write must not lose the old checkpoint
+    temporary = f'{path}.tmp'
+    with open(temporary, 'w') as handle:
+        json.dump({'source': os.path.abspath(source), 'done': done}, handle)
+    os.replace(temporary, path)
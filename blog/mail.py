@@ -0,0 +1,135 @@
+import logging
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.mail import EmailMessage, get_connection
+from django.db import transaction
+from django.utils import timezone
+
+from .models import OutboundEmail
+
+logger = logging.getLogger(__name__)
+
+# how long a worker may hold a claimed message before another worker retries it
+CLAIM_SECONDS = 300
+
+
+def enqueue(subject, message, recipient_list, from_email=None):
+    """
+    Queues an email for the send_queued_mail worker, with the same arguments as send_mail().
+    Returns the queued OutboundEmail.
+    """
+    return OutboundEmail.objects.create(
+        subject=subject,
+        body=message,
+        from_email=from_email or '',
+        to=','.join(recipient_list),
+    )
+
+
+async def aenqueue(subject, message, recipient_list, from_email=None):
+    """
+    Async version of enqueue() for async views.
+    """
+    return await OutboundEmail.objects.acreate(
+        subject=subject,
+        body=message,
+        from_email=from_email or '',
+        to=','.join(recipient_list),
+    )
+
+
+def retry_delay(attempts):
+    """
+    Exponential backoff: 1, 2, 4, 8 ... minutes after each failed attempt, capped at a day.
+    """
+    base = getattr(settings, 'MAIL_QUEUE_RETRY_DELAY', 60)
+    return timedelta(seconds=min(base * 2 ** (attempts - 1), 24 * 60 * 60))
+
+
+def claim_batch(batch_size):
+    """
+    Claims up to batch_size due messages for this worker.
+
+    Claimed messages get their next attempt pushed into the future,
+    so parallel workers skip them and a crashed worker's messages come back later.
+    """
+    now = timezone.now()
+    with transaction.atomic():
+        batch = list(
+            OutboundEmail.objects.select_for_update(skip_locked=True)
+            .filter(status=OutboundEmail.Status.QUEUED, next_attempt__lte=now)
+            .order_by('next_attempt', 'id')[:batch_size]
+        )
+        OutboundEmail.objects.filter(id__in=[email.id for email in batch]).update(
+            next_attempt=now + timedelta(seconds=CLAIM_SECONDS)
+        )
+    return batch
+
+
+def send_batch(batch, max_attempts=5, connection=None):
+    """
+    Sends the messages over a single SMTP connection and records each outcome.
+    Returns a (sent, failed) tuple with the number of messages in each state.
+    """
+    sent = failed = 0
+    connection = connection or get_connection()
+    try:
+        connection.open()
+    except Exception as exc:
+        # nothing can be delivered, every message is retried later
+        logger.warning('Could not connect to the mail server: %s', exc)
+        for email in batch:
+            _record_failure(email, exc, max_attempts)
+        return 0, len(batch)
+
+    try:
+        for email in batch:
+            message = EmailMessage(
+                subject=email.subject,
+                body=email.body,
+                from_email=email.from_email or None,
+                to=email.recipients,
+                connection=connection,
+            )
+            try:
+                message.send()
+            except Exception as exc:
+                logger.warning('Sending email %s failed: %s', email.pk, exc)
+                _record_failure(email, exc, max_attempts)
+                failed += 1
+            else:
+                email.status = OutboundEmail.Status.SENT
+                email.attempts += 1
+                email.sent = timezone.now()
+                email.last_error = ''
+                email.save(update_fields=['status', 'attempts', 'sent', 'last_error'])
+                sent += 1
+    finally:
+        connection.close()
+    return sent, failed
+
+
+def _record_failure(email, exc, max_attempts):
+    email.attempts += 1
+    email.last_error = str(exc)[:1000]
+    if email.attempts >= max_attempts:
+        email.status = OutboundEmail.Status.FAILED
+    else:
+        email.next_attempt = timezone.now() + retry_delay(email.attempts)
+    email.save(update_fields=['status', 'attempts', 'last_error', 'next_attempt'])
+
+
+def send_queued(batch_size=50, max_attempts=5):
+    """
+    Delivers every due message, one connection per batch.
+    Returns a (sent, failed) tuple for the whole run.
+    """
+    total_sent = total_failed = 0
+    while True:
+        batch = claim_batch(batch_size)
+        if not batch:
+            return total_sent, total_failed
+        sent, failed = send_batch(batch, max_attempts=max_attempts)
+        total_sent += sent
+        total_failed += failed
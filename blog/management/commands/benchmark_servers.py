@@ -0,0 +1,92 @@
+import json
+import os
+import shlex
+import subprocess
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+from django.urls import reverse
+
+from blog import benchmark
+from blog.models import Post
+
+SERVERS = {
+    # one process each, so the comparison is threads against the event loop
+    'wsgi': '{python} -m gunicorn config.wsgi:application --bind 127.0.0.1:{port} --workers 1 --threads {threads}',
+    'asgi': '{python} -m uvicorn config.asgi:application --host 127.0.0.1 --port {port} --workers 1 --no-access-log',
+}
+
+
+class Command(BaseCommand):
+    help = (
+        'Starts the site under a WSGI and an ASGI server in turn and compares '
+        'throughput and latency of the read views under concurrent load.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--servers', nargs='+', choices=sorted(SERVERS), default=['wsgi', 'asgi'])
+        parser.add_argument('--requests', type=int, default=2000,
+                            help='Requests sent to each page on each server.')
+        parser.add_argument('--concurrency', type=int, default=32,
+                            help='Number of clients sending requests at the same time.')
+        parser.add_argument('--threads', type=int, default=8,
+                            help='Threads of the WSGI worker.')
+        parser.add_argument('--port', type=int, default=8765)
+        parser.add_argument('--path', action='append', dest='paths',
+                            help='Page to load, may be repeated. Defaults to the post list and the latest post.')
+        parser.add_argument('--wsgi-command', help='Override the WSGI server command, {port} is filled in.')
+        parser.add_argument('--asgi-command', help='Override the ASGI server command, {port} is filled in.')
+        parser.add_argument('--json', action='store_true', help='Print the results as JSON.')
+
+    def handle(self, *args, **options):
+        if options['requests'] < 1 or options['concurrency'] < 1:
+            raise CommandError('--requests and --concurrency must be at least 1.')
+
+        paths = options['paths'] or self.default_paths()
+        results = {}
+        for name in options['servers']:
+            command = options[f'{name}_command'] or SERVERS[name]
+            command = command.format(python=shlex.quote(sys.executable), port=options['port'],
+                                     threads=options['threads'])
+            results[name] = self.bench_server(name, command, paths, options)
+
+        if options['json']:
+            self.stdout.write(json.dumps(results, indent=2))
+            return
+        for name, pages in results.items():
+            for path, summary in pages.items():
+                self.stdout.write(
+                    f'{name:5} {path:40} {summary["rps"]:>8} req/s  p50 {summary["p50_ms"]} ms  '
+                    f'p99 {summary["p99_ms"]} ms  errors {summary["errors"]}'
+                )
+
+    def default_paths(self):
+        paths = [reverse('blog:post_list')]
+        post = Post.published.only('id', 'slug', 'publish').first()
+        if post is not None:
+            paths.append(post.get_absolute_url())
+        return paths
+
+    def bench_server(self, name, command, paths, options):
+        self.stderr.write(f'Starting {name}: {command}')
+        # both servers need the project on the path and share this process's settings
+        process = subprocess.Popen(shlex.split(command), env=os.environ.copy(),
+                                   stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+        try:
+            if not benchmark.wait_for_port('127.0.0.1', options['port']):
+                process.kill()
+                raise CommandError(f'{name} did not start: {process.stderr.read().decode()[-2000:]}')
+
+            pages = {}
+            for path in paths:
+                url = f'http://127.0.0.1:{options["port"]}{path}'
+                # warm up connections, caches and lazy imports before measuring
+                benchmark.run_load(url, options['concurrency'] * 2, options['concurrency'])
+                pages[path] = benchmark.run_load(url, options['requests'], options['concurrency'])
+            return pages
+        finally:
+            process.terminate()
+            try:
+                process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                process.kill()
@@ -0,0 +1,84 @@
+import json
+import os
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from blog import exporter
+
+
+class Command(BaseCommand):
+    help = (
+        'Streams posts, comments, subscribers or tags as JSON Lines or CSV. '
+        'Pass --watermark to export only what changed since the last run.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('dataset', choices=sorted(exporter.DATASETS))
+        parser.add_argument('--format', choices=sorted(exporter.FORMATS), default='jsonl')
+        parser.add_argument('--output', default='-', help='File to write, - for stdout.')
+        parser.add_argument('--gzip', action='store_true', help='Compress the output, needs --output.')
+        parser.add_argument('--since', help='Only rows changed after this date and time.')
+        parser.add_argument('--watermark',
+                            help='JSON file remembering where each dataset was exported up to. '
+                                 'Read for --since and updated once the export has finished.')
+        parser.add_argument('--chunk-size', type=int, default=exporter.CHUNK_SIZE,
+                            help='Rows fetched from the database at a time.')
+
+    def handle(self, *args, **options):
+        dataset, output = options['dataset'], options['output']
+        if options['gzip'] and output == '-':
+            raise CommandError('--gzip needs --output.')
+        if options['chunk_size'] < 1:
+            raise CommandError('--chunk-size must be at least 1.')
+
+        marks = self.load_watermarks(options['watermark']) if options['watermark'] else {}
+        since = options['since'] or marks.get(dataset)
+        if since:
+            since = exporter.parse_since(since)
+            if since is None:
+                raise CommandError('Unreadable --since.')
+        until = timezone.now()
+
+        start, count = time.monotonic(), 0
+        rows = exporter.rows(dataset, since, until, chunk_size=options['chunk_size'])
+
+        def counted(rows):
+            nonlocal count
+            for row in rows:
+                count += 1
+                yield row
+
+        lines = exporter.encode(dataset, counted(rows), options['format'])
+        if output == '-':
+            for line in lines:
+                self.stdout.write(line, ending='')
+        else:
+            with open(output, 'wb') as handle:
+                for data in exporter.stream(lines, compress=options['gzip']):
+                    handle.write(data)
+
+        if options['watermark']:
+            marks[dataset] = until.isoformat()
+            self.save_watermarks(options['watermark'], marks)
+        elapsed = time.monotonic() - start
+        self.stderr.write(self.style.SUCCESS(
+            f'Exported {count} {dataset} rows in {elapsed:.1f}s ({count / (elapsed or 1):.0f} rows/s), '
+            f'up to {until.isoformat()}.'
+        ))
+
+    def load_watermarks(self, path):
+        try:
+            with open(path) as handle:
+                return json.load(handle)
+        except FileNotFoundError:
+            return {}
+        except ValueError:
+            raise CommandError(f'{path}: unreadable watermark file.')
+
+    def save_watermarks(self, path, marks):
+        # written aside and renamed, a crash mid-write must not lose the old watermarks
+        with open(f'{path}.tmp', 'w') as handle:
+            json.dump(marks, handle)
+        os.replace(f'{path}.tmp', path)
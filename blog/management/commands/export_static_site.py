@@ -0,0 +1,79 @@
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+from blog import static_site
+
+
+class Command(BaseCommand):
+    help = (
+        'Pre-renders the post list, every tag page and every post to HTML files '
+        'with .gz copies, re-rendering only the pages that changed since the last build.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--output', default=getattr(settings, 'BLOG_STATIC_SITE_ROOT', None),
+                            help='Directory the site is written to.')
+        parser.add_argument('--workers', type=int, default=os.cpu_count() or 1,
+                            help='Number of rendering processes, 0 renders in this process.')
+        parser.add_argument('--batch-size', type=int, default=50,
+                            help='Pages rendered per task sent to a worker.')
+        parser.add_argument('--full', action='store_true',
+                            help='Ignore the manifest and render every page, e.g. after a template change.')
+
+    def handle(self, *args, **options):
+        output_dir = self.output_dir = options['output']
+        if not output_dir:
+            raise CommandError('Set BLOG_STATIC_SITE_ROOT or pass --output.')
+        if options['batch_size'] < 1 or options['workers'] < 0:
+            raise CommandError('--batch-size must be at least 1 and --workers at least 0.')
+
+        start = time.monotonic()
+        previous = {} if options['full'] else static_site.load_manifest(output_dir)
+        jobs = static_site.plan()
+
+        stale = [key for key in previous if key not in jobs]
+        for key in stale:
+            static_site.remove_page(output_dir, previous[key]['files'])
+
+        # pages that are gone are dropped, the rest keep their entry until re-rendered
+        manifest = {key: entry for key, entry in previous.items() if key in jobs}
+        changed = [
+            (key, job) for key, job in jobs.items()
+            if manifest.get(key, {}).get('fingerprint') != job['fingerprint']
+            or manifest[key]['files'] != job['files']
+        ]
+        batches = [changed[i:i + options['batch_size']] for i in range(0, len(changed), options['batch_size'])]
+
+        try:
+            if options['workers'] == 0:
+                for batch in batches:
+                    self.record(manifest, static_site.render_batch(output_dir, batch))
+            else:
+                # workers are forked, they must open their own connections
+                connections.close_all()
+                with ProcessPoolExecutor(max_workers=options['workers']) as executor:
+                    futures = [executor.submit(static_site.render_batch, output_dir, batch) for batch in batches]
+                    for future in as_completed(futures):
+                        self.record(manifest, future.result())
+        finally:
+            # saved even after a failure, so the next run only redoes what is missing
+            static_site.save_manifest(output_dir, manifest)
+
+        elapsed = time.monotonic() - start
+        self.stdout.write(self.style.SUCCESS(
+            f'Rendered {len(changed)} of {len(jobs)} pages and removed {len(stale)} in {elapsed:.2f}s.'
+        ))
+
+    def record(self, manifest, done):
+        for key, job in done:
+            replaced = manifest.get(key)
+            manifest[key] = {'fingerprint': job['fingerprint'], 'files': job['files']}
+            # a page whose cursor changed leaves its old alias files behind
+            if replaced:
+                leftover = [name for name in replaced['files'] if name not in job['files']]
+                static_site.remove_page(self.output_dir, leftover)
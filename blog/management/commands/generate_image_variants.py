@@ -0,0 +1,54 @@
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from blog import images
+from blog.models import Post
+
+
+class Command(BaseCommand):
+    help = 'Generates the resized WebP/JPEG variants of existing post images.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--all', action='store_true',
+                            help='Regenerate every image, not only the ones without variants.')
+        parser.add_argument('--workers', type=int, default=getattr(settings, 'BLOG_IMAGE_WORKERS', 2) or 1,
+                            help='Number of processes resizing images.')
+
+    def handle(self, *args, **options):
+        posts = Post.objects.exclude(image='').only('id', 'image', 'image_variants').order_by('id')
+        if not options['all']:
+            posts = posts.filter(image_variants=[])
+
+        start = time.monotonic()
+        workers = max(1, options['workers'])
+        done = failed = 0
+        jobs = {}
+
+        def collect(finished):
+            nonlocal done, failed
+            for future in finished:
+                post = jobs.pop(future)
+                try:
+                    result = future.result()
+                except Exception as exc:
+                    self.stderr.write(f'Post {post.pk}: {exc}')
+                    failed += 1
+                    continue
+                if images.save_variants(post.pk, post.image.name, result, post.image_variants):
+                    done += 1
+
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            for post in posts.iterator(chunk_size=200):
+                jobs[executor.submit(images.generate_variants, *images.job_arguments(post))] = post
+                # a few images per process in flight, so memory stays flat on big archives
+                if len(jobs) >= workers * 4:
+                    collect(wait(jobs, return_when=FIRST_COMPLETED).done)
+            collect(wait(jobs).done)
+
+        elapsed = time.monotonic() - start
+        self.stdout.write(self.style.SUCCESS(
+            f'Generated variants for {done} images in {elapsed:.2f}s, {failed} failed.'
+        ))
@@ -0,0 +1,65 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.contrib.auth.models import User
+
+from blog import synthetic
+
+
+class Command(BaseCommand):
+    help = 'Fills the database with a deterministic synthetic dataset for benchmarks.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=200)
+        parser.add_argument('--posts', type=int, default=100_000)
+        parser.add_argument('--tags', type=int, default=300)
+        parser.add_argument('--comments', type=int, default=2_000_000)
+        parser.add_argument('--seed', type=int, default=42,
+                            help='The same seed and sizes always produce the same data.')
+        parser.add_argument('--published-ratio', type=float, default=0.9)
+        parser.add_argument('--batch-size', type=int, default=2000)
+        parser.add_argument('--clear', action='store_true',
+                            help='Delete the synthetic data of an earlier run first.')
+
+    def handle(self, *args, **options):
+        if min(options['users'], options['tags'], options['batch_size']) < 1:
+            raise CommandError('--users, --tags and --batch-size must be at least 1.')
+
+        if options['clear']:
+            removed = synthetic.clear()
+            self.stdout.write(f'Removed {removed} synthetic users and their posts.')
+        elif User.objects.filter(username__startswith=synthetic.USERNAME_PREFIX).exists():
+            raise CommandError('Synthetic data already exists, pass --clear to replace it.')
+
+        start = time.monotonic()
+        generator = synthetic.Generator(seed=options['seed'], batch_size=options['batch_size'])
+        author_ids = generator.users(options['users'])
+        tag_ids = generator.tags(options['tags'])
+
+        published, written, phase = [], 0, time.monotonic()
+        for count, ids in generator.posts(options['posts'], author_ids, tag_ids, options['published_ratio']):
+            written += count
+            published += ids
+            self.progress('posts', written, options['posts'], phase)
+        self.stdout.write('')
+
+        if options['comments'] and not published:
+            raise CommandError('No published posts to comment on, raise --published-ratio.')
+        written, phase = 0, time.monotonic()
+        for count in generator.comments(options['comments'], published):
+            written += count
+            self.progress('comments', written, options['comments'], phase)
+        self.stdout.write('')
+
+        indexed, pairs = generator.finish()
+        elapsed = time.monotonic() - start
+        self.stdout.write(self.style.SUCCESS(
+            f'Created {len(author_ids)} users, {options["posts"]} posts ({len(published)} published), '
+            f'{options["comments"]} comments; indexed {indexed} posts and {pairs} similar links '
+            f'in {elapsed:.1f}s.'
+        ))
+
+    def progress(self, name, done, total, start):
+        rate = done / ((time.monotonic() - start) or 1)
+        self.stdout.write(f'\r{name}: {done}/{total} ({rate:.0f}/s)', ending='')
+        self.stdout.flush()
@@ -0,0 +1,57 @@
+import time
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from blog import importer
+
+
+class Command(BaseCommand):
+    help = (
+        'Imports posts from a directory of Markdown files with front matter, or from a JSON Lines file. '
+        'Fields: title, body, slug, author (a username), publish, status, format and tags.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('source', help='A directory of .md files or a .jsonl file.')
+        parser.add_argument('--author', help='Username used for records without a known author.')
+        parser.add_argument('--batch-size', type=int, default=500, help='Posts written per transaction.')
+        parser.add_argument('--checkpoint',
+                            help='Records progress in this file after every batch, and resumes from it.')
+
+    def handle(self, *args, **options):
+        if options['batch_size'] < 1:
+            raise CommandError('--batch-size must be at least 1.')
+        default_author = None
+        if options['author']:
+            default_author = User.objects.filter(username=options['author']).first()
+            if default_author is None:
+                raise CommandError(f'No user named {options["author"]}.')
+
+        source, checkpoint = options['source'], options['checkpoint']
+        try:
+            skip = importer.load_checkpoint(checkpoint, source) if checkpoint else 0
+            if skip:
+                self.stdout.write(f'Resuming after {skip} records.')
+            run = importer.Importer(default_author=default_author, batch_size=options['batch_size'])
+            start, done = time.monotonic(), skip
+            for done in run.run(importer.read_source(source), skip=skip):
+                if checkpoint:
+                    importer.save_checkpoint(checkpoint, source, done)
+                self.progress(done - skip, start)
+        except (OSError, importer.InvalidRecord) as exc:
+            raise CommandError(str(exc))
+        self.stdout.write('')
+
+        imported, elapsed = done - skip, time.monotonic() - start
+        self.stdout.write('Updating the search index, similar posts and tag stats...')
+        run.finish()
+        self.stdout.write(self.style.SUCCESS(
+            f'Imported {imported} posts in {elapsed:.1f}s ({imported / (elapsed or 1):.0f} rows/s), '
+            f'finished in {time.monotonic() - start:.1f}s.'
+        ))
+
+    def progress(self, done, start):
+        rate = done / ((time.monotonic() - start) or 1)
+        self.stdout.write(f'\rposts: {done} ({rate:.0f}/s)', ending='')
+        self.stdout.flush()
@@ -0,0 +1,27 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from blog import search
+
+
+class Command(BaseCommand):
+    help = 'Rebuilds the full-text search index for all published posts.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500,
+                            help='Number of posts written to the index per batch.')
+
+    def handle(self, *args, **options):
+        if search.backend() is None:
+            self.stdout.write(self.style.WARNING(
+                'This database has no full-text search support, nothing to rebuild.'
+            ))
+            return
+
+        start = time.monotonic()
+        total = search.rebuild_index(batch_size=options['batch_size'])
+        elapsed = time.monotonic() - start
+        self.stdout.write(self.style.SUCCESS(
+            f'Indexed {total} posts in {elapsed:.2f}s ({search.backend()}).'
+        ))
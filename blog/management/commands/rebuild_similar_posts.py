@@ -0,0 +1,21 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from blog import similar
+
+
+class Command(BaseCommand):
+    help = 'Rebuilds the precomputed similar posts table for all published posts.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000,
+                            help='Number of post ids handled by each INSERT ... SELECT.')
+
+    def handle(self, *args, **options):
+        start = time.monotonic()
+        total = similar.rebuild(batch_size=options['batch_size'])
+        elapsed = time.monotonic() - start
+        self.stdout.write(self.style.SUCCESS(
+            f'Wrote {total} similar post links in {elapsed:.2f}s.'
+        ))
@@ -0,0 +1,21 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from blog import tagstats
+
+
+class Command(BaseCommand):
+    help = 'Rebuilds the per tag post counts and the tag page rows for all published posts.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000,
+                            help='Number of rows written per INSERT.')
+
+    def handle(self, *args, **options):
+        start = time.monotonic()
+        total = tagstats.rebuild(batch_size=options['batch_size'])
+        elapsed = time.monotonic() - start
+        self.stdout.write(self.style.SUCCESS(
+            f'Wrote {total} tagged post rows in {elapsed:.2f}s.'
+        ))
@@ -0,0 +1,43 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from blog import caching
+from blog.models import Post
+from blog.rendering import RENDERER_VERSION
+
+
+class Command(BaseCommand):
+    help = 'Re-renders the stored body html of posts rendered by an older renderer version.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--all', action='store_true',
+                            help='Re-render every post, not only the stale ones.')
+        parser.add_argument('--batch-size', type=int, default=500,
+                            help='Number of posts updated per query.')
+
+    def handle(self, *args, **options):
+        posts = Post.objects.only('id', 'body', 'body_format').order_by('id')
+        if not options['all']:
+            posts = posts.exclude(rendered_version=RENDERER_VERSION)
+
+        fields = ['body_html', 'rendered_version', 'word_count', 'reading_time', 'excerpt']
+        start = time.monotonic()
+        total = 0
+        batch = []
+        for post in posts.iterator(chunk_size=options['batch_size']):
+            post.render()
+            batch.append(post)
+            if len(batch) >= options['batch_size']:
+                Post.objects.bulk_update(batch, fields)
+                total += len(batch)
+                batch = []
+        if batch:
+            Post.objects.bulk_update(batch, fields)
+            total += len(batch)
+
+        if total:
+            # bulk_update sends no signals, drop the cached pages ourselves
+            caching.bump('posts')
+        elapsed = time.monotonic() - start
+        self.stdout.write(self.style.SUCCESS(f'Re-rendered {total} posts in {elapsed:.2f}s.'))
@@ -0,0 +1,146 @@
+import json
+import platform
+import subprocess
+import sys
+
+import django
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client, override_settings
+from django.utils import timezone
+
+from blog import benchmark
+from blog.models import Comment, Post
+
+# caches off, so every request measures the view itself
+NO_CACHE = {
+    'CACHES': {'default': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}},
+    'BLOG_PAGE_CACHE': False,
+}
+# the comment scenario posts far faster than any visitor may
+NO_RATELIMIT = {'BLOG_RATELIMIT_ENABLED': False}
+
+
+class Command(BaseCommand):
+    help = (
+        'Benchmarks the post list, a deep page, search, a tag page, a post with similar posts '
+        'and comment submission, reporting latency percentiles, queries per request and peak memory, '
+        'plus the time the rate limiter adds to each write.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=200, help='Timed requests per scenario.')
+        parser.add_argument('--samples', type=int, default=5,
+                            help='Extra requests per scenario measuring queries and memory.')
+        parser.add_argument('--scenario', action='append', dest='scenarios',
+                            help='Only run the named scenario, may be repeated.')
+        parser.add_argument('--cache', action='store_true',
+                            help='Keep the configured caches instead of measuring uncached views.')
+        parser.add_argument('--url', help='Load a running server at this base url instead of the test client.')
+        parser.add_argument('--concurrency', type=int, default=8, help='Clients used with --url.')
+        parser.add_argument('--output', help='Save the results as JSON to this file.')
+        parser.add_argument('--compare', help='Print the change against results saved by an earlier run.')
+
+    def handle(self, *args, **options):
+        if options['requests'] < 1:
+            raise CommandError('--requests must be at least 1.')
+
+        scenarios = benchmark.default_scenarios()
+        if options['scenarios']:
+            unknown = set(options['scenarios']) - {scenario.name for scenario in scenarios}
+            if unknown:
+                raise CommandError(f'Unknown scenarios: {", ".join(sorted(unknown))}')
+            scenarios = [scenario for scenario in scenarios if scenario.name in options['scenarios']]
+
+        results, overhead = {}, None
+        if options['url']:
+            base = options['url'].rstrip('/')
+            for scenario in scenarios:
+                if scenario.data is not None:
+                    # posts need a CSRF token from a server, only the test client can send them
+                    self.stderr.write(f'Skipping {scenario.name}, posts are only sent through the test client.')
+                    continue
+                results[scenario.name] = benchmark.run_load(
+                    base + scenario.path, options['requests'], options['concurrency'],
+                )
+                self.report(scenario.name, results[scenario.name])
+        else:
+            overrides = NO_RATELIMIT if options['cache'] else {**NO_CACHE, **NO_RATELIMIT}
+            with override_settings(**overrides):
+                client = Client(SERVER_NAME='localhost')
+                for scenario in scenarios:
+                    results[scenario.name] = benchmark.measure(
+                        client, scenario, options['requests'], samples=options['samples'],
+                    )
+                    self.report(scenario.name, results[scenario.name])
+            # what the limiter adds to each limited request, against the configured cache
+            overhead = benchmark.ratelimit_overhead()
+            self.stdout.write(
+                f'{"ratelimit_check":18} mean {overhead["mean_us"]} us  p50 {overhead["p50_us"]} us'
+                f'  p99 {overhead["p99_us"]} us'
+            )
+
+        run = {
+            'created': timezone.now().isoformat(),
+            'commit': self.commit(),
+            'python': platform.python_version(),
+            'django': django.get_version(),
+            'database': connection.vendor,
+            'target': options['url'] or 'test client',
+            'cache': bool(options['cache']),
+            'rows': {'posts': Post.objects.count(), 'comments': Comment.objects.count()},
+            'max_rss_kb': self.max_rss(),
+            'scenarios': results,
+            'ratelimit_check': overhead,
+        }
+        if options['output']:
+            with open(options['output'], 'w') as handle:
+                json.dump(run, handle, indent=2)
+            self.stdout.write(self.style.SUCCESS(f'Saved results to {options["output"]}.'))
+        if options['compare']:
+            self.compare(options['compare'], results)
+
+    def report(self, name, summary):
+        queries = '' if summary.get('queries') is None else f'  {summary["queries"]} queries'
+        memory = '' if summary.get('peak_kb') is None else f'  peak {summary["peak_kb"]} KiB'
+        self.stdout.write(
+            f'{name:18} p50 {summary["p50_ms"]} ms  p95 {summary["p95_ms"]} ms  p99 {summary["p99_ms"]} ms'
+            f'{queries}{memory}  errors {summary["errors"]}'
+        )
+
+    def compare(self, path, results):
+        try:
+            with open(path) as handle:
+                previous = json.load(handle)['scenarios']
+        except (OSError, ValueError, KeyError) as exc:
+            raise CommandError(f'Could not read {path}: {exc}')
+        self.stdout.write(f'Change against {path}:')
+        for name, summary in results.items():
+            if name not in previous:
+                continue
+            changes = []
+            for metric in ('p50_ms', 'p99_ms', 'queries', 'peak_kb'):
+                before, after = previous[name].get(metric), summary.get(metric)
+                if before and after is not None:
+                    changes.append(f'{metric} {(after - before) / before:+.1%}')
+            self.stdout.write(f'{name:18} {"  ".join(changes)}')
+
+    def commit(self):
+        try:
+            return subprocess.run(
+                ['git', 'rev-parse', '--short', 'HEAD'], cwd=settings.BASE_DIR,
+                capture_output=True, text=True, check=True,
+            ).stdout.strip()
+        except (OSError, subprocess.CalledProcessError):
+            return None
+
+    def max_rss(self):
+        try:
+            import resource
+        except ImportError:
+            # not available on Windows
+            return None
+        usage = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # bytes on macOS, kilobytes elsewhere
+        return usage // 1024 if sys.platform == 'darwin' else usage
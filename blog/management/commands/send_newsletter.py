@@ -0,0 +1,46 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from blog import newsletter as newsletters
+from blog.models import Newsletter
+
+
+class Command(BaseCommand):
+    help = 'Sends the digest of recent posts to every subscriber, resuming an unfinished newsletter first.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--subject', default='This week on the NACOS Blog',
+                            help='Subject of a new newsletter.')
+        parser.add_argument('--days', type=int, default=7,
+                            help='Include posts published in the last number of days.')
+        parser.add_argument('--chunk-size', type=int, default=100,
+                            help='Recipients handed to a sending thread at a time.')
+        parser.add_argument('--workers', type=int, default=4,
+                            help='Number of sending threads, each with its own connection.')
+        parser.add_argument('--new', action='store_true',
+                            help='Start a new newsletter even if the last one is unfinished.')
+
+    def handle(self, *args, **options):
+        if options['chunk_size'] < 1 or options['workers'] < 1:
+            raise CommandError('--chunk-size and --workers must be at least 1.')
+
+        newsletter = None
+        if not options['new']:
+            newsletter = Newsletter.objects.filter(finished__isnull=True).first()
+        if newsletter is None:
+            newsletter = newsletters.create_newsletter(options['subject'], days=options['days'])
+            self.stdout.write(f'Created newsletter "{newsletter}".')
+        else:
+            self.stdout.write(f'Resuming newsletter "{newsletter}".')
+
+        start = time.monotonic()
+        sent, failed = newsletters.dispatch(
+            newsletter, chunk_size=options['chunk_size'], workers=options['workers'],
+        )
+        elapsed = time.monotonic() - start
+        message = f'Sent to {sent} subscribers in {elapsed:.2f}s, {failed} failed.'
+        if failed:
+            self.stdout.write(self.style.WARNING(message + ' Run the command again to retry them.'))
+        else:
+            self.stdout.write(self.style.SUCCESS(message))
@@ -0,0 +1,31 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from blog import mail
+
+
+class Command(BaseCommand):
+    help = 'Delivers queued outbound emails, reusing one SMTP connection per batch.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=50,
+                            help='Number of messages sent over each SMTP connection.')
+        parser.add_argument('--max-attempts', type=int, default=5,
+                            help='Attempts before a message is marked as failed.')
+        parser.add_argument('--loop', action='store_true',
+                            help='Keep polling the queue instead of exiting when it is empty.')
+        parser.add_argument('--interval', type=float, default=5.0,
+                            help='Seconds to wait between polls with --loop.')
+
+    def handle(self, *args, **options):
+        while True:
+            sent, failed = mail.send_queued(
+                batch_size=options['batch_size'],
+                max_attempts=options['max_attempts'],
+            )
+            if sent or failed or not options['loop']:
+                self.stdout.write(f'Sent {sent} emails, {failed} failed.')
+            if not options['loop']:
+                return
+            time.sleep(options['interval'])
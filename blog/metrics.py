@@ -0,0 +1,238 @@
+import bisect
+import contextvars
+import logging
+import threading
+import time
+
+from django.template.backends.django import DjangoTemplates
+
+slow_logger = logging.getLogger('blog.metrics.slow')
+
+# upper bounds of the histogram buckets, +Inf is implied
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100, 200)
+SIZE_BUCKETS = (1_000, 5_000, 10_000, 50_000, 100_000, 500_000, 1_000_000, 5_000_000)
+
+# most queries kept for the slow request log
+SLOW_LOG_QUERIES = 50
+
+# the request being measured in the current thread or task
+_current = contextvars.ContextVar('blog_metrics_request', default=None)
+
+
+class Histogram:
+    """
+    A Prometheus style histogram: cumulative bucket counts, a sum and a count.
+    """
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative(self):
+        total = 0
+        for bound, count in zip((*self.buckets, '+Inf'), self.counts):
+            total += count
+            yield bound, total
+
+
+class Registry:
+    """
+    The metrics of this process, per view and method.
+
+    Each worker process keeps its own, like the page cache hit counters.
+    """
+
+    HISTOGRAMS = {
+        'blog_request_duration_seconds': ('Wall time of each request.', DURATION_BUCKETS),
+        'blog_db_queries': ('SQL queries run by each request.', QUERY_BUCKETS),
+        'blog_db_duration_seconds': ('Time spent in SQL queries by each request.', DURATION_BUCKETS),
+        'blog_template_render_seconds': (
+            'Time spent rendering templates by each request, including queries run while rendering.',
+            DURATION_BUCKETS,
+        ),
+        'blog_response_size_bytes': ('Size of each response body.', SIZE_BUCKETS),
+    }
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.histograms = {name: {} for name in self.HISTOGRAMS}
+            self.requests = {}
+            self.rejections = {}
+
+    def record(self, view, method, status, values):
+        """
+        Adds one request. values maps histogram names to what was measured, None skips one.
+        """
+        with self.lock:
+            key = (view, method, str(status))
+            self.requests[key] = self.requests.get(key, 0) + 1
+            for name, value in values.items():
+                if value is None:
+                    continue
+                series = self.histograms[name]
+                if (view, method) not in series:
+                    series[view, method] = Histogram(self.HISTOGRAMS[name][1])
+                series[view, method].observe(value)
+
+    def record_rejection(self, scope):
+        """
+        Adds one request turned away by the rate limiter.
+        """
+        with self.lock:
+            self.rejections[scope] = self.rejections.get(scope, 0) + 1
+
+    def render(self):
+        """
+        Returns every metric in the Prometheus text exposition format.
+        """
+        lines = [
+            '# HELP blog_requests_total Requests handled, by view, method and status.',
+            '# TYPE blog_requests_total counter',
+        ]
+        with self.lock:
+            for (view, method, status), count in sorted(self.requests.items()):
+                lines.append(f'blog_requests_total{_labels(view=view, method=method, status=status)} {count}')
+            for name, (help_text, _) in self.HISTOGRAMS.items():
+                lines += [f'# HELP {name} {help_text}', f'# TYPE {name} histogram']
+                for (view, method), histogram in sorted(self.histograms[name].items()):
+                    for bound, count in histogram.cumulative():
+                        labels = _labels(view=view, method=method, le=bound)
+                        lines.append(f'{name}_bucket{labels} {count}')
+                    labels = _labels(view=view, method=method)
+                    lines.append(f'{name}_sum{labels} {histogram.sum:g}')
+                    lines.append(f'{name}_count{labels} {histogram.count}')
+            lines += [
+                '# HELP blog_ratelimit_rejections_total Requests answered with 429 by the rate limiter, by scope.',
+                '# TYPE blog_ratelimit_rejections_total counter',
+            ]
+            for scope, count in sorted(self.rejections.items()):
+                lines.append(f'blog_ratelimit_rejections_total{_labels(scope=scope)} {count}')
+        return '\n'.join(lines) + '\n'
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(**labels):
+    return '{' + ','.join(f'{key}="{_escape(value)}"' for key, value in labels.items()) + '}'
+
+
+registry = Registry()
+
+
+class RequestMetrics:
+    """
+    What one request spent its time on, filled in while it runs.
+
+    Attributes:
+        queries (int): Number of SQL queries.
+        query_time (float): Seconds spent in SQL.
+        template_time (float): Seconds spent rendering templates.
+        statements (list): (seconds, sql) of the queries, only kept for the slow request log.
+    """
+
+    def __init__(self, keep_statements=False):
+        self.queries = 0
+        self.query_time = 0.0
+        self.template_time = 0.0
+        self.keep_statements = keep_statements
+        self.statements = []
+
+    def add_query(self, sql, seconds):
+        self.queries += 1
+        self.query_time += seconds
+        if self.keep_statements and len(self.statements) < SLOW_LOG_QUERIES:
+            self.statements.append((seconds, sql))
+
+
+def start_request(keep_statements=False):
+    """
+    Starts measuring the current request. Returns the RequestMetrics and a token for finish_request().
+    """
+    metrics = RequestMetrics(keep_statements)
+    return metrics, _current.set(metrics)
+
+
+def finish_request(token):
+    _current.reset(token)
+
+
+def record_query(execute, sql, params, many, context):
+    """
+    Execute wrapper timing every query run while a request is being measured.
+    Installed on each database connection as it is created.
+    """
+    metrics = _current.get()
+    if metrics is None:
+        return execute(sql, params, many, context)
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        metrics.add_query(sql, time.perf_counter() - start)
+
+
+def install(connection):
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_query)
+
+
+class TimedTemplate:
+    """
+    Wraps a Django template to add its render time to the current request.
+    """
+
+    def __init__(self, template):
+        self.template = template
+
+    def __getattr__(self, name):
+        return getattr(self.template, name)
+
+    def render(self, context=None, request=None):
+        metrics = _current.get()
+        if metrics is None:
+            return self.template.render(context, request)
+        start = time.perf_counter()
+        try:
+            return self.template.render(context, request)
+        finally:
+            metrics.template_time += time.perf_counter() - start
+
+
+class TimedDjangoTemplates(DjangoTemplates):
+    """
+    The Django template backend, timing every template rendered through it.
+    Included templates render inside their parent, so they are not counted twice.
+    """
+
+    def from_string(self, template_code):
+        return TimedTemplate(super().from_string(template_code))
+
+    def get_template(self, template_name):
+        return TimedTemplate(super().get_template(template_name))
+
+
+def log_slow_request(request, view, duration, metrics):
+    """
+    Logs a request over the slow request threshold with its slowest queries.
+    """
+    statements = sorted(metrics.statements, reverse=True)
+    slow_logger.warning(
+        'Slow request %s %s (%s) took %.1f ms: %d queries in %.1f ms, templates %.1f ms\n%s',
+        request.method, request.get_full_path(), view, duration * 1000,
+        metrics.queries, metrics.query_time * 1000, metrics.template_time * 1000,
+        '\n'.join(f'  {seconds * 1000:.1f} ms  {sql}' for seconds, sql in statements),
+    )
@@ -0,0 +1,110 @@
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+
+from . import metrics, routing
+
+
+class MetricsMiddleware:
+    """
+    Records the wall time, SQL queries, template time and response size of every request,
+    labelled with the name of the view it resolved to. See blog/metrics.py.
+
+    Goes first in MIDDLEWARE so the time spent in the other middleware counts too.
+    Requests slower than BLOG_SLOW_REQUEST_MS are logged with their queries.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        measured, token = self.start()
+        start = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            metrics.finish_request(token)
+        self.finish(request, response, time.perf_counter() - start, measured)
+        return response
+
+    async def __acall__(self, request):
+        measured, token = self.start()
+        start = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            metrics.finish_request(token)
+        self.finish(request, response, time.perf_counter() - start, measured)
+        return response
+
+    def start(self):
+        # the SQL text is only kept when something may log it
+        return metrics.start_request(keep_statements=settings.BLOG_SLOW_REQUEST_MS is not None)
+
+    def finish(self, request, response, duration, measured):
+        match = getattr(request, 'resolver_match', None)
+        view = match.view_name if match else '<unresolved>'
+        # streamed bodies aren't read here, that would consume them
+        size = None if response.streaming else len(response.content)
+        metrics.registry.record(view, request.method, response.status_code, {
+            'blog_request_duration_seconds': duration,
+            'blog_db_queries': measured.queries,
+            'blog_db_duration_seconds': measured.query_time,
+            'blog_template_render_seconds': measured.template_time,
+            'blog_response_size_bytes': size,
+        })
+        threshold = settings.BLOG_SLOW_REQUEST_MS
+        if threshold is not None and duration * 1000 >= threshold:
+            metrics.log_slow_request(request, view, duration, measured)
+
+
+class ReplicaRoutingMiddleware:
+    """
+    Tracks the database reads and writes of each request for ReplicaRouter, see blog/routing.py.
+
+    A request that writes sets a short-lived cookie, so the pages the reader
+    sees next are read from the primary until the replicas have caught up.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        current, token = routing.start_request(pinned=routing.PRIMARY_COOKIE in request.COOKIES)
+        try:
+            response = self.get_response(request)
+        finally:
+            routing.finish_request(token)
+        return self.finish(response, current)
+
+    async def __acall__(self, request):
+        current, token = routing.start_request(pinned=routing.PRIMARY_COOKIE in request.COOKIES)
+        try:
+            response = await self.get_response(request)
+        finally:
+            routing.finish_request(token)
+        return self.finish(response, current)
+
+    def finish(self, response, current):
+        if current.wrote and routing.replicas():
+            response.set_cookie(
+                routing.PRIMARY_COOKIE, '1', max_age=routing.max_lag(), httponly=True, samesite='Lax',
+            )
+        return response
@@ -0,0 +1,67 @@
+from django.db import migrations
+
+
+SQLITE_TAGS = """
+    SELECT group_concat(taggit_tag.name, ' ')
+    FROM taggit_taggeditem
+    JOIN taggit_tag ON taggit_tag.id = taggit_taggeditem.tag_id
+    JOIN django_content_type ON django_content_type.id = taggit_taggeditem.content_type_id
+    WHERE django_content_type.app_label = 'blog' AND django_content_type.model = 'post'
+      AND taggit_taggeditem.object_id = blog_post.id
+"""
+
+POSTGRES_TAGS = SQLITE_TAGS.replace("group_concat(taggit_tag.name, ' ')", "string_agg(taggit_tag.name, ' ')")
+
+
+def create_search_index(apps, schema_editor):
+    """
+    Creates the full-text index for posts and fills it with the published posts.
+    SQLite gets an FTS5 virtual table, Postgres a weighted tsvector column with a GIN index.
+    """
+    vendor = schema_editor.connection.vendor
+    if vendor == 'sqlite':
+        schema_editor.execute(
+            "CREATE VIRTUAL TABLE blog_post_fts USING fts5(title, tags, body, tokenize='porter unicode61')"
+        )
+        schema_editor.execute(
+            f"""
+            INSERT INTO blog_post_fts (rowid, title, tags, body)
+            SELECT id, title, coalesce(({SQLITE_TAGS}), ''), body FROM blog_post WHERE status = 'PB'
+            """
+        )
+    elif vendor == 'postgresql':
+        schema_editor.execute('ALTER TABLE blog_post ADD COLUMN search_vector tsvector')
+        schema_editor.execute(
+            'CREATE INDEX blog_post_search_vector_idx ON blog_post USING GIN (search_vector)'
+        )
+        schema_editor.execute(
+            f"""
+            UPDATE blog_post SET search_vector =
+                setweight(to_tsvector('english', title), 'A') ||
+                setweight(to_tsvector('english', coalesce(({POSTGRES_TAGS}), '')), 'B') ||
+                setweight(to_tsvector('english', body), 'C')
+            WHERE status = 'PB'
+            """
+        )
+
+
+def drop_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'sqlite':
+        schema_editor.execute('DROP TABLE IF EXISTS blog_post_fts')
+    elif vendor == 'postgresql':
+        schema_editor.execute('DROP INDEX IF EXISTS blog_post_search_vector_idx')
+        schema_editor.execute('ALTER TABLE blog_post DROP COLUMN IF EXISTS search_vector')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blog', '0008_subscriber'),
+        ('taggit', '0006_rename_taggeditem_content_type_object_id_taggit_tagg_content_8fc721_idx'),
+        ('contenttypes', '0002_remove_content_type_name'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -0,0 +1,34 @@
+from django.db import migrations
+from django.utils.text import Truncator
+
+WORDS_PER_MINUTE = 200
+EXCERPT_WORDS = 30
+
+
+def backfill_body_stats(apps, schema_editor):
+    """
+    Fills word_count, reading_time and excerpt for posts saved before the columns existed.
+    """
+    Post = apps.get_model('blog', 'Post')
+    batch = []
+    for post in Post.objects.only('id', 'body').iterator(chunk_size=500):
+        post.word_count = len(post.body.split())
+        post.reading_time = max(1, post.word_count // WORDS_PER_MINUTE)
+        post.excerpt = Truncator(post.body).words(EXCERPT_WORDS, truncate=' …')
+        batch.append(post)
+        if len(batch) >= 500:
+            Post.objects.bulk_update(batch, ['word_count', 'reading_time', 'excerpt'])
+            batch = []
+    if batch:
+        Post.objects.bulk_update(batch, ['word_count', 'reading_time', 'excerpt'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blog', '0010_post_word_count_reading_time_excerpt'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_body_stats, migrations.RunPython.noop),
+    ]
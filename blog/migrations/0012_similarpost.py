@@ -0,0 +1,28 @@
+# Generated by Django 5.2 on 2026-10-18 11:08
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blog', '0011_backfill_post_body_stats'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SimilarPost',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('score', models.PositiveIntegerField()),
+                ('publish', models.DateTimeField()),
+                ('post', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='similar_links', to='blog.post')),
+                ('similar', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='similar_of', to='blog.post')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['post', '-score', '-publish'], name='blog_simila_post_id_ca99dd_idx')],
+                'constraints': [models.UniqueConstraint(fields=('post', 'similar'), name='unique_similar_post')],
+            },
+        ),
+    ]
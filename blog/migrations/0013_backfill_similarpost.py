@@ -0,0 +1,27 @@
+from django.db import migrations
+
+BACKFILL_SQL = """
+    INSERT INTO blog_similarpost (post_id, similar_id, score, publish)
+    SELECT a.object_id, b.object_id, COUNT(*), similar.publish
+    FROM taggit_taggeditem a
+    JOIN taggit_taggeditem b
+        ON b.tag_id = a.tag_id AND b.content_type_id = a.content_type_id AND b.object_id <> a.object_id
+    JOIN django_content_type ct ON ct.id = a.content_type_id
+    JOIN blog_post post ON post.id = a.object_id
+    JOIN blog_post similar ON similar.id = b.object_id
+    WHERE ct.app_label = 'blog' AND ct.model = 'post' AND post.status = 'PB' AND similar.status = 'PB'
+    GROUP BY a.object_id, b.object_id, similar.publish
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blog', '0012_similarpost'),
+        ('taggit', '0006_rename_taggeditem_content_type_object_id_taggit_tagg_content_8fc721_idx'),
+        ('contenttypes', '0002_remove_content_type_name'),
+    ]
+
+    operations = [
+        migrations.RunSQL(BACKFILL_SQL, 'DELETE FROM blog_similarpost'),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 5.2 on 2026-10-18 11:12
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blog', '0013_backfill_similarpost'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OutboundEmail',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('subject', models.CharField(max_length=255)),
+                ('body', models.TextField()),
+                ('from_email', models.CharField(blank=True, max_length=254)),
+                ('to', models.TextField()),
+                ('status', models.CharField(choices=[('QU', 'Queued'), ('SE', 'Sent'), ('FA', 'Failed')], default='QU', max_length=2)),
+                ('attempts', models.PositiveIntegerField(default=0)),
+                ('next_attempt', models.DateTimeField(default=django.utils.timezone.now)),
+                ('last_error', models.TextField(blank=True)),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('sent', models.DateTimeField(blank=True, null=True)),
+            ],
+            options={
+                'ordering': ['created'],
+                'indexes': [models.Index(fields=['status', 'next_attempt'], name='blog_outbou_status_f5c9e8_idx')],
+            },
+        ),
+    ]
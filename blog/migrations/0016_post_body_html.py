@@ -0,0 +1,28 @@
+# Generated by Django 5.2 on 2026-10-18 11:15
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blog', '0015_newsletter'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='post',
+            name='body_format',
+            field=models.CharField(choices=[('PL', 'Plain text'), ('MD', 'Markdown')], default='PL', max_length=2),
+        ),
+        migrations.AddField(
+            model_name='post',
+            name='body_html',
+            field=models.TextField(blank=True, editable=False),
+        ),
+        migrations.AddField(
+            model_name='post',
+            name='rendered_version',
+            field=models.PositiveSmallIntegerField(default=0, editable=False),
+        ),
+    ]
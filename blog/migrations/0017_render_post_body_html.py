@@ -0,0 +1,48 @@
+import html
+
+from django.db import migrations
+from django.utils.html import linebreaks, strip_tags
+from django.utils.text import Truncator
+
+WORDS_PER_MINUTE = 200
+EXCERPT_WORDS = 30
+# the renderer as of this migration, a later version is picked up by `rerender_posts`
+RENDERER_VERSION = 1
+
+
+def render_existing_posts(apps, schema_editor):
+    """
+    Renders body_html for posts saved before the column existed.
+
+    They are all plain text, body_format was only added in 0016, and this is
+    what render_body() made of plain text at version 1: line breaks with the
+    text escaped as the sanitiser escapes it. Copied here so the migration
+    doesn't follow the live renderer.
+    """
+    Post = apps.get_model('blog', 'Post')
+    fields = ['body_html', 'rendered_version', 'word_count', 'reading_time', 'excerpt']
+    batch = []
+    for post in Post.objects.only('id', 'body').iterator(chunk_size=500):
+        post.body_html = linebreaks(html.escape(post.body, quote=False))
+        post.rendered_version = RENDERER_VERSION
+        text = html.unescape(strip_tags(post.body_html))
+        post.word_count = len(text.split())
+        post.reading_time = max(1, post.word_count // WORDS_PER_MINUTE)
+        post.excerpt = Truncator(text).words(EXCERPT_WORDS, truncate=' …')
+        batch.append(post)
+        if len(batch) >= 500:
+            Post.objects.bulk_update(batch, fields)
+            batch = []
+    if batch:
+        Post.objects.bulk_update(batch, fields)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blog', '0016_post_body_html'),
+    ]
+
+    operations = [
+        migrations.RunPython(render_existing_posts, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,40 @@
+# Generated by Django 5.2 on 2026-10-18 12:16
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blog', '0019_conditional_get_indexes'),
+        ('taggit', '0006_rename_taggeditem_content_type_object_id_taggit_tagg_content_8fc721_idx'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TagStats',
+            fields=[
+                ('tag', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='stats', serialize=False, to='taggit.tag')),
+                ('post_count', models.PositiveIntegerField(default=0)),
+                ('latest_publish', models.DateTimeField(blank=True, null=True)),
+            ],
+            options={
+                'verbose_name_plural': 'tag stats',
+                'indexes': [models.Index(fields=['-post_count'], name='blog_tagsta_post_co_9c2422_idx')],
+            },
+        ),
+        migrations.CreateModel(
+            name='TagPost',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('publish', models.DateTimeField()),
+                ('post', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='tag_links', to='blog.post')),
+                ('tag', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='published_links', to='taggit.tag')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['tag', '-publish', '-post'], name='blog_tagpos_tag_id_af9ece_idx')],
+                'constraints': [models.UniqueConstraint(fields=('post', 'tag'), name='unique_tag_post')],
+            },
+        ),
+    ]
@@ -0,0 +1,28 @@
+from django.db import migrations
+
+BACKFILL_TAGPOST_SQL = """
+    INSERT INTO blog_tagpost (tag_id, post_id, publish)
+    SELECT item.tag_id, post.id, post.publish
+    FROM taggit_taggeditem item
+    JOIN django_content_type ct ON ct.id = item.content_type_id
+    JOIN blog_post post ON post.id = item.object_id
+    WHERE ct.app_label = 'blog' AND ct.model = 'post' AND post.status = 'PB'
+"""
+
+BACKFILL_TAGSTATS_SQL = """
+    INSERT INTO blog_tagstats (tag_id, post_count, latest_publish)
+    SELECT tag_id, COUNT(*), MAX(publish) FROM blog_tagpost GROUP BY tag_id
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blog', '0020_tagstats'),
+        ('contenttypes', '0002_remove_content_type_name'),
+    ]
+
+    operations = [
+        migrations.RunSQL(BACKFILL_TAGPOST_SQL, 'DELETE FROM blog_tagpost'),
+        migrations.RunSQL(BACKFILL_TAGSTATS_SQL, 'DELETE FROM blog_tagstats'),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 5.2 on 2026-10-18 12:38
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blog', '0023_admin_moderation_indexes'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='comment',
+            index=models.Index(fields=['updated'], name='blog_commen_updated_af3518_idx'),
+        ),
+    ]
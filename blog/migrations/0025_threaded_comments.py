@@ -0,0 +1,53 @@
+# Generated by Django 5.2 on 2026-10-18 12:56
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import CharField, Count, OuterRef, Subquery, Value
+from django.db.models.functions import Cast, Coalesce, LPad
+
+COMMENT_PATH_STEP = 10
+
+
+def backfill_threads(apps, schema_editor):
+    """
+    Every existing comment starts a thread of its own, and each post gets its visible comment count.
+    """
+    Comment = apps.get_model('blog', 'Comment')
+    Post = apps.get_model('blog', 'Post')
+    Comment.objects.update(path=LPad(Cast('id', CharField()), COMMENT_PATH_STEP, Value('0')))
+    visible = (
+        Comment.objects.filter(post=OuterRef('pk'), active=True)
+        .values('post').annotate(count=Count('id')).values('count')
+    )
+    Post.objects.update(comment_count=Coalesce(Subquery(visible), 0))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blog', '0024_comment_updated_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='comment',
+            name='parent',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='replies', to='blog.comment'),
+        ),
+        migrations.AddField(
+            model_name='comment',
+            name='path',
+            field=models.CharField(blank=True, editable=False, max_length=255),
+        ),
+        migrations.AddField(
+            model_name='post',
+            name='comment_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        # filled before the index is built
+        migrations.RunPython(backfill_threads, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='comment',
+            index=models.Index(fields=['post', 'path'], name='blog_commen_post_id_34d25d_idx'),
+        ),
+    ]
@@ -1,12 +1,71 @@
+import html
+
 from django.conf import settings
 from django.db import models
 from django.utils import timezone
-from django.utils.text import slugify
+from django.utils.html import strip_tags
+from django.utils.text import Truncator, slugify
 from django.urls import reverse
 from taggit.managers import TaggableManager
+from taggit.models import Tag
+
+from .rendering import RENDERER_VERSION, render_body
+
+# average reading speed used for the estimated reading time
+WORDS_PER_MINUTE = 200
+# number of words kept in the stored excerpt shown on post cards
+EXCERPT_WORDS = 30
+# characters of a comment's path per level, its id zero padded
+COMMENT_PATH_STEP = 10
+# deepest reply level, replies to comments there become their siblings
+COMMENT_MAX_DEPTH = 5
+
 
 # Create your models here.
-class PublishedManager(models.Manager):
+class PostQuerySet(models.QuerySet):
+    """
+    Shared query building blocks for post pages.
+
+    Every page that renders posts should start from these so the author
+    and tags are loaded in a fixed number of queries, whatever the page size.
+    """
+
+    def with_related(self):
+        """
+        Loads the author in the same query and all tags in one extra query.
+        """
+        return self.select_related('author').prefetch_related('tags')
+
+    def for_cards(self):
+        """
+        Posts rendered as cards, the body is never shown so it is not loaded.
+        """
+        return self.with_related().defer('body')
+
+    def similar_to(self, post, limit=4):
+        """
+        Posts sharing the most tags with the given post, newest first on ties.
+        Reads the precomputed SimilarPost rows, so it is a single indexed lookup.
+        """
+        return (
+            self.defer('body')
+            .filter(similar_of__post=post)
+            .order_by('-similar_of__score', '-similar_of__publish')[:limit]
+        )
+
+    def tagged(self, tag):
+        """
+        Published posts with the tag, read through the TagPost rows so the
+        (tag, publish) index does the filtering and the ordering.
+
+        Adds tag_publish and tag_post to order and paginate on, see KeysetPaginator.
+        """
+        return self.filter(tag_links__tag=tag).annotate(
+            tag_publish=models.F('tag_links__publish'), tag_post=models.F('tag_links__post'),
+        )
+
+
+class PublishedManager(models.Manager.from_queryset(PostQuerySet)):
     """
     Custom manager to retrieve only published posts.
     """
@@ -29,6 +88,16 @@ class Post(models.Model):
         updated (datetime): The date and time the post was last updated.
         status (str): The status of the post (Draft or Published).
         tags (TaggableManager): The tags associated with the post.
+        word_count (int): Number of words in the body, filled on save.
+        reading_time (int): Estimated reading time in minutes, filled on save.
+        excerpt (str): The first words of the body used on post cards, filled on save.
+        body_format (str): How the body is written (Plain text or Markdown).
+        body_html (str): The sanitised html of the body, rendered on save.
+        rendered_version (int): The renderer version body_html was produced with.
+        image_width (int): Width of the original image, filled by blog.images.
+        image_height (int): Height of the original image, filled by blog.images.
+        image_variants (list): Resized copies of the image, each with name, format, width and height.
+        comment_count (int): Number of visible comments, kept by blog.threads.
     """
 
     class Status(models.TextChoices):
@@ -36,19 +105,38 @@ class Post(models.Model):
         DRAFT = 'DF', 'Draft'
         PUBLISHED = 'PB', 'Published'
 
+    class BodyFormat(models.TextChoices):
+        '''A class for the formats a post body can be written in'''
+        PLAIN = 'PL', 'Plain text'
+        MARKDOWN = 'MD', 'Markdown'
+
     title = models.CharField(max_length=100)
     slug = models.SlugField(unique=True, blank=True)
     body = models.TextField()
     image = models.ImageField(upload_to='images/blog/', blank=True)
+    image_width = models.PositiveIntegerField(null=True, blank=True, editable=False)
+    image_height = models.PositiveIntegerField(null=True, blank=True, editable=False)
+    image_variants = models.JSONField(default=list, blank=True, editable=False)
     publish = models.DateTimeField(default=timezone.now)
     created = models.DateTimeField(auto_now_add=True)
     updated = models.DateTimeField(auto_now=True)
     status = models.CharField(max_length=2, choices=Status, default=Status.DRAFT)
 
+    # precomputed from the body in save() so lists never have to load the body
+    word_count = models.PositiveIntegerField(default=0, editable=False)
+    reading_time = models.PositiveIntegerField(default=1, editable=False)
+    excerpt = models.TextField(blank=True, editable=False)
+
+    # rendered once in save() so pages output the html as is
+    body_format = models.CharField(max_length=2, choices=BodyFormat, default=BodyFormat.PLAIN)
+    body_html = models.TextField(blank=True, editable=False)
+    rendered_version = models.PositiveSmallIntegerField(default=0, editable=False)
+    comment_count = models.PositiveIntegerField(default=0, editable=False)
+
     # adding a many to one relationship between author and post 
     author = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='blog_posts')
     # managers
-    objects = models.Manager() #the defualt manager
+    objects = PostQuerySet.as_manager() #the defualt manager
     published = PublishedManager() #custom manager
     tags = TaggableManager() #for tagging posts
 
@@ -56,16 +144,82 @@ class Post(models.Model):
 
     class Meta:
         ordering = ['-publish']
-        indexes = [models.Index(fields=['-publish']),]
+        indexes = [
+            models.Index(fields=['-publish']),
+            # the latest edit, a validator for conditional GETs on the post lists
+            models.Index(fields=['updated']),
+            # an author's drafts or published posts, newest first, for the dashboard
+            models.Index(fields=['author', 'status', '-publish']),
+            # the admin's changelist order
+            models.Index(fields=['status', 'publish']),
+        ]
 
     def __str__(self):
         return self.title
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # remember what was loaded so signal handlers can tell what changed
+        instance._loaded_values = dict(zip(field_names, values))
+        return instance
+
+    def has_changed(self, *fields):
+        """
+        Returns True if any of the fields differ from the values loaded from the database.
+        New posts always count as changed.
+        """
+        loaded = getattr(self, '_loaded_values', None)
+        if loaded is None:
+            return True
+        return any(field in loaded and loaded[field] != getattr(self, field) for field in fields)
+
+    def mark_saved(self):
+        """
+        Makes the current field values the baseline for has_changed().
+        """
+        self._loaded_values = {
+            field.attname: getattr(self, field.attname)
+            for field in self._meta.concrete_fields
+            if field.attname not in self.get_deferred_fields()
+        }
     
     # auto filling slug with title 
     def save(self, *args, **kwargs):
         if not self.slug:
             self.slug = slugify(self.title)
+        # skip when the body was deferred, it can't have changed then
+        if 'body' not in self.get_deferred_fields():
+            self.render()
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and {'body', 'body_format'} & set(update_fields):
+            kwargs['update_fields'] = {
+                *update_fields, 'body_html', 'rendered_version', 'word_count', 'reading_time', 'excerpt',
+            }
+        elif update_fields is None and not self._state.adding and not kwargs.get('force_insert'):
+            # comment_count is counted by the comment signals, a copy loaded
+            # before the latest comment must not write its stale count back
+            deferred = self.get_deferred_fields()
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.name != 'comment_count' and field.attname not in deferred
+            ]
         super().save(*args, **kwargs)
+        # after the post_save handlers have seen what changed
+        self.mark_saved()
+
+    def render(self):
+        """
+        Renders body_html and fills word_count, reading_time and excerpt from it.
+        Assumes an average reading speed of 200 words per minute.
+        """
+        self.body_html = render_body(self.body, self.body_format)
+        self.rendered_version = RENDERER_VERSION
+        # counted on the rendered text so Markdown syntax isn't counted or shown
+        text = html.unescape(strip_tags(self.body_html))
+        self.word_count = len(text.split())
+        self.reading_time = max(1, self.word_count // WORDS_PER_MINUTE)
+        self.excerpt = Truncator(text).words(EXCERPT_WORDS, truncate=' …')
 
     # for canonical url that aids SEO 
     def get_absolute_url(self):
@@ -73,17 +227,6 @@ class Post(models.Model):
         Returns the canonical URL for the post.
         """
         return reverse('blog:post_detail', args=[self.id, self.slug])
-    
-    @property
-    def reading_time(self):
-        """
-        Calculates the estimated reading time of the post in minutes.
-        Assumes an average reading speed of 200 words per minute.
-        """
-        words = self.body.split()
-        # Average reading speed is 200 words per minute
-        minutes = len(words) // 200
-        return max(1, minutes)
 
 
 class Subscriber(models.Model):
@@ -109,8 +252,14 @@ class Comment(models.Model):
         created (datetime): The date and time the comment was created.
         updated (datetime): The date and time the comment was last updated.
         active (bool): Whether the comment is active/visible.
+        parent (Comment): The comment this one replies to, None for a new thread.
+        path (str): The ids of the comment's ancestors and its own, each zero padded
+            to COMMENT_PATH_STEP characters. Ordering a post's comments by it
+            gives every thread in reading order, replies under what they answer.
     """
     post = models.ForeignKey(Post, on_delete=models.CASCADE, related_name='comments')
+    parent = models.ForeignKey('self', on_delete=models.CASCADE, null=True, blank=True, related_name='replies')
+    path = models.CharField(max_length=255, blank=True, editable=False)
     name = models.CharField(max_length=80)
     email = models.EmailField()
     body = models.TextField()
@@ -120,7 +269,245 @@ class Comment(models.Model):
 
     class Meta:
         ordering = ['created']
-        indexes = [models.Index(fields=['-created']),]
+        indexes = [
+            models.Index(fields=['-created']),
+            # a post's visible comments in order, and their count and latest for conditional GETs
+            models.Index(fields=['post', 'active', 'created']),
+            # only the hidden comments, for the moderation queue
+            models.Index(fields=['-created', '-id'], condition=models.Q(active=False), name='blog_comment_hidden_idx'),
+            # what changed since the last incremental export
+            models.Index(fields=['updated']),
+            # a post's threads in reading order
+            models.Index(fields=['post', 'path']),
+        ]
+
+    def __str__(self):
+        return f'Comment by {self.name} on {self.post}'
+
+    @property
+    def depth(self):
+        """
+        How deep in its thread the comment is, 0 for one that starts a thread.
+        """
+        return max(len(self.path) // COMMENT_PATH_STEP - 1, 0)
+
+    def save(self, *args, **kwargs):
+        prefix = None
+        if not self.path:
+            parent = self.parent
+            prefix = parent.path if parent is not None else ''
+            if parent is not None and parent.depth >= COMMENT_MAX_DEPTH:
+                # too deep, the reply goes next to the comment it answers
+                self.parent_id, prefix = parent.parent_id, prefix[:-COMMENT_PATH_STEP]
+        super().save(*args, **kwargs)
+        # the path ends with the comment's own id, so it is only known after the INSERT
+        if prefix is not None:
+            self.path = f'{prefix}{self.pk:0{COMMENT_PATH_STEP}d}'
+            Comment.objects.filter(pk=self.pk).update(path=self.path)
+
+
+class SimilarPost(models.Model):
+    """
+    Precomputed "similar posts" link between two published posts.
+
+    Only the best few links of each post are stored, kept up to date by
+    blog.similar, so the detail page can read them with one indexed lookup.
+
+    Attributes:
+        post (Post): The post the suggestion is shown on.
+        similar (Post): The suggested post.
+        score (int): Number of tags the two posts share.
+        publish (datetime): Copy of the suggested post's publish date, used to break ties.
+    """
+    post = models.ForeignKey(Post, on_delete=models.CASCADE, related_name='similar_links')
+    similar = models.ForeignKey(Post, on_delete=models.CASCADE, related_name='similar_of')
+    score = models.PositiveIntegerField()
+    publish = models.DateTimeField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['post', 'similar'], name='unique_similar_post'),
+        ]
+        indexes = [models.Index(fields=['post', '-score', '-publish']),]
 
     def __str__(self):
-        return f'Comment by {self.name} on {self.post}'
\ No newline at end of file
+        return f'{self.similar} is similar to {self.post}'
+
+
+class AuthorStats(models.Model):
+    """
+    Totals over all of an author's posts, shown on their dashboard.
+
+    Marked stale by blog.authorstats whenever one of the author's posts
+    or their comments change, and recomputed the next time it is read.
+
+    Attributes:
+        author (User): The author.
+        post_count (int): Number of posts, drafts included.
+        published_count (int): Number of published posts.
+        word_count (int): Words over all posts.
+        comment_count (int): Visible comments over all posts.
+        last_published (datetime): Publish date of the newest published post.
+        stale (bool): Something changed since the totals were taken.
+    """
+    author = models.OneToOneField(
+        settings.AUTH_USER_MODEL, on_delete=models.CASCADE, primary_key=True, related_name='blog_stats',
+    )
+    post_count = models.PositiveIntegerField(default=0)
+    published_count = models.PositiveIntegerField(default=0)
+    word_count = models.PositiveIntegerField(default=0)
+    comment_count = models.PositiveIntegerField(default=0)
+    last_published = models.DateTimeField(null=True, blank=True)
+    stale = models.BooleanField(default=False)
+
+    class Meta:
+        verbose_name_plural = 'author stats'
+
+    def __str__(self):
+        return f'{self.author}: {self.post_count} posts'
+
+    @property
+    def draft_count(self):
+        return self.post_count - self.published_count
+
+
+class TagPost(models.Model):
+    """
+    A tag of a published post, with a copy of the post's publish date.
+
+    Kept up to date by blog.tagstats. Tag pages read the newest posts of a tag
+    straight off the (tag, publish) index, instead of joining every post
+    through taggit's generic tagged items and sorting them.
+
+    Attributes:
+        tag (Tag): The tag.
+        post (Post): The published post carrying it.
+        publish (datetime): Copy of the post's publish date.
+    """
+    tag = models.ForeignKey(Tag, on_delete=models.CASCADE, related_name='published_links')
+    post = models.ForeignKey(Post, on_delete=models.CASCADE, related_name='tag_links')
+    publish = models.DateTimeField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['post', 'tag'], name='unique_tag_post'),
+        ]
+        indexes = [models.Index(fields=['tag', '-publish', '-post']),]
+
+    def __str__(self):
+        return f'{self.post} tagged {self.tag}'
+
+
+class TagStats(models.Model):
+    """
+    How many published posts a tag has and when the newest was published.
+
+    Kept up to date by blog.tagstats as posts are published, unpublished,
+    retagged and deleted, so the tag cloud and tag index never count posts.
+
+    Attributes:
+        tag (Tag): The tag.
+        post_count (int): Number of published posts with the tag.
+        latest_publish (datetime): Publish date of the newest of them, None when there are none.
+    """
+    tag = models.OneToOneField(Tag, on_delete=models.CASCADE, primary_key=True, related_name='stats')
+    post_count = models.PositiveIntegerField(default=0)
+    latest_publish = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        verbose_name_plural = 'tag stats'
+        indexes = [models.Index(fields=['-post_count']),]
+
+    def __str__(self):
+        return f'{self.tag}: {self.post_count} posts'
+
+
+class OutboundEmail(models.Model):
+    """
+    An email waiting in (or sent from) the outbound mail queue.
+
+    Views only enqueue; the send_queued_mail worker delivers the messages
+    over a reused SMTP connection and records the outcome here.
+
+    Attributes:
+        subject (str): The subject line.
+        body (str): The plain text body.
+        from_email (str): The sender, blank for DEFAULT_FROM_EMAIL.
+        to (str): Comma separated recipient addresses.
+        status (str): Queued, Sent or Failed.
+        attempts (int): Number of delivery attempts so far.
+        next_attempt (datetime): When the worker may try this message next.
+        last_error (str): The error of the last failed attempt.
+        created (datetime): When the message was queued.
+        sent (datetime): When the message was delivered.
+    """
+
+    class Status(models.TextChoices):
+        QUEUED = 'QU', 'Queued'
+        SENT = 'SE', 'Sent'
+        FAILED = 'FA', 'Failed'
+
+    subject = models.CharField(max_length=255)
+    body = models.TextField()
+    from_email = models.CharField(max_length=254, blank=True)
+    to = models.TextField()
+    status = models.CharField(max_length=2, choices=Status, default=Status.QUEUED)
+    attempts = models.PositiveIntegerField(default=0)
+    next_attempt = models.DateTimeField(default=timezone.now)
+    last_error = models.TextField(blank=True)
+    created = models.DateTimeField(auto_now_add=True)
+    sent = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ['created']
+        indexes = [models.Index(fields=['status', 'next_attempt']),]
+
+    def __str__(self):
+        return f'{self.subject} to {self.to}'
+
+    @property
+    def recipients(self):
+        return [address for address in self.to.split(',') if address]
+
+
+class Newsletter(models.Model):
+    """
+    A digest of recent posts sent to every Subscriber.
+
+    The body is rendered once when the newsletter is created,
+    so resumed runs send exactly the same content.
+
+    Attributes:
+        subject (str): The subject line.
+        body (str): The rendered plain text digest.
+        created (datetime): When the newsletter was created.
+        finished (datetime): When every subscriber had been sent the newsletter.
+    """
+    subject = models.CharField(max_length=255)
+    body = models.TextField()
+    created = models.DateTimeField(auto_now_add=True)
+    finished = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ['-created']
+
+    def __str__(self):
+        return self.subject
+
+
+class NewsletterDelivery(models.Model):
+    """
+    Records that a newsletter was sent to a subscriber, so interrupted runs can resume.
+    """
+    newsletter = models.ForeignKey(Newsletter, on_delete=models.CASCADE, related_name='deliveries')
+    subscriber = models.ForeignKey(Subscriber, on_delete=models.CASCADE, related_name='newsletter_deliveries')
+    sent = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['newsletter', 'subscriber'], name='unique_newsletter_delivery'),
+        ]
+
+    def __str__(self):
+        return f'{self.newsletter} to {self.subscriber}'
+
@@ -0,0 +1,148 @@
+import logging
+import threading
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.mail import EmailMessage, get_connection
+from django.template.loader import render_to_string
+from django.utils import timezone
+
+from .models import Newsletter, NewsletterDelivery, Post, Subscriber
+
+logger = logging.getLogger(__name__)
+
+
+def render_digest(since):
+    """
+    Renders the plain text digest of the posts published since the given date.
+    """
+    posts = Post.published.filter(publish__gte=since).defer('body').order_by('-publish')
+    return render_to_string('blog/email/newsletter.txt', {
+        'posts': posts,
+        'site_url': getattr(settings, 'SITE_URL', '').rstrip('/'),
+    })
+
+
+def create_newsletter(subject, days=7):
+    """
+    Creates a newsletter with the digest of the last days, rendered once for every recipient.
+    """
+    since = timezone.now() - timedelta(days=days)
+    return Newsletter.objects.create(subject=subject, body=render_digest(since))
+
+
+class ConnectionPool:
+    """
+    Hands every worker thread its own open mail connection and closes them all at the end.
+    """
+
+    def __init__(self):
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._connections = []
+
+    def get(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = get_connection()
+            connection.open()
+            self._local.connection = connection
+            with self._lock:
+                self._connections.append(connection)
+        return connection
+
+    def close_all(self):
+        with self._lock:
+            for connection in self._connections:
+                try:
+                    connection.close()
+                except Exception:
+                    logger.exception('Closing a mail connection failed')
+            self._connections = []
+
+
+def _send_chunk(pool, newsletter, chunk):
+    """
+    Sends the newsletter to the (id, email) rows of chunk one by one over this thread's connection.
+    Returns the ids it was delivered to and the error that stopped it, None if it wasn't.
+    """
+    connection = pool.get()
+    delivered = []
+    for subscriber_id, email in chunk:
+        message = EmailMessage(newsletter.subject, newsletter.body, to=[email], connection=connection)
+        try:
+            message.send()
+        except Exception as error:
+            # the ones before it did get the newsletter, they must not get it again on resume
+            return delivered, error
+        delivered.append(subscriber_id)
+    return delivered, None
+
+
+def dispatch(newsletter, chunk_size=100, workers=4):
+    """
+    Sends the newsletter to every subscriber who hasn't received it yet.
+
+    Subscribers are streamed in chunks, each chunk is sent by one of the worker
+    threads over that thread's pooled connection, and whoever the chunk was
+    delivered to is recorded, up to a failure within it too, so an interrupted
+    run picks up where it stopped. Only this thread touches the database.
+
+    Returns a (sent, failed) tuple with the number of recipients in each state.
+    """
+    pending = (
+        Subscriber.objects.exclude(newsletter_deliveries__newsletter=newsletter)
+        .order_by('id')
+        .values_list('id', 'email')
+    )
+    pool = ConnectionPool()
+    sent = failed = 0
+    in_flight = {}
+
+    def collect(done):
+        nonlocal sent, failed
+        for future in done:
+            chunk = in_flight.pop(future)
+            try:
+                subscriber_ids, error = future.result()
+            except Exception:
+                logger.exception('Sending a newsletter chunk of %s recipients failed', len(chunk))
+                failed += len(chunk)
+                continue
+            if error is not None:
+                logger.error(
+                    'Sending a newsletter chunk failed after %s of %s recipients',
+                    len(subscriber_ids), len(chunk), exc_info=error,
+                )
+                failed += len(chunk) - len(subscriber_ids)
+            NewsletterDelivery.objects.bulk_create(
+                [NewsletterDelivery(newsletter=newsletter, subscriber_id=pk) for pk in subscriber_ids],
+                ignore_conflicts=True,
+            )
+            sent += len(subscriber_ids)
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        try:
+            chunk = []
+            for row in pending.iterator(chunk_size=chunk_size):
+                chunk.append(row)
+                if len(chunk) < chunk_size:
+                    continue
+                in_flight[executor.submit(_send_chunk, pool, newsletter, chunk)] = chunk
+                chunk = []
+                # keep memory flat, never queue more than two chunks per worker
+                if len(in_flight) >= workers * 2:
+                    done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                    collect(done)
+            if chunk:
+                in_flight[executor.submit(_send_chunk, pool, newsletter, chunk)] = chunk
+            collect(wait(in_flight).done)
+        finally:
+            executor.shutdown(wait=True)
+            pool.close_all()
+
+    if not failed:
+        newsletter.finished = timezone.now()
+        newsletter.save(update_fields=['finished'])
+    return sent, failed
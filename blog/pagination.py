@@ -0,0 +1,210 @@
+import base64
+import binascii
+import json
+
+from django.core.exceptions import FieldDoesNotExist, FieldError, ValidationError
+from django.db.models import Q
+
+
+class InvalidCursor(Exception):
+    """
+    Raised when a cursor token can't be decoded or holds values that don't fit the ordering.
+    """
+
+
+class KeysetPage:
+    """
+    A page of results produced by KeysetPaginator.
+
+    Unlike Django's Page it knows nothing about the total number of results,
+    only whether there is a page before and after it.
+    """
+
+    def __init__(self, object_list, paginator, has_previous, has_next):
+        self.object_list = object_list
+        self.paginator = paginator
+        self._has_previous = has_previous
+        self._has_next = has_next
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __getitem__(self, index):
+        return self.object_list[index]
+
+    def has_previous(self):
+        return self._has_previous
+
+    def has_next(self):
+        return self._has_next
+
+    def has_other_pages(self):
+        return self._has_previous or self._has_next
+
+    @property
+    def previous_cursor(self):
+        if not self._has_previous:
+            return None
+        return self.paginator.encode_cursor(self.object_list[0], backwards=True)
+
+    @property
+    def next_cursor(self):
+        if not self._has_next:
+            return None
+        return self.paginator.encode_cursor(self.object_list[-1])
+
+
+class KeysetPaginator:
+    """
+    Cursor based paginator that seeks on the ordering columns instead of using OFFSET.
+
+    Each page costs one query of ``per_page + 1`` rows no matter how deep it is,
+    and no COUNT(*) is ever run. The default ordering of ``(-publish, -id)``
+    is served by the ``-publish`` index on Post.
+
+    Args:
+        queryset: The queryset to paginate, values() querysets must include the ordering columns.
+        per_page (int): Number of objects on each page.
+        ordering (tuple): Field or annotation names, ``-`` for descending.
+            The last one must be unique so every row has a distinct key.
+    """
+
+    def __init__(self, queryset, per_page, ordering=('-publish', '-id')):
+        self.queryset = queryset
+        self.per_page = per_page
+        self.ordering = tuple(ordering)
+        self.fields = [name.lstrip('-') for name in self.ordering]
+
+    def page(self, cursor=None):
+        """
+        Returns the page after (or before) the given cursor, the first page when cursor is empty.
+        Raises InvalidCursor for tokens that can't be decoded or hold unusable values.
+        """
+        if not cursor:
+            return self._page(None, backwards=False, has_cursor=False)
+        backwards, values = self.decode_cursor(cursor)
+        return self._page(values, backwards=backwards, has_cursor=True)
+
+    def get_page(self, cursor=None):
+        """
+        Like page() but falls back to the first page for a bad cursor.
+        """
+        try:
+            return self.page(cursor)
+        except InvalidCursor:
+            return self.page(None)
+
+    async def apage(self, cursor=None):
+        """
+        Async version of page(), the rows are fetched with async iteration.
+        """
+        backwards, values = self.decode_cursor(cursor) if cursor else (False, None)
+        queryset = self._queryset(values, backwards)
+        rows = [row async for row in queryset]
+        return self._build_page(rows, backwards, has_cursor=bool(cursor))
+
+    async def aget_page(self, cursor=None):
+        """
+        Async version of get_page().
+        """
+        try:
+            return await self.apage(cursor)
+        except InvalidCursor:
+            return await self.apage(None)
+
+    def _queryset(self, values, backwards):
+        ordering = self.ordering
+        if backwards:
+            ordering = tuple(self._flip(name) for name in ordering)
+
+        queryset = self.queryset
+        if values is not None:
+            queryset = queryset.filter(self._seek(ordering, values))
+        return queryset.order_by(*ordering)[:self.per_page + 1]
+
+    def _page(self, values, backwards, has_cursor):
+        rows = list(self._queryset(values, backwards))
+        return self._build_page(rows, backwards, has_cursor)
+
+    def _build_page(self, rows, backwards, has_cursor):
+        has_more = len(rows) > self.per_page
+        rows = rows[:self.per_page]
+        if backwards:
+            rows.reverse()
+            return KeysetPage(rows, self, has_previous=has_more, has_next=has_cursor)
+        return KeysetPage(rows, self, has_previous=has_cursor, has_next=has_more)
+
+    @staticmethod
+    def _flip(name):
+        return name[1:] if name.startswith('-') else f'-{name}'
+
+    def _seek(self, ordering, values):
+        """
+        Builds the row comparison (a, b) > (x, y) as (a > x) OR (a = x AND b > y)
+        so it works on every database.
+        """
+        condition = Q()
+        equal = {}
+        for name, value in zip(ordering, values):
+            field = name.lstrip('-')
+            lookup = 'lt' if name.startswith('-') else 'gt'
+            condition |= Q(**equal, **{f'{field}__{lookup}': value})
+            equal[field] = value
+        return condition
+
+    def encode_cursor(self, obj, backwards=False):
+        """
+        Returns the opaque token pointing just after (or before) obj.
+        """
+        # rows of a values() queryset are dicts
+        values = [obj[field] if isinstance(obj, dict) else getattr(obj, field) for field in self.fields]
+        # full isoformat, DjangoJSONEncoder would drop the microseconds the seek depends on
+        values = [value.isoformat() if hasattr(value, 'isoformat') else value for value in values]
+        payload = json.dumps([1 if backwards else 0, values])
+        return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+    def decode_cursor(self, cursor):
+        """
+        Returns (backwards, values) for a token made by encode_cursor().
+        """
+        try:
+            payload = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+            backwards, values = json.loads(payload)
+        except (binascii.Error, ValueError, TypeError):
+            raise InvalidCursor(cursor)
+        if not isinstance(values, list) or len(values) != len(self.fields):
+            raise InvalidCursor(cursor)
+        return bool(backwards), [self._to_python(field, value) for field, value in zip(self.fields, values)]
+
+    def _to_python(self, name, value):
+        # a key is always a scalar, None can't be compared against
+        if value is None or not isinstance(value, (str, int, float)):
+            raise InvalidCursor(value)
+        try:
+            field = self.queryset.model._meta.get_field(name)
+        except FieldDoesNotExist:
+            field = self._annotation_field(name)
+            if field is None:
+                # annotations such as search_rank are plain numbers
+                if not isinstance(value, (int, float)):
+                    raise InvalidCursor(value)
+                return value
+        try:
+            value = field.to_python(value)
+        except (ValidationError, TypeError, ValueError):
+            raise InvalidCursor(value)
+        # e.g. an empty string for a date
+        if value is None:
+            raise InvalidCursor(value)
+        return value
+
+    def _annotation_field(self, name):
+        # the field an annotation such as tag_publish stands for, None for raw SQL with no type
+        annotation = self.queryset.query.annotations.get(name)
+        try:
+            return annotation.output_field if annotation is not None else None
+        except FieldError:
+            return None
@@ -0,0 +1,147 @@
+import math
+import time
+from functools import wraps
+
+from asgiref.sync import iscoroutinefunction
+from django.conf import settings
+from django.core.cache import cache
+from django.http import HttpResponse
+
+from . import metrics
+
+PERIODS = {'s': 1, 'm': 60, 'h': 60 * 60, 'd': 24 * 60 * 60}
+
+
+def parse_rate(rate):
+    """
+    Returns (requests, seconds) for a rate such as ``'5/m'`` or ``'100/h'``.
+    """
+    count, _, unit = rate.partition('/')
+    if unit not in PERIODS:
+        raise ValueError(f'Unknown rate {rate!r}, expected e.g. 5/m.')
+    return int(count), PERIODS[unit]
+
+
+def client_ip(request):
+    """
+    The client's address from BLOG_RATELIMIT_IP_HEADER, REMOTE_ADDR unless the site runs behind a proxy.
+    """
+    value = request.META.get(getattr(settings, 'BLOG_RATELIMIT_IP_HEADER', 'REMOTE_ADDR'), '')
+    # the last hop of X-Forwarded-For is the one the proxy saw, the rest can be made up
+    return value.rsplit(',', 1)[-1].strip() or 'unknown'
+
+
+def _keys(scope, ident, period, now):
+    window = int(now // period)
+    base = f'blog:ratelimit:{scope}:{ident}'
+    return f'{base}:{window}', f'{base}:{window - 1}', now / period - window
+
+
+def _retry_after(limit, period, current, previous, through):
+    """
+    Seconds to wait if the request counted in current pushed the window over limit, else 0.
+
+    A sliding window counter: the previous fixed window counts for the part of it
+    the sliding window still overlaps, so bursts at a window edge aren't let through twice.
+    """
+    if previous * (1 - through) + current <= limit:
+        return 0
+    return max(1, math.ceil(period * (1 - through)))
+
+
+def hit(scope, ident, limit, period, now=None):
+    """
+    Counts a request of ident to scope. Returns 0 when it is allowed, else the seconds until it would be.
+
+    Two cache operations in the common case: an incr of the current window
+    and a get of the previous one. Rejected requests count too, so a client
+    that keeps hammering stays locked out.
+
+    The limit is only as exact as the backend's incr. Memcached and Redis
+    increment atomically. The file cache reads and writes the count back,
+    so workers racing on the same key can lose counts and let a few extra
+    requests through. Locmem is atomic but kept per process, so each worker
+    allows the full rate.
+    """
+    now = time.time() if now is None else now
+    current_key, previous_key, through = _keys(scope, ident, period, now)
+    try:
+        current = cache.incr(current_key)
+    except ValueError:
+        # the window's first request, unless another one just added it
+        current = 1 if cache.add(current_key, 1, period * 2) else cache.incr(current_key)
+    previous = cache.get(previous_key, 0)
+    return _retry_after(limit, period, current, previous, through)
+
+
+async def ahit(scope, ident, limit, period, now=None):
+    """
+    Async version of hit().
+    """
+    now = time.time() if now is None else now
+    current_key, previous_key, through = _keys(scope, ident, period, now)
+    try:
+        current = await cache.aincr(current_key)
+    except ValueError:
+        current = 1 if await cache.aadd(current_key, 1, period * 2) else await cache.aincr(current_key)
+    previous = await cache.aget(previous_key, 0)
+    return _retry_after(limit, period, current, previous, through)
+
+
+def _rate(scope, rate):
+    # BLOG_RATE_LIMITS overrides the rate a view was decorated with
+    return parse_rate(getattr(settings, 'BLOG_RATE_LIMITS', {}).get(scope, rate))
+
+
+def _rejected(scope, wait):
+    metrics.registry.record_rejection(scope)
+    response = HttpResponse(
+        f'Too many requests, try again in {wait} seconds.', status=429, content_type='text/plain',
+    )
+    response['Retry-After'] = str(wait)
+    return response
+
+
+def rate_limit(scope, rate, methods=('POST',), key='ip'):
+    """
+    Answers a client's requests to the view past rate with 429 Too Many Requests, before the view runs.
+
+    Goes above the view's other decorators so nothing else is done for a
+    rejected request. Counts are kept in the cache, see hit() for how exact they are.
+    Works on both sync and async views.
+
+    Args:
+        scope (str): Name the counts and rejections are kept under, usually the endpoint.
+        rate (str): Requests allowed per client, e.g. ``'5/m'``. BLOG_RATE_LIMITS can override it.
+        methods (tuple): The methods that are counted, the others pass freely.
+        key (str): ``'ip'`` counts per address, ``'user'`` per logged in user and per address for anonymous ones.
+    """
+    parse_rate(rate)
+
+    def enabled(request):
+        return request.method in methods and getattr(settings, 'BLOG_RATELIMIT_ENABLED', True)
+
+    def decorator(view):
+        if iscoroutinefunction(view):
+            @wraps(view)
+            async def async_wrapper(request, *args, **kwargs):
+                if enabled(request):
+                    user = await request.auser() if key == 'user' else None
+                    ident = f'user:{user.pk}' if user is not None and user.is_authenticated else client_ip(request)
+                    wait = await ahit(scope, ident, *_rate(scope, rate))
+                    if wait:
+                        return _rejected(scope, wait)
+                return await view(request, *args, **kwargs)
+            return async_wrapper
+
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            if enabled(request):
+                user = request.user if key == 'user' else None
+                ident = f'user:{user.pk}' if user is not None and user.is_authenticated else client_ip(request)
+                wait = hit(scope, ident, *_rate(scope, rate))
+                if wait:
+                    return _rejected(scope, wait)
+            return view(request, *args, **kwargs)
+        return wrapper
+    return decorator
@@ -0,0 +1,166 @@
+from html import escape
+from html.parser import HTMLParser
+from urllib.parse import urlsplit
+
+from django.utils.html import linebreaks
+from django.utils.text import slugify
+
+# bump when the output of render_body() changes, `rerender_posts` then refreshes stored html
+RENDERER_VERSION = 1
+
+ALLOWED_TAGS = {
+    'a', 'abbr', 'b', 'blockquote', 'br', 'code', 'dd', 'del', 'div', 'dl', 'dt', 'em',
+    'h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'hr', 'i', 'img', 'ins', 'li', 'ol', 'p', 'pre',
+    's', 'span', 'strong', 'sub', 'sup', 'table', 'tbody', 'td', 'th', 'thead', 'tr', 'u', 'ul',
+}
+ALLOWED_ATTRIBUTES = {
+    'a': {'href', 'title'},
+    'abbr': {'title'},
+    'img': {'src', 'alt', 'title', 'width', 'height'},
+    'td': {'align'},
+    'th': {'align'},
+    'ol': {'start'},
+}
+URL_ATTRIBUTES = {'href', 'src'}
+ALLOWED_SCHEMES = {'', 'http', 'https', 'mailto'}
+VOID_TAGS = {'br', 'hr', 'img'}
+# their text is dropped along with the tag
+DROP_CONTENT_TAGS = {'script', 'style', 'iframe', 'object', 'embed', 'template'}
+ANCHOR_HEADINGS = {'h2', 'h3', 'h4', 'h5', 'h6'}
+
+
+def _scheme(url):
+    # None for urls too malformed to split, e.g. an unclosed [ipv6 host
+    try:
+        return urlsplit(url.strip()).scheme.lower()
+    except ValueError:
+        return None
+
+
+class BodyCleaner(HTMLParser):
+    """
+    Rewrites rendered post html in one pass.
+
+    Only allowlisted tags, attributes and url schemes are kept,
+    headings get unique id anchors and images are lazy loaded.
+    """
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.out = []
+        self.open_tags = []
+        self.dropping = 0
+        self.heading = None
+        self.anchors = set()
+
+    def _emit(self, html):
+        if self.heading is not None:
+            self.heading['html'].append(html)
+        else:
+            self.out.append(html)
+
+    def handle_starttag(self, tag, attrs):
+        if tag in DROP_CONTENT_TAGS:
+            self.dropping += 1
+            return
+        if self.dropping or tag not in ALLOWED_TAGS:
+            return
+
+        allowed = ALLOWED_ATTRIBUTES.get(tag, set())
+        kept = []
+        for name, value in attrs:
+            if name not in allowed or value is None:
+                continue
+            if name in URL_ATTRIBUTES and _scheme(value) not in ALLOWED_SCHEMES:
+                continue
+            kept.append((name, value))
+        if tag == 'img':
+            kept += [('loading', 'lazy'), ('decoding', 'async')]
+        if tag == 'a' and _scheme(dict(kept).get('href', '')) in ('http', 'https'):
+            kept.append(('rel', 'nofollow noopener'))
+
+        rendered = ''.join(f' {name}="{escape(value)}"' for name, value in kept)
+        if tag in VOID_TAGS:
+            self._emit(f'<{tag}{rendered}>')
+            return
+        if tag in ANCHOR_HEADINGS and self.heading is None:
+            self.heading = {'tag': tag, 'attrs': rendered, 'html': [], 'text': []}
+        else:
+            self._emit(f'<{tag}{rendered}>')
+        self.open_tags.append(tag)
+
+    def handle_startendtag(self, tag, attrs):
+        self.handle_starttag(tag, attrs)
+        if tag not in VOID_TAGS and tag in self.open_tags:
+            self.handle_endtag(tag)
+
+    def handle_endtag(self, tag):
+        if tag in DROP_CONTENT_TAGS:
+            self.dropping = max(0, self.dropping - 1)
+            return
+        if self.dropping or tag not in self.open_tags:
+            return
+        # close anything left open inside this tag
+        while self.open_tags:
+            open_tag = self.open_tags.pop()
+            if self.heading is not None and open_tag == self.heading['tag']:
+                self._close_heading()
+            else:
+                self._emit(f'</{open_tag}>')
+            if open_tag == tag:
+                break
+
+    def handle_data(self, data):
+        if self.dropping:
+            return
+        if self.heading is not None:
+            self.heading['text'].append(data)
+        self._emit(escape(data, quote=False))
+
+    def _close_heading(self):
+        heading, self.heading = self.heading, None
+        anchor = slugify(''.join(heading['text'])) or 'section'
+        unique, n = anchor, 1
+        while unique in self.anchors:
+            n += 1
+            unique = f'{anchor}-{n}'
+        self.anchors.add(unique)
+        self.out.append(
+            f'<{heading["tag"]} id="{unique}"{heading["attrs"]}>{"".join(heading["html"])}</{heading["tag"]}>'
+        )
+
+    def result(self):
+        self.close()
+        while self.open_tags:
+            self.handle_endtag(self.open_tags[-1])
+        return ''.join(self.out)
+
+
+def clean_html(html):
+    """
+    Sanitises html and adds heading anchors and lazy loading images.
+    """
+    cleaner = BodyCleaner()
+    cleaner.feed(html)
+    return cleaner.result()
+
+
+def render_markdown(text):
+    import markdown
+
+    return markdown.markdown(text, extensions=['extra', 'sane_lists'], output_format='html')
+
+
+def render_body(body, body_format='PL'):
+    """
+    Renders a post body to sanitised html.
+
+    Args:
+        body (str): The raw post body.
+        body_format (str): 'PL' for plain text with line breaks, 'MD' for Markdown.
+    """
+    if body_format == 'MD':
+        html = render_markdown(body)
+    else:
+        html = linebreaks(body, autoescape=True)
+    return clean_html(html)
@@ -0,0 +1,205 @@
+import contextvars
+import random
+import time
+from functools import wraps
+
+from asgiref.sync import iscoroutinefunction, sync_to_async
+from django.conf import settings
+from django.db import DatabaseError, connections
+
+# set on the responses of requests that wrote, so the reader's next pages are read from the primary
+PRIMARY_COOKIE = 'blog_primary'
+
+# seconds a replica is behind the primary, by database vendor
+LAG_QUERIES = {
+    'postgresql': """
+        SELECT CASE WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+            ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0) END
+    """,
+}
+
+# the routing of the request being handled, None outside requests
+_current = contextvars.ContextVar('blog_routing', default=None)
+
+# alias -> (checked at, usable), shared by the threads of this process
+_health = {}
+
+
+class RequestRouting:
+    """
+    How the current request reads.
+
+    Attributes:
+        replicas_allowed (bool): Set by read_from_replicas() while a view may read from replicas.
+        pinned (bool): The reader wrote recently, everything goes to the primary.
+        wrote (bool): This request has written, reads after it go to the primary.
+        replica (str): The replica this request reads from, picked on its first read.
+    """
+
+    def __init__(self, pinned=False):
+        self.replicas_allowed = False
+        self.pinned = pinned
+        self.wrote = False
+        self.replica = None
+
+
+def replicas():
+    return getattr(settings, 'BLOG_DATABASE_REPLICAS', [])
+
+
+def max_lag():
+    return getattr(settings, 'BLOG_REPLICA_MAX_LAG', 5)
+
+
+def measure_lag(alias):
+    """
+    Returns how many seconds the replica is behind, 0 for databases with no way to tell.
+    """
+    connection = connections[alias]
+    with connection.cursor() as cursor:
+        query = LAG_QUERIES.get(connection.vendor)
+        if query is None:
+            # still proves the replica answers
+            cursor.execute('SELECT 1')
+            return 0
+        cursor.execute(query)
+        return float(cursor.fetchone()[0] or 0)
+
+
+def is_usable(alias):
+    """
+    Whether the replica answers and is no more than BLOG_REPLICA_MAX_LAG seconds behind.
+
+    Checked at most every BLOG_REPLICA_CHECK_INTERVAL seconds per process.
+    """
+    now = time.monotonic()
+    checked = _health.get(alias)
+    if checked is not None and now - checked[0] < getattr(settings, 'BLOG_REPLICA_CHECK_INTERVAL', 10):
+        return checked[1]
+    try:
+        usable = measure_lag(alias) <= max_lag()
+    except DatabaseError:
+        # Django drops the broken connection when the request finishes
+        usable = False
+    _health[alias] = (now, usable)
+    return usable
+
+
+def reset_health():
+    _health.clear()
+
+
+class ReplicaRouter:
+    """
+    Sends the reads of views decorated with read_from_replicas() to a replica,
+    everything else to the primary.
+
+    Once a request writes, its remaining reads go to the primary too, so it
+    always sees its own changes. Replicas that are down or lagging are skipped,
+    and with none left reads fall back to the primary.
+    """
+
+    def db_for_read(self, model, **hints):
+        routing = _current.get()
+        if routing is None or not routing.replicas_allowed or routing.pinned or routing.wrote:
+            return None
+        if routing.replica is None or not is_usable(routing.replica):
+            usable = [alias for alias in replicas() if is_usable(alias)]
+            # a request sticks to one replica, so its reads agree with each other
+            routing.replica = random.choice(usable) if usable else None
+        return routing.replica
+
+    def db_for_write(self, model, **hints):
+        routing = _current.get()
+        if routing is not None:
+            routing.wrote = True
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # replicas hold the same rows as the primary
+        aliases = {'default', *replicas()}
+        if obj1._state.db in aliases and obj2._state.db in aliases:
+            return True
+        return None
+
+
+def current_replica():
+    """
+    The replica the current request has read from, None if it only used the primary.
+    """
+    routing = _current.get()
+    return routing.replica if routing is not None else None
+
+
+def start_request(pinned=False):
+    """
+    Starts routing a request. Returns the RequestRouting and a token for finish_request().
+    """
+    routing = RequestRouting(pinned)
+    return routing, _current.set(routing)
+
+
+def finish_request(token):
+    _current.reset(token)
+
+
+def read_from_replicas(view):
+    """
+    Lets the GET and HEAD requests of a view read from the replicas.
+
+    If a replica fails partway, it is marked down and the view runs again against the primary.
+    Works on both sync and async views.
+    """
+    def begin(request):
+        routing = _current.get()
+        token = None
+        if routing is None:
+            # used without ReplicaRoutingMiddleware, e.g. when exporting pages
+            routing, token = start_request()
+        routing.replicas_allowed = request.method in ('GET', 'HEAD') and bool(replicas())
+        return routing, token
+
+    def end(request, routing, token):
+        routing.replicas_allowed = False
+        if token is not None:
+            finish_request(token)
+
+    def failed(routing):
+        # only worth a retry when the replica is what broke
+        if routing.replica is None:
+            return False
+        _health.pop(routing.replica, None)
+        if is_usable(routing.replica):
+            return False
+        routing.replica = None
+        routing.pinned = True
+        return True
+
+    if iscoroutinefunction(view):
+        @wraps(view)
+        async def async_wrapper(request, *args, **kwargs):
+            routing, token = begin(request)
+            try:
+                try:
+                    return await view(request, *args, **kwargs)
+                except DatabaseError:
+                    if not await sync_to_async(failed)(routing):
+                        raise
+                    return await view(request, *args, **kwargs)
+            finally:
+                end(request, routing, token)
+        return async_wrapper
+
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        routing, token = begin(request)
+        try:
+            try:
+                return view(request, *args, **kwargs)
+            except DatabaseError:
+                if not failed(routing):
+                    raise
+                return view(request, *args, **kwargs)
+        finally:
+            end(request, routing, token)
+    return wrapper
@@ -0,0 +1,236 @@
+import re
+
+from django.db import connection
+from django.db.models import FloatField, Q, TextField, Value
+from django.db.models.expressions import RawSQL
+from django.utils.html import escape
+from django.utils.safestring import mark_safe
+
+# markers wrapped around matched terms in snippets, swapped for <mark> after escaping
+HIGHLIGHT_START = '\x02'
+HIGHLIGHT_STOP = '\x03'
+
+# relative weight of each indexed column when ranking results
+TITLE_WEIGHT = 10.0
+TAGS_WEIGHT = 4.0
+BODY_WEIGHT = 1.0
+
+FTS_TABLE = 'blog_post_fts'
+
+TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+
+
+def backend():
+    """
+    Returns the name of the search backend for the current database,
+    or None when only the slow icontains fallback is available.
+    """
+    if connection.vendor in ('sqlite', 'postgresql'):
+        return connection.vendor
+    return None
+
+
+def _tokens(query):
+    return TOKEN_RE.findall(query or '')
+
+
+def _fts_query(query):
+    """
+    Builds a safe FTS5 MATCH expression from free text.
+    Every word is quoted so user input can never be parsed as FTS syntax,
+    and the last word is prefix matched so partial words still find posts.
+    """
+    tokens = _tokens(query)
+    if not tokens:
+        return ''
+    terms = [f'"{token}"' for token in tokens]
+    terms[-1] += '*'
+    return ' '.join(terms)
+
+
+def _document(post):
+    """
+    Returns the (title, tags, body) text indexed for a post.
+    """
+    tags = ' '.join(post.tags.names()) if post.pk else ''
+    return post.title, tags, post.body
+
+
+def index_post(post):
+    """
+    Adds or refreshes a single post in the search index.
+    Drafts are removed so they never show up in search results.
+    """
+    from .models import Post
+
+    if post.status != Post.Status.PUBLISHED:
+        remove_post(post.pk)
+        return
+
+    vendor = backend()
+    title, tags, body = _document(post)
+    with connection.cursor() as cursor:
+        if vendor == 'sqlite':
+            cursor.execute(f'DELETE FROM {FTS_TABLE} WHERE rowid = %s', [post.pk])
+            cursor.execute(
+                f'INSERT INTO {FTS_TABLE} (rowid, title, tags, body) VALUES (%s, %s, %s, %s)',
+                [post.pk, title, tags, body],
+            )
+        elif vendor == 'postgresql':
+            cursor.execute(
+                """
+                UPDATE blog_post SET search_vector =
+                    setweight(to_tsvector('english', %s), 'A') ||
+                    setweight(to_tsvector('english', %s), 'B') ||
+                    setweight(to_tsvector('english', %s), 'C')
+                WHERE id = %s
+                """,
+                [title, tags, body, post.pk],
+            )
+
+
+def remove_post(post_id):
+    """
+    Removes a post from the search index.
+    """
+    vendor = backend()
+    with connection.cursor() as cursor:
+        if vendor == 'sqlite':
+            cursor.execute(f'DELETE FROM {FTS_TABLE} WHERE rowid = %s', [post_id])
+        elif vendor == 'postgresql':
+            cursor.execute('UPDATE blog_post SET search_vector = NULL WHERE id = %s', [post_id])
+
+
+def rebuild_index(batch_size=500):
+    """
+    Rebuilds the whole search index from the published posts.
+    Returns the number of posts indexed.
+    """
+    from .models import Post
+
+    vendor = backend()
+    if vendor is None:
+        return 0
+
+    with connection.cursor() as cursor:
+        if vendor == 'sqlite':
+            cursor.execute(f'DELETE FROM {FTS_TABLE}')
+        else:
+            cursor.execute('UPDATE blog_post SET search_vector = NULL')
+
+    total = 0
+    posts = Post.published.prefetch_related('tags').order_by('id')
+    batch = []
+    for post in posts.iterator(chunk_size=batch_size):
+        tags = ' '.join(tag.name for tag in post.tags.all())
+        batch.append((post.pk, post.title, tags, post.body))
+        if len(batch) >= batch_size:
+            total += _write_batch(vendor, batch)
+            batch = []
+    if batch:
+        total += _write_batch(vendor, batch)
+    return total
+
+
+def _write_batch(vendor, batch):
+    with connection.cursor() as cursor:
+        if vendor == 'sqlite':
+            cursor.executemany(
+                f'INSERT INTO {FTS_TABLE} (rowid, title, tags, body) VALUES (%s, %s, %s, %s)',
+                batch,
+            )
+        else:
+            cursor.executemany(
+                """
+                UPDATE blog_post SET search_vector =
+                    setweight(to_tsvector('english', %s), 'A') ||
+                    setweight(to_tsvector('english', %s), 'B') ||
+                    setweight(to_tsvector('english', %s), 'C')
+                WHERE id = %s
+                """,
+                [(title, tags, body, pk) for pk, title, tags, body in batch],
+            )
+    return len(batch)
+
+
+def search_posts(queryset, query):
+    """
+    Filters a Post queryset down to posts matching the query.
+
+    Results are ordered by relevance (title hits above tag hits above body hits)
+    and every post gets a ``search_rank`` and a ``search_snippet`` attribute.
+    The snippet should be rendered with the ``highlight`` template filter.
+
+    Args:
+        queryset: The Post queryset to search in.
+        query (str): The raw search text entered by the user.
+    """
+    vendor = backend()
+    if vendor == 'sqlite':
+        match = _fts_query(query)
+        if not match:
+            return _unranked(queryset.none())
+        queryset = queryset.extra(
+            tables=[FTS_TABLE],
+            where=[f'{FTS_TABLE}.rowid = blog_post.id', f'{FTS_TABLE} MATCH %s'],
+            params=[match],
+        )
+        # plain annotations rather than extra(select=...) so paginators can filter on the rank
+        return queryset.annotate(
+            search_rank=RawSQL(f'bm25({FTS_TABLE}, {TITLE_WEIGHT}, {TAGS_WEIGHT}, {BODY_WEIGHT})', ()),
+            search_snippet=RawSQL(
+                f'snippet({FTS_TABLE}, 2, %s, %s, %s, 24)', (HIGHLIGHT_START, HIGHLIGHT_STOP, '…'),
+            ),
+        ).order_by('search_rank', '-publish')
+
+    if vendor == 'postgresql':
+        words = ' '.join(_tokens(query))
+        if not words:
+            return _unranked(queryset.none())
+        # ts_rank takes the weights of the D, C, B, A labels in that order
+        weights = '{%s, %s, %s, 1.0}' % (
+            BODY_WEIGHT / TITLE_WEIGHT, BODY_WEIGHT / TITLE_WEIGHT, TAGS_WEIGHT / TITLE_WEIGHT,
+        )
+        headline_options = (
+            f'StartSel={HIGHLIGHT_START}, StopSel={HIGHLIGHT_STOP}, '
+            'MaxWords=35, MinWords=15, MaxFragments=2, FragmentDelimiter=" … "'
+        )
+        queryset = queryset.extra(
+            where=["blog_post.search_vector @@ websearch_to_tsquery('english', %s)"],
+            params=[words],
+        )
+        return queryset.annotate(
+            # negated so that, like bm25, a lower rank is a better match
+            search_rank=RawSQL(
+                "-ts_rank(%s::float4[], blog_post.search_vector, websearch_to_tsquery('english', %s))",
+                (weights, words),
+            ),
+            search_snippet=RawSQL(
+                "ts_headline('english', blog_post.body, websearch_to_tsquery('english', %s), %s)",
+                (words, headline_options),
+            ),
+        ).order_by('search_rank', '-publish')
+
+    # no full-text support on this database, fall back to a plain scan
+    return _unranked(queryset.filter(Q(title__icontains=query) | Q(body__icontains=query)))
+
+
+def _unranked(queryset):
+    """
+    Gives results without a rank the same attributes as ranked ones.
+    """
+    return queryset.annotate(
+        search_rank=Value(0.0, output_field=FloatField()),
+        search_snippet=Value('', output_field=TextField()),
+    ).order_by('-publish')
+
+
+def highlight(snippet):
+    """
+    Escapes a search snippet and wraps the matched terms in <mark> tags.
+    """
+    if not snippet:
+        return ''
+    html = escape(snippet)
+    html = html.replace(HIGHLIGHT_START, '<mark>').replace(HIGHLIGHT_STOP, '</mark>')
+    return mark_safe(html)
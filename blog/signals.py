@@ -0,0 +1,153 @@
+from django.db.backends.signals import connection_created
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete
+from django.dispatch import receiver
+from django.utils import timezone
+from taggit.models import Tag
+
+from . import authorstats, caching, images, metrics, search, similar, sitemaps, tagstats, threads
+from .models import Comment, Post
+
+
+# keep the full-text index in step with post edits
+@receiver(post_save, sender=Post)
+def index_saved_post(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    search.index_post(instance)
+
+
+@receiver(post_delete, sender=Post)
+def unindex_deleted_post(sender, instance, **kwargs):
+    search.remove_post(instance.pk)
+
+
+@receiver(m2m_changed, sender=Post.tags.through)
+def reindex_retagged_post(sender, instance, action, **kwargs):
+    if action in ('post_add', 'post_remove', 'post_clear') and isinstance(instance, Post):
+        search.index_post(instance)
+
+
+# keep the per tag post counts and the (tag, publish) rows of tag pages in step,
+# connected first as the similar posts are read off those rows
+@receiver(post_save, sender=Post)
+def update_tag_stats(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    if created or instance.has_changed('status', 'publish'):
+        tagstats.sync_post(instance)
+
+
+@receiver(m2m_changed, sender=Post.tags.through)
+def update_retagged_tag_stats(sender, instance, action, **kwargs):
+    if action in ('post_add', 'post_remove', 'post_clear') and isinstance(instance, Post):
+        tagstats.sync_post(instance)
+
+
+@receiver(pre_delete, sender=Post)
+def update_deleted_tag_stats(sender, instance, **kwargs):
+    # before the rows go with the post, so the counts can be taken down
+    tagstats.sync_post(instance, deleting=True)
+
+
+# keep the precomputed similar posts in step with tags, status and publish date
+@receiver(post_save, sender=Post)
+def update_similar_posts(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    if created or instance.has_changed('status', 'publish'):
+        similar.update_post(instance)
+
+
+@receiver(m2m_changed, sender=Post.tags.through)
+def update_retagged_similar_posts(sender, instance, action, **kwargs):
+    if action in ('post_add', 'post_remove', 'post_clear') and isinstance(instance, Post):
+        similar.update_post(instance)
+
+
+# the dashboard totals of the authors whose posts or comments changed
+@receiver(post_save, sender=Post)
+@receiver(post_delete, sender=Post)
+def invalidate_author_stats(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    loaded = getattr(instance, '_loaded_values', None) or {}
+    # both authors when a post changes hands
+    authorstats.mark_stale(instance.author_id, loaded.get('author_id'))
+
+
+@receiver(post_save, sender=Comment)
+@receiver(post_delete, sender=Comment)
+def invalidate_commented_author_stats(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    authorstats.mark_post_stale(instance.post_id)
+
+
+# the visible comment count shown on the post, recounted off the (post, active) index
+@receiver(post_save, sender=Comment)
+@receiver(post_delete, sender=Comment)
+def update_comment_count(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    threads.refresh_counts(instance.post_id)
+
+
+# version based invalidation of cached pages and fragments
+@receiver(post_save, sender=Post)
+@receiver(post_delete, sender=Post)
+def invalidate_post_pages(sender, instance, **kwargs):
+    caching.bump('posts')
+
+
+@receiver(m2m_changed, sender=Post.tags.through)
+def touch_retagged_post(sender, instance, action, **kwargs):
+    if action in ('post_add', 'post_remove', 'post_clear') and isinstance(instance, Post):
+        # tags aren't a column, so record the change in updated for anything keyed on it
+        instance.updated = timezone.now()
+        Post.objects.filter(pk=instance.pk).update(updated=instance.updated)
+        caching.bump('posts')
+        sitemaps.bump(instance.publish)
+
+
+# the sitemap shards of the months a post was and is published in
+@receiver(post_save, sender=Post)
+def invalidate_sitemap_shards(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    loaded = getattr(instance, '_loaded_values', None) or {}
+    sitemaps.bump(instance.publish, loaded.get('publish'))
+
+
+@receiver(post_delete, sender=Post)
+def invalidate_deleted_sitemap_shard(sender, instance, **kwargs):
+    sitemaps.bump(instance.publish)
+
+
+@receiver(post_save, sender=Comment)
+@receiver(post_delete, sender=Comment)
+def invalidate_post_comments(sender, instance, **kwargs):
+    # comments on its own covers every comment, for the admin's cached counts
+    caching.bump(f'comments:{instance.post_id}', 'comments')
+
+
+@receiver(post_save, sender=Tag)
+@receiver(post_delete, sender=Tag)
+def invalidate_tag_names(sender, instance, **kwargs):
+    caching.bump('tags', 'posts')
+
+
+# responsive copies of uploaded images
+@receiver(post_save, sender=Post)
+def generate_image_variants(sender, instance, created, raw=False, **kwargs):
+    if raw or not (created or instance.has_changed('image')):
+        return
+    if instance.image:
+        images.schedule(instance)
+    elif instance.image_variants:
+        images.clear(instance)
+
+
+# time the queries of every connection for the request metrics
+@receiver(connection_created)
+def instrument_connection(sender, connection, **kwargs):
+    metrics.install(connection)
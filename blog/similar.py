@@ -0,0 +1,243 @@
+import heapq
+from collections import defaultdict
+from itertools import combinations
+
+from django.contrib.contenttypes.models import ContentType
+from django.db import connection, transaction
+from django.db.models import Count, Max, OuterRef, Subquery
+from taggit.models import TaggedItem
+
+from .models import Post, SimilarPost, TagPost
+
+# links kept per post, a few more than the detail page shows so losing one rarely leaves a gap
+KEPT = 8
+# PostQuerySet.similar_to() shows this many, posts left with fewer are recomputed
+SHOWN = 4
+# most posts a saved post is added to, best matches first, so a save in a huge tag stays
+# a bounded number of writes. The rest pick it up at the next `rebuild_similar_posts`
+MAX_OFFERS = 200
+# a saved post is compared with at most this many of the newest posts of each of its tags,
+# so a save costs the same in a tag of 50 posts or 50,000
+SCAN_PER_TAG = 500
+# during a rebuild, posts in tags smaller than this are counted one by one,
+# larger tags are only looked at through their newest posts
+LARGE_TAG = 100
+
+# ranks each post's links and deletes all but the best KEPT
+TRIM_SQL = """
+    DELETE FROM {table} WHERE id IN (
+        SELECT id FROM (
+            SELECT id, ROW_NUMBER() OVER (
+                PARTITION BY post_id ORDER BY score DESC, publish DESC, similar_id DESC
+            ) AS position
+            FROM {table} WHERE post_id IN ({ids})
+        ) ranked WHERE position > %s
+    )
+"""
+
+
+def _ranked(post):
+    """
+    The published posts sharing tags with post as (id, score, publish), best first.
+
+    Read off the (tag, publish) index of TagPost: the newest SCAN_PER_TAG
+    posts of each tag, then the tags each of those shares, two queries per
+    tag at most. Tags smaller than that are read whole, in bigger ones an
+    older post sharing several tags can be missed until the next rebuild.
+    """
+    tag_ids = list(post.tags.values_list('id', flat=True))
+    candidates = set()
+    for tag_id in tag_ids:
+        candidates.update(
+            TagPost.objects.filter(tag=tag_id).exclude(post=post)
+            .order_by('-publish', '-post')
+            .values_list('post_id', flat=True)[:SCAN_PER_TAG]
+        )
+    if not candidates:
+        return []
+    others = (
+        TagPost.objects.filter(post__in=candidates, tag__in=tag_ids)
+        .values('post').order_by()
+        .annotate(score=Count('id'), latest=Max('publish'))
+        .values_list('post', 'score', 'latest')
+    )
+    return sorted(others, key=lambda row: (row[1], row[2], row[0]), reverse=True)
+
+
+def _links(post_id, ranked):
+    return [
+        SimilarPost(post_id=post_id, similar_id=other_id, score=score, publish=publish)
+        for other_id, score, publish in ranked[:KEPT]
+    ]
+
+
+def _trim(post_ids):
+    table = SimilarPost._meta.db_table
+    post_ids = list(post_ids)
+    with connection.cursor() as cursor:
+        for start in range(0, len(post_ids), 500):
+            chunk = post_ids[start:start + 500]
+            cursor.execute(
+                TRIM_SQL.format(table=table, ids=', '.join(['%s'] * len(chunk))), [*chunk, KEPT],
+            )
+
+
+def _refill(post_ids):
+    """
+    Recomputes the links of the posts left with fewer than SHOWN of them.
+    """
+    if not post_ids:
+        return
+    counts = dict(
+        SimilarPost.objects.filter(post__in=post_ids).values('post').annotate(n=Count('id')).values_list('post', 'n')
+    )
+    for post in Post.published.filter(id__in=[i for i in post_ids if counts.get(i, 0) < SHOWN]):
+        SimilarPost.objects.filter(post=post).delete()
+        SimilarPost.objects.bulk_create(_links(post.id, _ranked(post)))
+
+
+def _worst_links(post_ids):
+    """
+    The KEPT-th best link of each of the posts as {post_id: (score, publish, similar_id)}, in one query.
+    Posts with fewer links are left out, any post can still join them.
+    """
+    # one short seek of the (post, -score, -publish) index per post
+    kept = SimilarPost.objects.filter(post=OuterRef('pk')).order_by('-score', '-publish', '-similar_id')
+    worst = (
+        Post.objects.filter(id__in=post_ids)
+        .annotate(worst=Subquery(kept.values('id')[KEPT - 1:KEPT]))
+        .values('worst')
+    )
+    rows = SimilarPost.objects.filter(id__in=worst).values_list('post_id', 'score', 'publish', 'similar_id')
+    return {post_id: (score, publish, similar_id) for post_id, score, publish, similar_id in rows}
+
+
+def update_post(post):
+    """
+    Recomputes the similar posts of a single post, in both directions.
+
+    Called whenever the post's tags, status or publish date change.
+    Drafts simply lose all their links. The post is only offered to the
+    posts sharing a tag with it that it would make the best KEPT of, at most
+    MAX_OFFERS of them, and only those are trimmed back to KEPT. With the
+    candidates read by _ranked(), a save reads and writes a bounded number
+    of rows however big its tags are.
+
+    Relies on the TagPost rows of the other posts, so callers updating
+    several posts at once sync their tags first, see moderation.catch_up().
+    """
+    with transaction.atomic():
+        linked_from = set(SimilarPost.objects.filter(similar=post).values_list('post_id', flat=True))
+        SimilarPost.objects.filter(post=post).delete()
+        SimilarPost.objects.filter(similar=post).delete()
+
+        ranked = _ranked(post) if post.status == Post.Status.PUBLISHED else []
+        others = [other_id for other_id, _, _ in ranked]
+        worst = _worst_links(others) if ranked else {}
+        offered = [
+            (other_id, score) for other_id, score, _ in ranked
+            if other_id not in worst or (score, post.publish, post.id) > worst[other_id]
+        ][:MAX_OFFERS]
+        links = _links(post.id, ranked)
+        links += [
+            SimilarPost(post_id=other_id, similar_id=post.id, score=score, publish=post.publish)
+            for other_id, score in offered
+        ]
+        SimilarPost.objects.bulk_create(links, batch_size=500)
+
+        _trim([other_id for other_id, _ in offered if other_id in worst])
+        _refill(linked_from.difference(others))
+
+
+def _top_links(post_id, tag_ids, members, newest, shared, order):
+    """
+    The best KEPT posts for one post as {id: score}, without looking at every post sharing a tag.
+
+    Posts in a small tag are counted directly. Of the posts in each combination
+    of large tags only the newest KEPT can make the cut, since every post in
+    the combination scores at least its size and the newer ones win ties.
+    """
+    small = [tag_id for tag_id in tag_ids if len(members[tag_id]) < LARGE_TAG]
+    large = [tag_id for tag_id in tag_ids if len(members[tag_id]) >= LARGE_TAG]
+
+    scores = {}
+    for tag_id in small:
+        for other_id in members[tag_id]:
+            scores[other_id] = scores.get(other_id, 0) + 1
+    scores.pop(post_id, None)
+    for other_id in scores:
+        scores[other_id] += sum(other_id in members[tag_id] for tag_id in large)
+
+    for size in range(len(large), 0, -1):
+        for subset in combinations(large, size):
+            taken = 0
+            for other_id in _intersection(subset, members, newest, shared):
+                if taken == KEPT:
+                    break
+                if other_id == post_id:
+                    continue
+                if other_id not in scores:
+                    scores[other_id] = sum(other_id in members[tag_id] for tag_id in large)
+                taken += 1
+
+    best = heapq.nlargest(KEPT, scores, key=lambda other_id: (scores[other_id], *order(other_id)))
+    return {other_id: scores[other_id] for other_id in best}
+
+
+def _intersection(tag_ids, members, newest, shared):
+    """
+    Posts tagged with all of tag_ids, newest first.
+    """
+    if len(tag_ids) == 1:
+        return newest[tag_ids[0]]
+    key = frozenset(tag_ids)
+    if key not in shared:
+        smallest = min(tag_ids, key=lambda tag_id: len(members[tag_id]))
+        others = [members[tag_id] for tag_id in tag_ids if tag_id != smallest]
+        shared[key] = [post_id for post_id in newest[smallest] if all(post_id in other for other in others)]
+    return shared[key]
+
+
+def rebuild(batch_size=1000):
+    """
+    Rebuilds the whole SimilarPost table from the tags of the published posts.
+    Returns the number of rows written.
+
+    Works in memory from one pass over the posts and one over their tags,
+    so the cost grows with the number of posts rather than the number of pairs.
+    """
+    content_type = ContentType.objects.get_for_model(Post)
+    publish = dict(Post.published.values_list('id', 'publish'))
+    tags_of = defaultdict(list)
+    members = defaultdict(set)
+    for post_id, tag_id in (
+        TaggedItem.objects.filter(content_type=content_type)
+        .values_list('object_id', 'tag_id').iterator(chunk_size=5000)
+    ):
+        if post_id in publish:
+            tags_of[post_id].append(tag_id)
+            members[tag_id].add(post_id)
+
+    def order(post_id):
+        return publish[post_id], post_id
+
+    newest = {tag_id: sorted(post_ids, key=order, reverse=True) for tag_id, post_ids in members.items()}
+    shared = {}
+    total = 0
+
+    with transaction.atomic():
+        SimilarPost.objects.all().delete()
+        batch = []
+        for post_id in sorted(tags_of):
+            links = _top_links(post_id, sorted(tags_of[post_id]), members, newest, shared, order)
+            batch += [
+                SimilarPost(post_id=post_id, similar_id=other_id, score=score, publish=publish[other_id])
+                for other_id, score in links.items()
+            ]
+            if len(batch) >= batch_size:
+                SimilarPost.objects.bulk_create(batch)
+                total += len(batch)
+                batch = []
+        SimilarPost.objects.bulk_create(batch)
+        total += len(batch)
+    return total
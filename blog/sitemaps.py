@@ -0,0 +1,145 @@
+from datetime import datetime, timezone
+from xml.sax.saxutils import escape
+
+from django.core.cache import cache
+from django.db.models import Count, Max
+from django.http import Http404, HttpResponse, StreamingHttpResponse
+from django.urls import reverse
+
+from . import caching
+from .models import Post
+
+XML_HEADER = '<?xml version="1.0" encoding="UTF-8"?>\n'
+XMLNS = 'http://www.sitemaps.org/schemas/sitemap/0.9'
+CONTENT_TYPE = 'application/xml; charset=utf-8'
+# urls written per chunk of a streamed shard
+CHUNK_ROWS = 500
+# a shard only changes when one of its posts does, so it can be kept for long
+SHARD_TIMEOUT = 7 * 24 * 60 * 60
+
+
+def month_of(moment):
+    """
+    The first instant of the UTC month of moment, shards are split on these.
+    """
+    moment = moment.astimezone(timezone.utc)
+    return datetime(moment.year, moment.month, 1, tzinfo=timezone.utc)
+
+
+def _next_month(month):
+    if month.month == 12:
+        return month.replace(year=month.year + 1, month=1)
+    return month.replace(month=month.month + 1)
+
+
+def version_name(month):
+    return f'sitemap:{month:%Y-%m}'
+
+
+def bump(*moments):
+    """
+    Invalidates the shards of the months of the given publish dates, None is skipped.
+    """
+    names = {version_name(month_of(moment)) for moment in moments if moment is not None}
+    if names:
+        caching.bump(*names)
+
+
+def months():
+    """
+    Every month from the first published post to the last, two index lookups.
+    """
+    dates = Post.published.order_by('publish').values_list('publish', flat=True)
+    first, last = dates.first(), dates.last()
+    if first is None:
+        return []
+    month, last = month_of(first), month_of(last)
+    result = []
+    while month <= last:
+        result.append(month)
+        month = _next_month(month)
+    return result
+
+
+def summaries(month_list):
+    """
+    Returns {month: (posts, last modified)} for the given months.
+
+    Each is cached under its shard's version, so after a change only
+    that month's posts are counted again.
+    """
+    current = caching.versions(*[version_name(month) for month in month_list])
+    keys = {
+        caching.make_key('sitemap-month', version_name(month), current[version_name(month)]): month
+        for month in month_list
+    }
+    found = cache.get_many(keys)
+    result = {}
+    for key, month in keys.items():
+        if key not in found:
+            row = Post.published.filter(publish__gte=month, publish__lt=_next_month(month)).aggregate(
+                posts=Count('id'), lastmod=Max('updated'),
+            )
+            found[key] = (row['posts'], row['lastmod'])
+            cache.set(key, found[key], SHARD_TIMEOUT)
+        result[month] = found[key]
+    return result
+
+
+def index_response(request):
+    """
+    The sitemap index, one shard per month with published posts.
+    """
+    parts = [XML_HEADER, f'<sitemapindex xmlns="{XMLNS}">\n']
+    for month, (posts, lastmod) in summaries(months()).items():
+        if not posts:
+            continue
+        url = request.build_absolute_uri(reverse('sitemap_month', args=[f'{month:%Y}', f'{month:%m}']))
+        parts.append(
+            f'<sitemap><loc>{escape(url)}</loc><lastmod>{lastmod.isoformat()}</lastmod></sitemap>\n'
+        )
+    parts.append('</sitemapindex>\n')
+    return HttpResponse(''.join(parts), content_type=CONTENT_TYPE)
+
+
+def _shard(base, month):
+    yield XML_HEADER + f'<urlset xmlns="{XMLNS}">\n'
+    rows = (
+        Post.published.filter(publish__gte=month, publish__lt=_next_month(month))
+        .order_by('publish', 'id').values_list('id', 'slug', 'updated')
+        .iterator(chunk_size=CHUNK_ROWS)
+    )
+    chunk = []
+    for post_id, slug, updated in rows:
+        url = base + reverse('blog:post_detail', args=[post_id, slug])
+        chunk.append(f'<url><loc>{escape(url)}</loc><lastmod>{updated.isoformat()}</lastmod></url>\n')
+        if len(chunk) == CHUNK_ROWS:
+            yield ''.join(chunk)
+            chunk = []
+    chunk.append('</urlset>\n')
+    yield ''.join(chunk)
+
+
+def shard_response(request, year, month):
+    """
+    The posts published in one month, streamed and cached until one of them changes.
+    """
+    try:
+        month = datetime(int(year), int(month), 1, tzinfo=timezone.utc)
+    except ValueError:
+        raise Http404('No such month.')
+    if not summaries([month])[month][0]:
+        raise Http404('No posts were published that month.')
+
+    current = caching.versions(version_name(month))
+    key = caching.make_key('sitemap', request.build_absolute_uri(), *current.items())
+    content = cache.get(key)
+    if content is not None:
+        caching.record('sitemap', hit=True)
+        return HttpResponse(content, content_type=CONTENT_TYPE)
+    caching.record('sitemap', hit=False)
+
+    base = request.build_absolute_uri('/').rstrip('/')
+    return StreamingHttpResponse(
+        caching.stream_and_store(key, _shard(base, month), SHARD_TIMEOUT), content_type=CONTENT_TYPE,
+    )
@@ -0,0 +1,240 @@
+import gzip
+import hashlib
+import inspect
+import json
+import os
+from collections import defaultdict
+from types import SimpleNamespace
+from urllib.parse import urlsplit
+
+from asgiref.sync import async_to_sync, iscoroutinefunction
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser
+from django.contrib.contenttypes.models import ContentType
+from django.db.models import Count, Max
+from django.test import RequestFactory
+from django.urls import resolve, reverse
+from taggit.models import TaggedItem
+
+from . import similar, views
+from .caching import CSRF_PLACEHOLDER
+from .models import Comment, Post, SimilarPost
+from .pagination import KeysetPaginator
+
+MANIFEST_NAME = 'manifest.json'
+# bump when the layout of the export changes, older builds are then redone from scratch
+MANIFEST_VERSION = 1
+
+# static pages can't carry a per-reader CSRF token, forms fetch one just before they are sent
+CSRF_SCRIPT = """<script>
+document.addEventListener('submit', function (event) {
+    var input = event.target.querySelector('input[name="csrfmiddlewaretoken"]');
+    if (!input || input.value !== '%(placeholder)s') return;
+    event.preventDefault();
+    fetch('%(url)s', {credentials: 'same-origin'})
+        .then(function (response) { return response.json(); })
+        .then(function (data) { input.value = data.token; event.target.submit(); });
+});
+</script>"""
+
+
+def _digest(*parts):
+    return hashlib.sha256(json.dumps(parts, default=str).encode()).hexdigest()[:32]
+
+
+def page_file(path, cursor=None):
+    """
+    Returns the file, relative to the output directory, holding the page at path.
+
+    Pages of a listing after the first are named after their cursor,
+    so the web server can map ``?cursor=...`` straight to a file.
+    """
+    name = f'page-{cursor}.html' if cursor else 'index.html'
+    return os.path.join(path.strip('/'), name)
+
+
+def plan(per_page=None):
+    """
+    Lists every exportable page with a fingerprint of everything shown on it.
+
+    A page whose fingerprint matches the last build is left alone. The whole plan
+    takes a handful of queries however many posts there are.
+
+    Returns:
+        A dict mapping each page's primary file to a job dict with the
+        url ``path``, ``query`` parameters, ``fingerprint`` and all its ``files``.
+    """
+    per_page = per_page or views.POSTS_PER_PAGE
+    posts = list(Post.published.order_by('-publish', '-id').values_list('id', 'slug', 'publish', 'updated'))
+    published = {post_id for post_id, *_ in posts}
+
+    content_type = ContentType.objects.get_for_model(Post)
+    tags_of = defaultdict(list)
+    tag_names = {}
+    for post_id, slug, name in (
+        TaggedItem.objects.filter(content_type=content_type)
+        .order_by('object_id', 'tag__slug')
+        .values_list('object_id', 'tag__slug', 'tag__name')
+        .iterator(chunk_size=5000)
+    ):
+        if post_id in published:
+            tags_of[post_id].append((slug, name))
+            tag_names[slug] = name
+
+    comments = {
+        post_id: (count, last)
+        for post_id, count, last in Comment.objects.filter(active=True)
+        .values('post_id').annotate(count=Count('id'), last=Max('updated'))
+        .values_list('post_id', 'count', 'last')
+    }
+
+    similar_shown = defaultdict(list)
+    for post_id, similar_id, updated in (
+        SimilarPost.objects.order_by('post_id', '-score', '-publish')
+        .values_list('post_id', 'similar_id', 'similar__updated')
+        .iterator(chunk_size=5000)
+    ):
+        if len(similar_shown[post_id]) < similar.SHOWN:
+            similar_shown[post_id].append((similar_id, updated))
+
+    jobs = {}
+    for post_id, slug, publish, updated in posts:
+        path = reverse('blog:post_detail', args=[post_id, slug])
+        fingerprint = _digest(updated, tags_of[post_id], comments.get(post_id), similar_shown[post_id])
+        jobs[page_file(path)] = {'path': path, 'query': {}, 'fingerprint': fingerprint, 'files': [page_file(path)]}
+
+    listings = [(reverse('blog:post_list'), None, posts)]
+    tagged = defaultdict(list)
+    for post in posts:
+        for slug, _ in tags_of[post[0]]:
+            tagged[slug].append(post)
+    for slug, tag_posts in sorted(tagged.items()):
+        listings.append((reverse('blog:post_list_by_tag', args=[slug]), tag_names[slug], tag_posts))
+
+    for path, tag_name, listing in listings:
+        jobs.update(_listing_jobs(path, tag_name, listing, tags_of, per_page))
+    return jobs
+
+
+def _listing_jobs(path, tag_name, listing, tags_of, per_page):
+    """
+    Jobs for every page of one listing, following the same keyset pages as the post list view.
+    """
+    # any change to a card shifts or alters the pages, so they share one fingerprint
+    fingerprint = _digest(tag_name, per_page, [(post[0], post[3], tags_of[post[0]]) for post in listing])
+    paginator = KeysetPaginator(Post.published.none(), per_page)
+    pages = [listing[start:start + per_page] for start in range(0, len(listing), per_page)] or [[]]
+
+    jobs = {}
+    cursor = None
+    for number, rows in enumerate(pages):
+        files = [page_file(path, cursor)]
+        if number + 1 < len(pages):
+            # the next page links back here with a backwards cursor, which shows the same rows
+            first = pages[number + 1][0]
+            files.append(page_file(path, paginator.encode_cursor(
+                SimpleNamespace(publish=first[2], id=first[0]), backwards=True,
+            )))
+        query = {'cursor': cursor} if cursor else {}
+        jobs[files[0]] = {'path': path, 'query': query, 'fingerprint': fingerprint, 'files': files}
+        if rows:
+            cursor = paginator.encode_cursor(SimpleNamespace(publish=rows[-1][2], id=rows[-1][0]))
+    return jobs
+
+
+def render_page(path, query):
+    """
+    Renders a page the way an anonymous reader gets it, bypassing the page cache.
+    CSRF tokens are left as placeholders for the script added to the page.
+    """
+    match = resolve(path)
+    site = urlsplit(settings.SITE_URL)
+    request = RequestFactory(SERVER_NAME=site.hostname or 'localhost').get(path, query)
+    request.user = AnonymousUser()
+    request.resolver_match = match
+    request.blog_csrf_placeholder = True
+
+    # the bare view, without the page cache or conditional GETs in front of it
+    view = inspect.unwrap(match.func)
+    if iscoroutinefunction(view):
+        response = async_to_sync(view)(request, *match.args, **match.kwargs)
+    else:
+        response = view(request, *match.args, **match.kwargs)
+    if response.status_code != 200:
+        raise ValueError(f'{path} returned {response.status_code}')
+
+    content = response.content.decode(response.charset)
+    if CSRF_PLACEHOLDER in content:
+        script = CSRF_SCRIPT % {'placeholder': CSRF_PLACEHOLDER, 'url': reverse('blog:csrf_token')}
+        content = content.replace('</body>', f'{script}</body>', 1)
+    return content.encode()
+
+
+def _write(target, data):
+    # written aside and renamed, the web server never sees half a file
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    temporary = f'{target}.tmp{os.getpid()}'
+    with open(temporary, 'wb') as handle:
+        handle.write(data)
+    os.replace(temporary, target)
+
+
+def write_page(output_dir, files, content):
+    """
+    Writes the page and a precompressed .gz copy under every one of its file names.
+    """
+    compressed = gzip.compress(content, compresslevel=9, mtime=0)
+    for name in files:
+        target = os.path.join(output_dir, name)
+        _write(target, content)
+        _write(f'{target}.gz', compressed)
+
+
+def render_batch(output_dir, jobs):
+    """
+    Renders and writes a batch of pages, runs in a worker process.
+    Returns the (key, job) pairs it wrote.
+    """
+    done = []
+    for key, job in jobs:
+        write_page(output_dir, job['files'], render_page(job['path'], job['query']))
+        done.append((key, job))
+    return done
+
+
+def remove_page(output_dir, files):
+    for name in files:
+        for target in (os.path.join(output_dir, name), os.path.join(output_dir, f'{name}.gz')):
+            try:
+                os.remove(target)
+            except FileNotFoundError:
+                pass
+        # drop directories left empty, up to the output directory
+        directory = os.path.dirname(os.path.join(output_dir, name))
+        while os.path.abspath(directory) != os.path.abspath(output_dir):
+            try:
+                os.rmdir(directory)
+            except OSError:
+                break
+            directory = os.path.dirname(directory)
+
+
+def load_manifest(output_dir):
+    """
+    Returns the pages recorded by the last build, empty when there was none.
+    """
+    try:
+        with open(os.path.join(output_dir, MANIFEST_NAME)) as handle:
+            manifest = json.load(handle)
+    except (FileNotFoundError, ValueError):
+        return {}
+    if manifest.get('version') != MANIFEST_VERSION:
+        return {}
+    return manifest.get('pages', {})
+
+
+def save_manifest(output_dir, pages):
+    _write(
+        os.path.join(output_dir, MANIFEST_NAME),
+        json.dumps({'version': MANIFEST_VERSION, 'pages': pages}, indent=1, sort_keys=True).encode(),
+    )
@@ -0,0 +1,207 @@
+import bisect
+import itertools
+import random
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.contrib.contenttypes.models import ContentType
+from django.db import connection, transaction
+from django.utils.text import slugify
+from taggit.models import Tag, TaggedItem
+
+from . import caching, search, similar, tagstats, threads
+from .models import Comment, Post, SimilarPost, TagPost
+
+# synthetic users are recognisable by their name, so they can be removed again
+USERNAME_PREFIX = 'synthetic-'
+
+WORDS = (
+    'django python query index cache page template view model field server client request response '
+    'async thread process worker queue latency throughput memory disk network database table row '
+    'column join filter order limit offset cursor search rank token parser render html css script '
+    'image upload storage deploy build release test bench profile trace metric log error retry '
+    'timeout session cookie user author reader comment post tag feed archive draft publish edit '
+    'campus student lecture project team event hackathon workshop mentor career intern code review '
+    'design system pattern api schema migration backup replica primary shard vector graph tree '
+    'list set map hash sort merge stream batch chunk buffer pipe socket packet route proxy'
+).split()
+
+
+def zipf_weights(count, exponent=1.1):
+    """
+    Cumulative weights of a Zipf distribution, a few items are very popular and most are rare.
+    """
+    return list(itertools.accumulate(1 / (rank ** exponent) for rank in range(1, count + 1)))
+
+
+def pick(rng, items, cumulative):
+    return items[bisect.bisect(cumulative, rng.random() * cumulative[-1])]
+
+
+class Generator:
+    """
+    Fills the database with a deterministic synthetic dataset.
+
+    The same seed and sizes always give the same users, posts, tags and comments,
+    so benchmark runs on different commits measure the same data.
+    Rows are written with bulk_create in batches, signals don't run, and the
+    search index and similar posts are rebuilt once at the end.
+
+    Args:
+        seed (int): Seed of the random generator.
+        batch_size (int): Rows written per INSERT.
+        until (datetime): Publish date of the newest post.
+        days (int): Posts are published over this many days before until.
+    """
+
+    def __init__(self, seed=42, batch_size=2000, until=None, days=5 * 365):
+        self.rng = random.Random(seed)
+        self.batch_size = batch_size
+        self.until = until or datetime(2025, 1, 1, tzinfo=dt_timezone.utc)
+        self.days = days
+        self.word_weights = zipf_weights(len(WORDS), exponent=1.0)
+
+    def words(self, count):
+        return [pick(self.rng, WORDS, self.word_weights) for _ in range(count)]
+
+    def users(self, count):
+        """
+        Creates the authors, all sharing one password hash since hashing is slow on purpose.
+        Returns their ids.
+        """
+        password = make_password('synthetic')
+        users = [
+            User(username=f'{USERNAME_PREFIX}{i}', email=f'{USERNAME_PREFIX}{i}@example.com', password=password)
+            for i in range(count)
+        ]
+        User.objects.bulk_create(users, batch_size=self.batch_size)
+        return list(
+            User.objects.filter(username__startswith=USERNAME_PREFIX).order_by('id').values_list('id', flat=True)
+        )
+
+    def tags(self, count):
+        """
+        Creates the tags and returns their ids, most popular first.
+        """
+        names = []
+        for i in range(count):
+            word = WORDS[i % len(WORDS)]
+            names.append(word if i < len(WORDS) else f'{word}-{i // len(WORDS)}')
+        existing = set(Tag.objects.filter(name__in=names).values_list('name', flat=True))
+        Tag.objects.bulk_create(
+            [Tag(name=name, slug=slugify(name)) for name in names if name not in existing],
+            batch_size=self.batch_size,
+        )
+        ids = dict(Tag.objects.filter(name__in=names).values_list('name', 'id'))
+        return [ids[name] for name in names]
+
+    def post(self, number, author_ids, published_ratio):
+        title = ' '.join(self.words(self.rng.randint(3, 8))).capitalize()
+        paragraphs = [
+            ' '.join(self.words(self.rng.randint(30, 120))).capitalize() + '.'
+            for _ in range(self.rng.randint(2, 8))
+        ]
+        publish = self.until - timedelta(seconds=self.rng.randrange(self.days * 24 * 60 * 60))
+        post = Post(
+            title=title[:100],
+            slug=f'{slugify(title)[:40]}-{number}',
+            body='\n\n'.join(paragraphs),
+            author_id=self.rng.choice(author_ids),
+            publish=publish,
+            status=Post.Status.PUBLISHED if self.rng.random() < published_ratio else Post.Status.DRAFT,
+        )
+        # bulk_create skips save(), so the derived fields are filled here
+        post.render()
+        return post
+
+    def posts(self, count, author_ids, tag_ids, published_ratio=0.9, max_tags=5):
+        """
+        Creates the posts with 1 to max_tags Zipf distributed tags each.
+        Yields the number of posts written and the ids of the published ones after every batch.
+        """
+        content_type = ContentType.objects.get_for_model(Post)
+        tag_weights = zipf_weights(len(tag_ids))
+        start = Post.objects.count()
+
+        for offset in range(0, count, self.batch_size):
+            batch = [
+                self.post(start + number, author_ids, published_ratio)
+                for number in range(offset, min(offset + self.batch_size, count))
+            ]
+            with transaction.atomic():
+                Post.objects.bulk_create(batch)
+                items = []
+                for post in batch:
+                    chosen = {pick(self.rng, tag_ids, tag_weights) for _ in range(self.rng.randint(1, max_tags))}
+                    items += [TaggedItem(content_type=content_type, object_id=post.id, tag_id=tag_id)
+                              for tag_id in sorted(chosen)]
+                TaggedItem.objects.bulk_create(items, batch_size=self.batch_size)
+            yield len(batch), [post.id for post in batch if post.status == Post.Status.PUBLISHED]
+
+    def comments(self, count, post_ids, active_ratio=0.95):
+        """
+        Creates comments on the given posts, skewed so that a few posts get most of them.
+        Yields the number written after every batch.
+        """
+        for offset in range(0, count, self.batch_size):
+            batch = []
+            for _ in range(min(self.batch_size, count - offset)):
+                # squaring a uniform number piles the comments onto the first posts
+                post_id = post_ids[int(len(post_ids) * self.rng.random() ** 2)]
+                name = ' '.join(self.words(2)).title()
+                batch.append(Comment(
+                    post_id=post_id,
+                    name=name,
+                    email=f'{slugify(name)}@example.com',
+                    body=' '.join(self.words(self.rng.randint(5, 60))).capitalize() + '.',
+                    active=self.rng.random() < active_ratio,
+                ))
+            Comment.objects.bulk_create(batch)
+            yield len(batch)
+
+    @staticmethod
+    def finish():
+        """
+        Rebuilds what signals would have kept up to date. Returns (indexed, similar rows).
+        """
+        indexed = search.rebuild_index()
+        pairs = similar.rebuild()
+        tagstats.rebuild()
+        threads.fill_paths()
+        threads.refresh_counts()
+        caching.bump('posts', 'tags')
+        return indexed, pairs
+
+
+def clear():
+    """
+    Deletes the synthetic users along with their posts and comments. Returns the number of users.
+    """
+    users = User.objects.filter(username__startswith=USERNAME_PREFIX)
+    count = users.count()
+    content_type = ContentType.objects.get_for_model(Post)
+    posts = f"""
+        SELECT id FROM {Post._meta.db_table}
+        WHERE author_id IN (SELECT id FROM {User._meta.db_table} WHERE username LIKE %s)
+    """
+    like = [f'{USERNAME_PREFIX}%']
+    with transaction.atomic():
+        # plain DELETEs, the per row signal handlers would take hours on a full dataset
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {Comment._meta.db_table} WHERE post_id IN ({posts})', like)
+            cursor.execute(
+                f'DELETE FROM {SimilarPost._meta.db_table} WHERE post_id IN ({posts}) OR similar_id IN ({posts})',
+                like * 2,
+            )
+            cursor.execute(f'DELETE FROM {TagPost._meta.db_table} WHERE post_id IN ({posts})', like)
+            cursor.execute(
+                f'DELETE FROM {TaggedItem._meta.db_table} WHERE content_type_id = %s AND object_id IN ({posts})',
+                [content_type.id, *like],
+            )
+            cursor.execute(f'DELETE FROM {Post._meta.db_table} WHERE id IN ({posts})', like)
+        users.delete()
+    search.rebuild_index()
+    tagstats.rebuild()
+    caching.bump('posts', 'tags')
+    return count
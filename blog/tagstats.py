@@ -0,0 +1,100 @@
+from django.db import transaction
+from django.db.models import Count, F, Max, OuterRef, Subquery
+
+from .models import Post, TagPost, TagStats
+
+# tags shown in the tag cloud, the most used ones
+CLOUD_TAGS = 30
+# number of font sizes the tag cloud spreads the tags over
+CLOUD_SIZES = 5
+
+
+def _refresh_latest(tag_ids):
+    # the newest publish of each tag is the first entry of its (tag, publish) index
+    newest = TagPost.objects.filter(tag=OuterRef('tag')).order_by('-publish').values('publish')[:1]
+    TagStats.objects.filter(tag__in=tag_ids).update(latest_publish=Subquery(newest))
+
+
+def sync_post(post, deleting=False):
+    """
+    Brings the TagPost rows and TagStats of a single post's tags in line with the post.
+
+    Called whenever the post's tags, status or publish date change, and
+    before it is deleted. Only the tags whose rows changed are touched: their
+    counts move by one and their newest publish date is read off the index.
+    """
+    with transaction.atomic():
+        existing = dict(TagPost.objects.filter(post=post).values_list('tag_id', 'publish'))
+        wanted = set()
+        if not deleting and post.status == Post.Status.PUBLISHED:
+            wanted = set(post.tags.values_list('id', flat=True))
+
+        added = wanted.difference(existing)
+        removed = set(existing).difference(wanted)
+        moved = {tag_id for tag_id in wanted.intersection(existing) if existing[tag_id] != post.publish}
+        if not (added or removed or moved):
+            return
+
+        TagPost.objects.filter(post=post, tag__in=removed).delete()
+        TagPost.objects.filter(post=post, tag__in=moved).update(publish=post.publish)
+        TagPost.objects.bulk_create([TagPost(tag_id=tag_id, post=post, publish=post.publish) for tag_id in added])
+
+        TagStats.objects.bulk_create([TagStats(tag_id=tag_id) for tag_id in added], ignore_conflicts=True)
+        TagStats.objects.filter(tag__in=added).update(post_count=F('post_count') + 1)
+        TagStats.objects.filter(tag__in=removed).update(post_count=F('post_count') - 1)
+        _refresh_latest(added | removed | moved)
+
+
+def rebuild(batch_size=1000):
+    """
+    Recomputes every TagPost row and TagStats from scratch. Returns the number of TagPost rows.
+
+    Used after bulk changes that skip the signals, e.g. synthetic data.
+    """
+    with transaction.atomic():
+        TagPost.objects.all().delete()
+        TagStats.objects.all().delete()
+        rows = (
+            Post.published.filter(tags__isnull=False)
+            .order_by()
+            .values_list('tags', 'id', 'publish')
+        )
+        batch = []
+        total = 0
+        for tag_id, post_id, publish in rows.iterator(chunk_size=batch_size):
+            batch.append(TagPost(tag_id=tag_id, post_id=post_id, publish=publish))
+            if len(batch) == batch_size:
+                TagPost.objects.bulk_create(batch)
+                total += len(batch)
+                batch = []
+        TagPost.objects.bulk_create(batch)
+        total += len(batch)
+
+        counts = TagPost.objects.values('tag').annotate(count=Count('id'), latest=Max('publish')).order_by()
+        TagStats.objects.bulk_create(
+            [TagStats(tag_id=row['tag'], post_count=row['count'], latest_publish=row['latest']) for row in counts],
+            batch_size=batch_size,
+        )
+    return total
+
+
+def cloud(limit=CLOUD_TAGS):
+    """
+    The most used tags, alphabetically, each with a size from 1 to CLOUD_SIZES.
+
+    Sizes follow the square root of the post counts, so a handful
+    of very popular tags don't shrink the rest to the same size.
+    """
+    stats = list(
+        TagStats.objects.filter(post_count__gt=0)
+        .select_related('tag')
+        .order_by('-post_count', 'tag__name')[:limit]
+    )
+    if not stats:
+        return []
+    high = stats[0].post_count ** 0.5
+    low = stats[-1].post_count ** 0.5
+    spread = high - low or 1
+    for entry in stats:
+        entry.size = 1 + round((entry.post_count ** 0.5 - low) / spread * (CLOUD_SIZES - 1))
+    return sorted(stats, key=lambda entry: entry.tag.name.lower())
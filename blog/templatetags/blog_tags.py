@@ -0,0 +1,106 @@
+from django import template
+from django.core.cache import cache
+from django.core.files.storage import default_storage
+
+from .. import caching, search, tagstats
+
+register = template.Library()
+
+
+@register.filter
+def highlight(snippet):
+    """
+    Renders a search snippet with the matched words wrapped in <mark> tags.
+    """
+    return search.highlight(snippet)
+
+
+@register.simple_tag(takes_context=True)
+def cursor_url(context, cursor):
+    """
+    Returns the query string for another page of the current list,
+    keeping the search query and any other parameters.
+    """
+    params = context['request'].GET.copy()
+    params.pop('page', None)
+    params['cursor'] = cursor
+    return f'?{params.urlencode()}'
+
+
+class FragmentNode(template.Node):
+    def __init__(self, nodelist, name, vary_on):
+        self.nodelist = nodelist
+        self.name = name
+        self.vary_on = vary_on
+
+    def render(self, context):
+        name = self.name.resolve(context)
+        key = caching.make_key(f'fragment:{name}', *(var.resolve(context) for var in self.vary_on))
+        content = cache.get(key)
+        if content is not None:
+            caching.record(name, hit=True)
+            return content
+        caching.record(name, hit=False)
+        content = self.nodelist.render(context)
+        cache.set(key, content, caching.timeout())
+        return content
+
+
+@register.tag
+def fragment(parser, token):
+    """
+    Caches a block of a template, like the built-in cache tag,
+    but counts hits and misses per fragment name.
+
+    Usage::
+
+        {% fragment 'post_card' post.id post.updated %}
+            ...
+        {% endfragment %}
+    """
+    bits = token.split_contents()
+    if len(bits) < 2:
+        raise template.TemplateSyntaxError(f"'{bits[0]}' tag requires a fragment name.")
+    nodelist = parser.parse(('endfragment',))
+    parser.delete_first_token()
+    return FragmentNode(
+        nodelist,
+        parser.compile_filter(bits[1]),
+        [parser.compile_filter(bit) for bit in bits[2:]],
+    )
+
+
+@register.inclusion_tag('blog/post/includes/responsive_image.html')
+def responsive_image(post, sizes='100vw', css_class='', eager=False):
+    """
+    Renders a post image as a <picture> with WebP and JPEG srcsets,
+    falling back to the original upload until its variants are generated.
+    """
+    srcsets = {}
+    largest = {}
+    for variant in post.image_variants or []:
+        url = default_storage.url(variant['name'])
+        srcsets.setdefault(variant['format'], []).append(f"{url} {variant['width']}w")
+        if variant['width'] >= largest.get(variant['format'], {}).get('width', 0):
+            largest[variant['format']] = variant
+    fallback = largest.get('jpeg')
+    return {
+        'post': post,
+        'src': default_storage.url(fallback['name']) if fallback else post.image.url,
+        'webp_srcset': ', '.join(srcsets.get('webp', [])),
+        'jpeg_srcset': ', '.join(srcsets.get('jpeg', [])),
+        'width': post.image_width,
+        'height': post.image_height,
+        'sizes': sizes,
+        'css_class': css_class,
+        'eager': eager,
+    }
+
+
+@register.inclusion_tag('blog/post/includes/tag_cloud.html')
+def tag_cloud(limit=tagstats.CLOUD_TAGS):
+    """
+    Renders the most used tags sized by their number of published posts,
+    read from the maintained TagStats rows.
+    """
+    return {'tags': tagstats.cloud(limit)}
@@ -1,3 +1,1740 @@
-from django.test import TestCase
+import base64
+import gzip
+import json
+import os
+import re
+import shutil
+import tempfile
+from datetime import timedelta
+from io import BytesIO, StringIO
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.core import mail as outbox
+from django.core.mail.backends import locmem
+from django.core.cache import cache
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import CommandError, call_command
+from django.db import OperationalError, connection, connections
+from django.test import Client, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from PIL import Image
+
+from . import authorstats, caching, exporter, importer, mail, metrics, moderation, newsletter, ratelimit, rendering, routing, search, similar, tagstats, threads
+from .models import COMMENT_MAX_DEPTH, AuthorStats, Comment, NewsletterDelivery, OutboundEmail, Post, SimilarPost, Subscriber, TagPost, TagStats
+
+# for tests about the database work behind a page, not the cache in front of it
+no_cache = override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}})
+
+
+@no_cache
+class PostSearchTests(TestCase):
+    """
+    Tests for the full-text search on the post list.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user(username='author', password='secret')
+        cls.title_hit = Post.objects.create(
+            title='Learning Django', body='A gentle start.', author=cls.author,
+            status=Post.Status.PUBLISHED,
+        )
+        cls.body_hit = Post.objects.create(
+            title='Weekly notes', body='This week we looked at Django and <b>templates</b>.',
+            author=cls.author, status=Post.Status.PUBLISHED,
+        )
+        cls.draft = Post.objects.create(
+            title='Django draft', body='Not ready yet.', author=cls.author,
+        )
+
+    def test_title_hits_rank_above_body_hits(self):
+        results = list(search.search_posts(Post.published.all(), 'django'))
+        self.assertEqual(results, [self.title_hit, self.body_hit])
+
+    def test_drafts_are_not_indexed(self):
+        results = search.search_posts(Post.published.all(), 'draft')
+        self.assertFalse(results.exists())
+
+    def test_index_follows_edits_tags_and_deletes(self):
+        self.body_hit.title = 'Python notes'
+        self.body_hit.save()
+        self.assertIn(self.body_hit, search.search_posts(Post.published.all(), 'python'))
+
+        self.title_hit.tags.add('tutorial')
+        self.assertIn(self.title_hit, search.search_posts(Post.published.all(), 'tutorial'))
+
+        self.title_hit.delete()
+        self.assertEqual(list(search.search_posts(Post.published.all(), 'django')), [self.body_hit])
+
+    def test_query_syntax_is_not_interpreted(self):
+        results = search.search_posts(Post.published.all(), 'django" OR (NEAR')
+        self.assertEqual(results.count(), 0)
+
+    def test_snippet_is_escaped_and_highlighted(self):
+        post = search.search_posts(Post.published.all(), 'templates').get()
+        self.assertEqual(
+            search.highlight(post.search_snippet),
+            'This week we looked at Django and &lt;b&gt;<mark>templates</mark>&lt;/b&gt;.',
+        )
+
+    def test_rebuild_index(self):
+        self.assertEqual(search.rebuild_index(), 2)
+        self.assertEqual(search.search_posts(Post.published.all(), 'django').count(), 2)
+
+    def test_post_list_search(self):
+        response = self.client.get(reverse('blog:post_list'), {'q': 'templates'})
+        self.assertContains(response, '<mark>templates</mark>')
+        self.assertNotContains(response, self.title_hit.title)
+
+
+class PostBodyStatsTests(TestCase):
+    """
+    Tests for the word count, reading time and excerpt stored on save.
+    """
+
+    def setUp(self):
+        self.author = User.objects.create_user(username='author', password='secret')
+
+    def test_stats_are_filled_on_save(self):
+        post = Post.objects.create(title='Long read', body='word ' * 650, author=self.author)
+        self.assertEqual(post.word_count, 650)
+        self.assertEqual(post.reading_time, 3)
+        self.assertEqual(post.excerpt, ' '.join(['word'] * 30) + ' …')
+
+        post.body = 'short'
+        post.save(update_fields=['body'])
+        post.refresh_from_db()
+        self.assertEqual((post.word_count, post.reading_time, post.excerpt), (1, 1, 'short'))
+
+    def test_saving_a_deferred_post_keeps_stats(self):
+        post = Post.objects.create(title='Deferred', body='one two three', author=self.author)
+        deferred = Post.objects.defer('body').get(pk=post.pk)
+        deferred.title = 'Renamed'
+        deferred.save()
+        post.refresh_from_db()
+        self.assertEqual((post.title, post.word_count), ('Renamed', 3))
+
+
+@no_cache
+class QueryBudgetTests(TestCase):
+    """
+    Pins the number of queries each page runs.
+    The budgets must not depend on how many posts, tags or comments are shown.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user(username='author', password='secret')
+        cls.posts = []
+        for i in range(12):
+            author = User.objects.create_user(username=f'writer{i}', password='secret')
+            post = Post.objects.create(
+                title=f'Post {i}', body='Some words here.', author=author,
+                status=Post.Status.PUBLISHED,
+            )
+            post.tags.add('django', f'tag{i}', f'extra{i}')
+            post.comments.create(name='Reader', email='reader@example.com', body='Nice!')
+            cls.posts.append(post)
+        for i in range(5):
+            Post.objects.create(title=f'Mine {i}', body='Draft words.', author=cls.author)
+
+    # the lists and post pages each spend one or two queries on their conditional GET validators,
+    # and the lists one on the tag cloud
+
+    def test_post_list(self):
+        with self.assertNumQueries(5):
+            self.client.get(reverse('blog:post_list'))
+        with mock.patch('blog.views.POSTS_PER_PAGE', 10), self.assertNumQueries(5):
+            self.client.get(reverse('blog:post_list'))
+
+    def test_post_list_by_tag(self):
+        with self.assertNumQueries(6):
+            self.client.get(reverse('blog:post_list_by_tag', args=['django']))
+
+    def test_post_list_search(self):
+        with self.assertNumQueries(3):
+            self.client.get(reverse('blog:post_list'), {'q': 'post'})
+
+    def test_post_detail(self):
+        post = self.posts[0]
+        for i in range(5):
+            post.comments.create(name=f'Reader {i}', email='reader@example.com', body='More!')
+        with self.assertNumQueries(5):
+            self.client.get(post.get_absolute_url())
+
+    def test_profile(self):
+        self.client.force_login(self.author)
+        # the first visit takes the author's totals
+        self.client.get(reverse('blog:profile'))
+        with self.assertNumQueries(5):
+            self.client.get(reverse('blog:profile'), {'status': 'drafts'})
+        # nothing published, so no tags to load
+        with self.assertNumQueries(4):
+            self.client.get(reverse('blog:profile'))
+
+
+@no_cache
+class KeysetPaginationTests(TestCase):
+    """
+    Tests for cursor pagination on the post list.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        author = User.objects.create_user(username='author', password='secret')
+        publish = timezone.now()
+        cls.posts = []
+        for i in range(10):
+            # pairs of posts share a publish date so the id has to break ties
+            post = Post.objects.create(
+                title=f'Post {i}', body='Words.', author=author, status=Post.Status.PUBLISHED,
+                publish=publish - timedelta(days=i // 2),
+            )
+            cls.posts.append(post)
+        cls.expected = list(Post.published.order_by('-publish', '-id'))
+
+    def walk(self, params=None):
+        pages = []
+        response = self.client.get(reverse('blog:post_list'), params or {})
+        while True:
+            page = response.context['posts']
+            pages.append(list(page))
+            if not page.has_next():
+                return pages, page
+            response = self.client.get(reverse('blog:post_list'), {**(params or {}), 'cursor': page.next_cursor})
+
+    def test_walks_every_post_once_in_order(self):
+        pages, last = self.walk()
+        self.assertEqual([len(page) for page in pages], [4, 4, 2])
+        self.assertEqual([post for page in pages for post in page], self.expected)
+
+        # and back again from the last page
+        response = self.client.get(reverse('blog:post_list'), {'cursor': last.previous_cursor})
+        self.assertEqual(list(response.context['posts']), self.expected[4:8])
+        response = self.client.get(reverse('blog:post_list'), {'cursor': response.context['posts'].previous_cursor})
+        self.assertEqual(list(response.context['posts']), self.expected[:4])
+        self.assertFalse(response.context['posts'].has_previous())
+
+    def test_search_results_keep_relevance_order(self):
+        pages, last = self.walk({'q': 'post'})
+        results = list(search.search_posts(Post.published.all(), 'post').order_by('search_rank', '-id'))
+        self.assertEqual([post for page in pages for post in page], results)
+
+    def test_bad_cursor_loads_first_page(self):
+        response = self.client.get(reverse('blog:post_list'), {'cursor': 'not-a-cursor'})
+        self.assertEqual(list(response.context['posts']), self.expected[:4])
+
+        # cursors that decode but carry values no key can have
+        self.posts[0].tags.add('python')
+        for values in ([None, None], [{}, 1], [[1], 1], ['', 1], ['2024-01-01T00:00:00', 'x']):
+            cursor = base64.urlsafe_b64encode(json.dumps([0, values]).encode()).decode()
+            response = self.client.get(reverse('blog:post_list'), {'cursor': cursor})
+            self.assertEqual(list(response.context['posts']), self.expected[:4], values)
+            response = self.client.get(reverse('blog:post_list_by_tag', args=['python']), {'cursor': cursor})
+            self.assertEqual(list(response.context['posts']), [self.posts[0]], values)
+
+    def test_links_keep_the_search_query(self):
+        response = self.client.get(reverse('blog:post_list'), {'q': 'post'})
+        self.assertContains(response, '?q=post&amp;cursor=')
+
+
+class SimilarPostTests(TestCase):
+    """
+    Tests for the precomputed similar posts.
+    """
+
+    def setUp(self):
+        author = User.objects.create_user(username='author', password='secret')
+        self.post = Post.objects.create(title='Main', body='Words.', author=author, status=Post.Status.PUBLISHED)
+        self.close = Post.objects.create(title='Close', body='Words.', author=author, status=Post.Status.PUBLISHED)
+        self.far = Post.objects.create(title='Far', body='Words.', author=author, status=Post.Status.PUBLISHED)
+        self.draft = Post.objects.create(title='Draft', body='Words.', author=author)
+        self.post.tags.add('django', 'python')
+        self.close.tags.add('django', 'python')
+        self.far.tags.add('python')
+        self.draft.tags.add('django', 'python')
+
+    def similar(self, post):
+        return list(Post.published.similar_to(post))
+
+    def test_ranked_by_shared_tags(self):
+        self.assertEqual(self.similar(self.post), [self.close, self.far])
+        self.assertEqual(self.similar(self.far), [self.close, self.post])
+
+    def test_follows_tag_status_and_publish_changes(self):
+        self.close.tags.remove('django')
+        self.assertEqual(self.similar(self.post), [self.far, self.close])
+
+        self.draft.status = Post.Status.PUBLISHED
+        self.draft.save()
+        self.assertEqual(self.similar(self.post), [self.draft, self.far, self.close])
+
+        self.close.publish = timezone.now() + timedelta(days=1)
+        self.close.save()
+        self.assertEqual(self.similar(self.post), [self.draft, self.close, self.far])
+
+        self.draft.status = Post.Status.DRAFT
+        self.draft.save()
+        self.assertEqual(self.similar(self.post), [self.close, self.far])
+
+    def test_rebuild_matches_incremental_updates(self):
+        links = sorted(SimilarPost.objects.values_list('post', 'similar', 'score', 'publish'))
+        self.assertEqual(similar.rebuild(batch_size=2), len(links))
+        self.assertEqual(sorted(SimilarPost.objects.values_list('post', 'similar', 'score', 'publish')), links)
+
+    def test_only_the_best_links_are_kept(self):
+        author = User.objects.get(username='author')
+        now = timezone.now()
+        for i in range(similar.KEPT + 3):
+            extra = Post.objects.create(
+                title=f'Extra {i}', body='Words.', author=author,
+                status=Post.Status.PUBLISHED, publish=now - timedelta(days=i + 1),
+            )
+            extra.tags.add('python')
+
+        links = SimilarPost.objects.filter(post=self.far)
+        self.assertEqual(links.count(), similar.KEPT)
+        # ties on score go to the newest posts
+        self.assertEqual(self.similar(self.far)[:2], [self.close, self.post])
+
+        # an old post beats none of the full posts' links, so it is only linked from itself
+        old = Post.objects.create(
+            title='Old', body='Words.', author=author, status=Post.Status.PUBLISHED, publish=now - timedelta(days=365),
+        )
+        with CaptureQueriesContext(connection) as captured:
+            old.tags.add('python')
+        self.assertFalse(any('ROW_NUMBER' in query['sql'] for query in captured.captured_queries))
+        self.assertEqual(SimilarPost.objects.filter(post=old).count(), similar.KEPT)
+        self.assertFalse(SimilarPost.objects.filter(similar=old).exists())
+
+        incremental = sorted(SimilarPost.objects.values_list('post', 'similar', 'score'))
+        similar.rebuild()
+        self.assertEqual(sorted(SimilarPost.objects.values_list('post', 'similar', 'score')), incremental)
+
+        # posts left with too few links after a removal are recomputed
+        for post in [self.close, self.post, self.far]:
+            post.status = Post.Status.DRAFT
+            post.save()
+        for post in Post.published.all():
+            self.assertGreaterEqual(SimilarPost.objects.filter(post=post).count(), similar.SHOWN)
+
+        # a save only compares the newest posts of each tag
+        with mock.patch('blog.similar.SCAN_PER_TAG', 3):
+            newest = Post.objects.create(title='Newest', body='Words.', author=author, status=Post.Status.PUBLISHED)
+            newest.tags.add('python')
+        self.assertEqual(
+            list(newest.similar_links.order_by('-publish').values_list('similar__title', flat=True)),
+            ['Extra 0', 'Extra 1', 'Extra 2'],
+        )
+
+
+class CachingTests(TestCase):
+    """
+    Tests for the page and fragment caches and their invalidation.
+    """
+
+    def setUp(self):
+        cache.clear()
+        caching.reset_stats()
+        self.author = User.objects.create_user(username='author', password='secret')
+        self.post = Post.objects.create(
+            title='Cached post', body='Words.', author=self.author, status=Post.Status.PUBLISHED,
+        )
+        self.post.tags.add('django')
+
+    def test_list_is_served_from_cache_until_a_post_changes(self):
+        url = reverse('blog:post_list')
+        self.client.get(url)
+        with self.assertNumQueries(0):
+            response = self.client.get(url)
+        self.assertContains(response, 'Cached post')
+
+        self.post.title = 'Renamed post'
+        self.post.save()
+        self.assertContains(self.client.get(url), 'Renamed post')
+        self.assertEqual(caching.stats()['post_list'], {'hits': 1, 'misses': 2, 'hit_ratio': 0.3333})
+
+    def test_detail_shows_new_comments_immediately(self):
+        url = self.post.get_absolute_url()
+        self.client.get(url)
+        with self.assertNumQueries(0):
+            self.client.get(url)
+
+        response = self.client.post(url, {'name': 'Reader', 'email': 'reader@example.com', 'body': 'Fresh comment'})
+        response = self.client.get(response.url)
+        self.assertContains(response, 'Fresh comment')
+        self.assertContains(response, 'Your comment has been submitted successfully!')
+
+        # the page with the flash message was not cached, the next one is fresh
+        response = self.client.get(url)
+        self.assertContains(response, 'Fresh comment')
+        self.assertNotContains(response, 'Your comment has been submitted successfully!')
+
+    def test_cached_page_carries_each_readers_csrf_token(self):
+        url = self.post.get_absolute_url()
+        self.client.get(url)
+        other = self.client_class(enforce_csrf_checks=True)
+        response = other.get(url)
+        self.assertEqual(caching.stats()['post_detail']['hits'], 1)
+        self.assertNotContains(response, caching.CSRF_PLACEHOLDER)
+        token = re.search(r'name="csrfmiddlewaretoken" value="([^"]+)"', response.content.decode()).group(1)
+        response = other.post(url, {
+            'name': 'Reader', 'email': 'reader@example.com', 'body': 'Hi', 'csrfmiddlewaretoken': token,
+        })
+        self.assertEqual(response.status_code, 302)
+
+    def test_logged_in_users_skip_the_page_cache(self):
+        self.client.force_login(self.author)
+        self.client.get(reverse('blog:post_list'))
+        self.client.get(reverse('blog:post_list'))
+        self.assertNotIn('post_list', caching.stats())
+        self.assertEqual(caching.stats()['post_card']['hits'], 1)
+
+    def test_tag_changes_refresh_the_cards(self):
+        self.client.force_login(self.author)
+        self.client.get(reverse('blog:post_list'))
+        self.post.tags.set(['python'])
+        self.assertContains(self.client.get(reverse('blog:post_list')), 'python')
+
+
+class MailQueueTests(TestCase):
+    """
+    Tests for the outbound mail queue behind post_share.
+    """
+
+    def setUp(self):
+        author = User.objects.create_user(username='author', password='secret')
+        self.post = Post.objects.create(
+            title='Shared post', body='Words.', author=author, status=Post.Status.PUBLISHED,
+        )
+
+    def test_share_only_enqueues(self):
+        response = self.client.post(reverse('blog:post_share', args=[self.post.id]), {
+            'name': 'Ada', 'email': 'ada@example.com', 'to': 'friend@example.com', 'comments': 'Read it',
+        })
+        self.assertTrue(response.context['sent'])
+        self.assertEqual(len(outbox.outbox), 0)
+        queued = OutboundEmail.objects.get()
+        self.assertEqual(queued.recipients, ['friend@example.com'])
+
+        call_command('send_queued_mail', stdout=StringIO())
+        self.assertEqual(len(outbox.outbox), 1)
+        self.assertEqual(outbox.outbox[0].subject, 'Ada recommends you read Shared post')
+        queued.refresh_from_db()
+        self.assertEqual((queued.status, queued.attempts), (OutboundEmail.Status.SENT, 1))
+
+    def test_batch_reuses_one_connection(self):
+        for i in range(3):
+            mail.enqueue('Hello', 'Body', [f'reader{i}@example.com'])
+        with mock.patch('blog.mail.get_connection', wraps=mail.get_connection) as get_connection:
+            self.assertEqual(mail.send_queued(batch_size=10), (3, 0))
+        self.assertEqual(get_connection.call_count, 1)
+
+    def test_failures_back_off_then_give_up(self):
+        queued = mail.enqueue('Hello', 'Body', ['reader@example.com'])
+        with mock.patch('django.core.mail.EmailMessage.send', side_effect=OSError('connection reset')), \
+                self.assertLogs('blog.mail', 'WARNING'):
+            self.assertEqual(mail.send_queued(), (0, 1))
+            queued.refresh_from_db()
+            self.assertEqual(queued.status, OutboundEmail.Status.QUEUED)
+            self.assertEqual(queued.last_error, 'connection reset')
+            self.assertGreater(queued.next_attempt, timezone.now())
+
+            # not due yet
+            self.assertEqual(mail.send_queued(), (0, 0))
+
+            for attempt in range(4):
+                OutboundEmail.objects.update(next_attempt=timezone.now())
+                mail.send_queued(max_attempts=5)
+        queued.refresh_from_db()
+        self.assertEqual((queued.status, queued.attempts), (OutboundEmail.Status.FAILED, 5))
+
+
+class NewsletterTests(TestCase):
+    """
+    Tests for the newsletter fan-out to subscribers.
+    """
+
+    def setUp(self):
+        author = User.objects.create_user(username='author', password='secret')
+        Post.objects.create(title='Fresh post', body='Words.', author=author, status=Post.Status.PUBLISHED)
+        Post.objects.create(
+            title='Old post', body='Words.', author=author, status=Post.Status.PUBLISHED,
+            publish=timezone.now() - timedelta(days=30),
+        )
+        Subscriber.objects.bulk_create([Subscriber(email=f'reader{i}@example.com') for i in range(25)])
+
+    def test_sends_the_digest_once_to_everyone(self):
+        call_command('send_newsletter', '--chunk-size', '4', '--workers', '3', stdout=StringIO())
+        self.assertEqual(len(outbox.outbox), 25)
+        self.assertEqual(len({message.to[0] for message in outbox.outbox}), 25)
+        self.assertIn('Fresh post', outbox.outbox[0].body)
+        self.assertNotIn('Old post', outbox.outbox[0].body)
+
+        # a finished newsletter isn't resumed, the next run is a new one
+        call_command('send_newsletter', stdout=StringIO())
+        self.assertEqual(NewsletterDelivery.objects.count(), 50)
+
+    def test_interrupted_run_resumes(self):
+        letter = newsletter.create_newsletter('Digest')
+        real_send = locmem.EmailBackend.send_messages
+        calls = []
+
+        def flaky_send(backend, messages):
+            calls.append(messages)
+            # halfway through the second chunk
+            if len(calls) == 15:
+                raise OSError('connection lost')
+            return real_send(backend, messages)
+
+        with mock.patch.object(locmem.EmailBackend, 'send_messages', flaky_send), \
+                self.assertLogs('blog.newsletter', 'ERROR'):
+            self.assertEqual(newsletter.dispatch(letter, chunk_size=10, workers=1), (19, 6))
+        letter.refresh_from_db()
+        self.assertIsNone(letter.finished)
+        self.assertEqual(letter.deliveries.count(), 19)
+
+        first_run = [message.to[0] for message in outbox.outbox]
+        outbox.outbox.clear()
+        call_command('send_newsletter', stdout=StringIO())
+        self.assertEqual(len(outbox.outbox), 6)
+        # nobody got the digest twice
+        recipients = first_run + [message.to[0] for message in outbox.outbox]
+        self.assertEqual(len(set(recipients)), 25)
+        self.assertEqual(len(recipients), 25)
+        letter.refresh_from_db()
+        self.assertIsNotNone(letter.finished)
+        self.assertEqual(letter.deliveries.count(), 25)
+
+
+class BodyRenderingTests(TestCase):
+    """
+    Tests for the body html rendered on save.
+    """
+
+    def setUp(self):
+        self.author = User.objects.create_user(username='author', password='secret')
+
+    def test_plain_text_matches_linebreaks(self):
+        post = Post.objects.create(title='Plain', body='First <b>line</b>\nsecond\n\nNext', author=self.author)
+        self.assertEqual(post.body_html, '<p>First &lt;b&gt;line&lt;/b&gt;<br>second</p>\n\n<p>Next</p>')
+        self.assertEqual(post.rendered_version, rendering.RENDERER_VERSION)
+
+    def test_markdown_is_sanitised_with_anchors_and_lazy_images(self):
+        body = (
+            '## Getting started\n\nSome **bold** text. ![Logo](/media/logo.png)\n\n'
+            '## Getting started\n\n[bad](javascript:alert(1)) [good](https://example.com)\n\n'
+            '<script>alert("x")</script><p onclick="steal()">raw</p>'
+        )
+        post = Post.objects.create(
+            title='Markdown', body=body, body_format=Post.BodyFormat.MARKDOWN, author=self.author,
+        )
+        self.assertIn('<h2 id="getting-started">Getting started</h2>', post.body_html)
+        self.assertIn('<h2 id="getting-started-2">Getting started</h2>', post.body_html)
+        self.assertIn('<img alt="Logo" src="/media/logo.png" loading="lazy" decoding="async">', post.body_html)
+        self.assertIn('<a>bad</a>', post.body_html)
+        self.assertIn('<a href="https://example.com" rel="nofollow noopener">good</a>', post.body_html)
+        self.assertNotIn('script', post.body_html)
+        self.assertNotIn('onclick', post.body_html)
+        self.assertTrue(post.excerpt.startswith('Getting started Some bold text.'))
+
+    def test_malformed_links_are_dropped(self):
+        post = Post.objects.create(
+            title='Broken links', body='[x](http://[oops)\n\n<a href="http://[::1">raw</a> <img src="http://[bad">',
+            body_format=Post.BodyFormat.MARKDOWN, author=self.author,
+        )
+        self.assertIn('<a>x</a>', post.body_html)
+        self.assertIn('<a>raw</a>', post.body_html)
+        self.assertIn('<img loading="lazy" decoding="async">', post.body_html)
+        self.assertEqual(rendering.clean_html('<a href="http://[::1">raw</a>'), '<a>raw</a>')
+
+    def test_detail_outputs_stored_html(self):
+        post = Post.objects.create(
+            title='Shown', body='# Title\n\n*hello*', body_format=Post.BodyFormat.MARKDOWN,
+            author=self.author, status=Post.Status.PUBLISHED,
+        )
+        self.assertContains(self.client.get(post.get_absolute_url()), '<p><em>hello</em></p>', html=False)
+
+    def test_rerender_refreshes_stale_posts(self):
+        post = Post.objects.create(title='Stale', body='text', author=self.author)
+        Post.objects.filter(pk=post.pk).update(body_html='', rendered_version=0)
+        call_command('rerender_posts', stdout=StringIO())
+        post.refresh_from_db()
+        self.assertEqual((post.body_html, post.rendered_version), ('<p>text</p>', rendering.RENDERER_VERSION))
+
+
+class ImageVariantTests(TestCase):
+    """
+    Tests for the responsive image variants of post images.
+    """
+
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root)
+        settings_override = override_settings(
+            MEDIA_ROOT=self.media_root, BLOG_IMAGE_WORKERS=0, BLOG_IMAGE_WIDTHS=[480, 960],
+        )
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.author = User.objects.create_user(username='author', password='secret')
+
+    def upload(self, size=(1200, 600), mode='RGBA', name='photo.png'):
+        buffer = BytesIO()
+        Image.new(mode, size, (200, 30, 30, 128) if mode == 'RGBA' else (200, 30, 30)).save(buffer, 'PNG')
+        return SimpleUploadedFile(name, buffer.getvalue(), content_type='image/png')
+
+    def test_variants_are_generated_on_upload(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            post = Post.objects.create(
+                title='Pictured', body='Words.', author=self.author, status=Post.Status.PUBLISHED,
+                image=self.upload(),
+            )
+        post.refresh_from_db()
+        self.assertEqual((post.image_width, post.image_height), (1200, 600))
+        self.assertEqual(
+            [(v['format'], v['width'], v['height']) for v in post.image_variants],
+            [('webp', 480, 240), ('jpeg', 480, 240), ('webp', 960, 480), ('jpeg', 960, 480)],
+        )
+        for variant in post.image_variants:
+            self.assertTrue(os.path.exists(os.path.join(self.media_root, variant['name'])))
+
+        response = self.client.get(post.get_absolute_url())
+        self.assertContains(response, 'type="image/webp"')
+        self.assertContains(response, 'width="1200" height="600"')
+        self.assertContains(response, '960w')
+
+    def test_replacing_the_image_removes_old_variants(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            post = Post.objects.create(title='Pictured', body='Words.', author=self.author, image=self.upload())
+        post.refresh_from_db()
+        old_names = [variant['name'] for variant in post.image_variants]
+
+        post.image = self.upload(size=(300, 200), mode='RGB', name='small.png')
+        with self.captureOnCommitCallbacks(execute=True):
+            post.save()
+        post.refresh_from_db()
+        self.assertEqual([(v['format'], v['width']) for v in post.image_variants], [('webp', 300), ('jpeg', 300)])
+        for name in old_names:
+            self.assertFalse(os.path.exists(os.path.join(self.media_root, name)))
+
+    def test_backfill_command(self):
+        post = Post.objects.create(title='Pictured', body='Words.', author=self.author)
+        Post.objects.filter(pk=post.pk).update(image=default_storage.save('images/blog/old.png', self.upload()))
+        call_command('generate_image_variants', '--workers', '1', stdout=StringIO())
+        post.refresh_from_db()
+        self.assertEqual(len(post.image_variants), 4)
+
+
+class AsyncViewTests(TestCase):
+    """
+    Tests for the async read path, served through the ASGI handler.
+    """
+
+    def setUp(self):
+        cache.clear()
+        caching.reset_stats()
+        self.author = User.objects.create_user(username='author', password='secret')
+        self.post = Post.objects.create(
+            title='Async post', body='Words.', author=self.author, status=Post.Status.PUBLISHED,
+        )
+        self.post.tags.add('django')
+
+    async def test_list_and_tag_pages(self):
+        response = await self.async_client.get(reverse('blog:post_list'))
+        self.assertContains(response, 'Async post')
+        response = await self.async_client.get(reverse('blog:post_list_by_tag', args=['django']))
+        self.assertContains(response, 'Async post')
+        response = await self.async_client.get(reverse('blog:post_list_by_tag', args=['missing']))
+        self.assertEqual(response.status_code, 404)
+
+    async def test_anonymous_pages_are_cached(self):
+        url = self.post.get_absolute_url()
+        await self.async_client.get(url)
+        response = await self.async_client.get(url)
+        self.assertContains(response, 'Async post')
+        self.assertEqual(caching.stats()['post_detail'], {'hits': 1, 'misses': 1, 'hit_ratio': 0.5})
+
+        await self.async_client.aforce_login(self.author)
+        await self.async_client.get(url)
+        self.assertEqual(caching.stats()['post_detail']['misses'], 1)
+
+    async def test_comment_and_share(self):
+        url = self.post.get_absolute_url()
+        response = await self.async_client.post(url, {'name': 'Reader', 'email': 'r@example.com', 'body': 'Async hi'})
+        self.assertEqual(response.status_code, 302)
+        response = await self.async_client.get(url)
+        self.assertContains(response, 'Async hi')
+
+        response = await self.async_client.post(reverse('blog:post_share', args=[self.post.id]), {
+            'name': 'Reader', 'email': 'r@example.com', 'to': 'friend@example.com', 'comments': '',
+        })
+        self.assertEqual(response.status_code, 200)
+        email = await OutboundEmail.objects.aget()
+        self.assertEqual(email.recipients, ['friend@example.com'])
+
+
+@no_cache
+class StaticSiteTests(TestCase):
+    """
+    Tests for the incremental static export.
+    """
+
+    def setUp(self):
+        self.output = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.output)
+        self.author = User.objects.create_user(username='author', password='secret')
+        now = timezone.now()
+        self.posts = []
+        for i in range(6):
+            post = Post.objects.create(
+                title=f'Static {i}', body='Words.', author=self.author,
+                status=Post.Status.PUBLISHED, publish=now - timedelta(days=i),
+            )
+            post.tags.add('django')
+            self.posts.append(post)
+
+    def export(self, *args):
+        out = StringIO()
+        call_command('export_static_site', '--output', self.output, '--workers', '0', *args, stdout=out)
+        return out.getvalue()
+
+    def read(self, name):
+        with open(os.path.join(self.output, name), 'rb') as handle:
+            return handle.read()
+
+    def test_exports_every_page_with_gzip_copies(self):
+        self.assertIn('Rendered 10 of 10 pages', self.export())
+        # 6 posts, the list and the tag page each have 2 pages
+        detail = self.posts[0].get_absolute_url().strip('/') + '/index.html'
+        self.assertIn(b'Static 0', self.read(detail))
+        self.assertEqual(gzip.decompress(self.read(detail + '.gz')), self.read(detail))
+
+        first_page = self.read('blog/index.html').decode()
+        self.assertIn('Static 3', first_page)
+        self.assertNotIn('Static 4', first_page)
+        cursor = re.search(r'\?cursor=([\w-]+)', first_page).group(1)
+        second_page = self.read(f'blog/page-{cursor}.html').decode()
+        self.assertIn('Static 4', second_page)
+        # the link back to the first page is served by an alias of it
+        back = re.search(r'\?cursor=([\w-]+)', second_page).group(1)
+        self.assertEqual(self.read(f'blog/page-{back}.html').decode(), first_page)
+        self.assertTrue(os.path.exists(os.path.join(self.output, 'blog/tag/django/index.html')))
+
+        self.assertIn(caching.CSRF_PLACEHOLDER, first_page)
+        self.assertIn(reverse('blog:csrf_token'), first_page)
+
+    def test_rebuild_only_renders_changed_pages(self):
+        self.export()
+        self.assertIn('Rendered 0 of 10 pages', self.export())
+
+        self.posts[5].comments.create(name='Reader', email='r@example.com', body='New comment')
+        self.assertIn('Rendered 1 of 10 pages', self.export())
+        self.assertIn(b'New comment', self.read(self.posts[5].get_absolute_url().strip('/') + '/index.html'))
+
+        for post in self.posts[4:]:
+            post.status = Post.Status.DRAFT
+            post.save()
+        # both posts are gone, the listings lose their second page and the others their similar posts
+        self.assertIn('Rendered 6 of 6 pages and removed 4', self.export())
+        self.assertFalse(os.path.exists(os.path.join(self.output, self.posts[5].get_absolute_url().strip('/'))))
+        self.assertEqual(
+            sorted(name for name in os.listdir(os.path.join(self.output, 'blog')) if name.startswith('page-')), [],
+        )
+
+    def test_csrf_token_endpoint(self):
+        response = self.client.get(reverse('blog:csrf_token'))
+        self.assertTrue(response.json()['token'])
+
+
+class SyntheticDataTests(TestCase):
+    """
+    Tests for the synthetic dataset generator and the benchmark command.
+    """
+
+    def generate(self, seed=7):
+        call_command(
+            'generate_synthetic_data', '--clear', '--users', '3', '--posts', '30', '--tags', '12',
+            '--comments', '80', '--seed', str(seed), '--batch-size', '7', stdout=StringIO(),
+        )
+        return (
+            list(Post.objects.order_by('id').values_list('title', 'status', 'publish', 'author__username')),
+            sorted(Post.objects.values_list('slug', 'tags__name')),
+            list(Comment.objects.order_by('id').values_list('post__slug', 'body', 'active')),
+        )
+
+    def test_same_seed_gives_same_data(self):
+        first = self.generate()
+        self.assertEqual(len(first[0]), 30)
+        self.assertEqual(len(first[2]), 80)
+        self.assertEqual(self.generate(), first)
+        self.assertNotEqual(self.generate(seed=8), first)
+
+    def test_derived_data_is_built(self):
+        self.generate()
+        post = Post.published.filter(comments__isnull=False).first()
+        self.assertTrue(post.body_html.startswith('<p>'))
+        self.assertGreater(post.word_count, 0)
+        self.assertTrue(SimilarPost.objects.exists())
+        self.assertIn(post, Post.published.filter(id__in=search.search_posts(Post.published.all(), post.title)))
+
+    def test_benchmark_saves_json(self):
+        self.generate()
+        output = os.path.join(tempfile.mkdtemp(), 'results.json')
+        self.addCleanup(shutil.rmtree, os.path.dirname(output))
+        call_command('run_benchmarks', '--requests', '3', '--samples', '1', '--output', output, stdout=StringIO())
+        with open(output) as handle:
+            results = json.load(handle)
+        self.assertEqual(
+            set(results['scenarios']), {'post_list', 'search', 'tag', 'post_detail', 'comment'},
+        )
+        detail = results['scenarios']['post_detail']
+        self.assertEqual(detail['errors'], 0)
+        self.assertEqual(detail['queries'], 5)
+        self.assertGreater(detail['peak_kb'], 0)
+        self.assertGreater(results['ratelimit_check']['mean_us'], 0)
+
+
+@no_cache
+class MetricsTests(TestCase):
+    """
+    Tests for the per-view request metrics and the /metrics endpoint.
+    """
+
+    def setUp(self):
+        metrics.registry.reset()
+        self.author = User.objects.create_user(username='author', password='secret')
+        self.post = Post.objects.create(
+            title='Measured post', body='Words.', author=self.author, status=Post.Status.PUBLISHED,
+        )
+
+    def series(self, name, view):
+        for line in metrics.registry.render().splitlines():
+            if line.startswith(f'{name}{{view="{view}",method="GET"}}'):
+                return float(line.rsplit(' ', 1)[1])
+        return None
+
+    def test_requests_are_recorded_per_view(self):
+        self.client.get(reverse('blog:post_list'))
+        self.client.get(reverse('blog:post_list'))
+        response = self.client.get(self.post.get_absolute_url())
+        self.client.get('/no-such-page/')
+
+        text = metrics.registry.render()
+        self.assertIn('blog_requests_total{view="blog:post_list",method="GET",status="200"} 2', text)
+        self.assertIn('blog_requests_total{view="<unresolved>",method="GET",status="404"} 1', text)
+        self.assertIn('blog_request_duration_seconds_bucket{view="blog:post_list",method="GET",le="+Inf"} 2', text)
+        self.assertEqual(self.series('blog_request_duration_seconds_count', 'blog:post_detail'), 1)
+        self.assertEqual(self.series('blog_response_size_bytes_sum', 'blog:post_detail'), len(response.content))
+        self.assertGreater(self.series('blog_db_queries_sum', 'blog:post_detail'), 0)
+        self.assertGreater(self.series('blog_template_render_seconds_sum', 'blog:post_detail'), 0)
+
+    def test_histogram_buckets_are_cumulative(self):
+        histogram = metrics.Histogram((1, 5))
+        for value in (0, 1, 3, 9):
+            histogram.observe(value)
+        self.assertEqual(list(histogram.cumulative()), [(1, 2), (5, 3), ('+Inf', 4)])
+        self.assertEqual(histogram.sum, 13)
+
+    @override_settings(BLOG_METRICS_TOKEN='scrape-me')
+    def test_endpoint_needs_token_or_staff(self):
+        self.client.get(reverse('blog:post_list'))
+        self.assertEqual(self.client.get('/metrics').status_code, 403)
+        self.assertEqual(self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer wrong').status_code, 403)
+
+        response = self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer scrape-me')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response['Content-Type'].startswith('text/plain; version=0.0.4'))
+        self.assertIn(b'# TYPE blog_request_duration_seconds histogram', response.content)
+
+        self.author.is_staff = True
+        self.author.save()
+        self.client.force_login(self.author)
+        self.assertEqual(self.client.get('/metrics').status_code, 200)
+
+    @override_settings(BLOG_SLOW_REQUEST_MS=0)
+    def test_slow_requests_are_logged_with_their_sql(self):
+        with self.assertLogs('blog.metrics.slow', 'WARNING') as logs:
+            self.client.get(self.post.get_absolute_url())
+        self.assertIn('blog:post_detail', logs.output[0])
+        self.assertIn('SELECT', logs.output[0])
+
+    def test_slow_log_is_off_by_default(self):
+        with self.assertNoLogs('blog.metrics.slow'):
+            self.client.get(self.post.get_absolute_url())
+
+
+@override_settings(BLOG_DATABASE_REPLICAS=['replica'])
+class ReplicaRoutingTests(TestCase):
+    """
+    Tests for read replica routing, with a second SQLite database standing in for the replica.
+    """
+
+    # the replica is only added in setUpClass
+    databases = '__all__'
+
+    @classmethod
+    def setUpClass(cls):
+        cls.replica_dir = tempfile.mkdtemp()
+        name = os.path.join(cls.replica_dir, 'replica.sqlite3')
+        default = connections.settings['default']
+        connections.settings['replica'] = {**default, 'NAME': name, 'TEST': {**default['TEST'], 'NAME': name}}
+        call_command('migrate', database='replica', verbosity=0)
+        super().setUpClass()
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        connections['replica'].close()
+        del connections['replica']
+        del connections.settings['replica']
+        shutil.rmtree(cls.replica_dir)
+
+    def setUp(self):
+        routing.reset_health()
+        self.author = User.objects.create_user(username='author', password='secret')
+        self.post = Post.objects.create(
+            title='Primary copy', body='Words.', author=self.author, status=Post.Status.PUBLISHED,
+        )
+        # the same rows with a different title, to tell which database answered
+        User.objects.using('replica').bulk_create([User(id=self.author.id, username='author')])
+        Post.objects.using('replica').bulk_create([Post(
+            id=self.post.id, title='Replica copy', slug=self.post.slug, body='Words.', author_id=self.author.id,
+            status=Post.Status.PUBLISHED, publish=self.post.publish, body_html='<p>Words.</p>',
+        )])
+
+    @no_cache
+    def test_hot_pages_read_from_the_replica(self):
+        self.assertContains(self.client.get(reverse('blog:post_list')), 'Replica copy')
+        self.assertContains(self.client.get(self.post.get_absolute_url()), 'Replica copy')
+        self.client.force_login(self.author)
+        self.assertContains(self.client.get(reverse('blog:profile')), 'Replica copy')
+        # views that aren't marked stay on the primary
+        response = self.client.get(reverse('blog:post_edit', args=[self.post.id]))
+        self.assertContains(response, 'Primary copy')
+
+    @no_cache
+    def test_writes_and_the_next_reads_use_the_primary(self):
+        response = self.client.post(self.post.get_absolute_url(), {
+            'name': 'Reader', 'email': 'r@example.com', 'body': 'Hello',
+        })
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(Comment.objects.count(), 1)
+        self.assertFalse(Comment.objects.using('replica').exists())
+        self.assertIn(routing.PRIMARY_COOKIE, response.cookies)
+
+        response = self.client.get(self.post.get_absolute_url())
+        self.assertContains(response, 'Primary copy')
+        self.assertContains(response, 'Hello')
+
+        del self.client.cookies[routing.PRIMARY_COOKIE]
+        self.assertContains(self.client.get(self.post.get_absolute_url()), 'Replica copy')
+
+    @no_cache
+    def test_lagging_or_failing_replicas_are_skipped(self):
+        with mock.patch('blog.routing.measure_lag', return_value=60):
+            self.assertContains(self.client.get(reverse('blog:post_list')), 'Primary copy')
+
+        routing.reset_health()
+        with mock.patch('blog.routing.measure_lag', side_effect=OperationalError('down')):
+            self.assertContains(self.client.get(reverse('blog:post_list')), 'Primary copy')
+
+        routing.reset_health()
+        self.assertContains(self.client.get(reverse('blog:post_list')), 'Replica copy')
+
+    def test_fresh_replica_pages_are_not_cached(self):
+        cache.clear()
+        caching.reset_stats()
+        caching.bump('posts')
+        self.client.get(reverse('blog:post_list'))
+        self.client.get(reverse('blog:post_list'))
+        self.assertEqual(caching.stats()['post_list']['misses'], 2)
+
+        with override_settings(BLOG_REPLICA_MAX_LAG=0):
+            self.client.get(reverse('blog:post_list'))
+            self.client.get(reverse('blog:post_list'))
+        self.assertEqual(caching.stats()['post_list']['hits'], 1)
+
+
+@no_cache
+class ConditionalGetTests(TestCase):
+    """
+    Tests for ETag and Last-Modified validation on the post pages.
+    """
+
+    def setUp(self):
+        self.author = User.objects.create_user(username='author', password='secret')
+        self.post = Post.objects.create(
+            title='Validated post', body='Words.', author=self.author, status=Post.Status.PUBLISHED,
+        )
+        self.post.tags.add('django')
+        self.url = self.post.get_absolute_url()
+
+    def revalidate(self, url, response):
+        return self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+
+    def test_unchanged_post_is_not_rendered_again(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response['ETag'].startswith('W/"'))
+        self.assertIn('private', response['Cache-Control'])
+
+        # a single query for the validators, no similar posts and no templates
+        with self.assertNumQueries(1):
+            again = self.revalidate(self.url, response)
+        self.assertEqual(again.status_code, 304)
+        self.assertEqual(again.templates, [])
+        self.assertEqual(again['ETag'], response['ETag'])
+
+    def test_comments_change_the_post_page(self):
+        response = self.client.get(self.url)
+        comment = Comment.objects.create(post=self.post, name='Reader', email='r@example.com', body='Hi')
+        changed = self.revalidate(self.url, response)
+        self.assertEqual(changed.status_code, 200)
+
+        comment.active = False
+        comment.save()
+        self.assertEqual(self.revalidate(self.url, changed).status_code, 200)
+
+    def test_reader_and_csrf_cookie_are_part_of_the_etag(self):
+        response = self.client.get(self.url)
+        self.client.cookies['csrftoken'] = 'a' * 32
+        self.assertEqual(self.revalidate(self.url, response).status_code, 200)
+
+        response = self.client.get(self.url)
+        self.client.force_login(self.author)
+        self.assertEqual(self.revalidate(self.url, response).status_code, 200)
+
+    def test_form_on_a_revalidated_page_still_posts(self):
+        client = Client(enforce_csrf_checks=True)
+        response = client.get(self.url)
+        token = re.search(r'name="csrfmiddlewaretoken" value="([^"]+)"', response.content.decode()).group(1)
+        self.assertEqual(client.get(self.url, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304)
+
+        response = client.post(self.url, {
+            'name': 'Reader', 'email': 'r@example.com', 'body': 'Hi', 'csrfmiddlewaretoken': token,
+        })
+        self.assertEqual(response.status_code, 302)
+
+    def test_pages_with_flash_messages_are_not_validated(self):
+        self.client.post(self.url, {'name': 'Reader', 'email': 'r@example.com', 'body': 'Hi'})
+        response = self.client.get(self.url)
+        self.assertContains(response, 'submitted successfully')
+        self.assertFalse(response.has_header('ETag'))
+        self.assertTrue(self.client.get(self.url).has_header('ETag'))
+
+    def test_lists_follow_edits_and_deletions(self):
+        list_url = reverse('blog:post_list_by_tag', args=['django'])
+        response = self.client.get(list_url)
+        self.assertEqual(self.revalidate(list_url, response).status_code, 304)
+
+        # crawlers without cookies only send If-Modified-Since
+        crawler = Client()
+        self.assertEqual(
+            crawler.get(list_url, HTTP_IF_MODIFIED_SINCE=response['Last-Modified']).status_code, 304,
+        )
+
+        other = Post.objects.create(title='Other', body='Words.', author=self.author, status=Post.Status.PUBLISHED)
+        response = self.revalidate(list_url, response)
+        self.assertEqual(response.status_code, 200)
+        other.delete()
+        self.assertEqual(self.revalidate(list_url, response).status_code, 200)
+
+        self.assertFalse(self.client.get(reverse('blog:post_list'), {'q': 'validated'}).has_header('ETag'))
+
+
+class FeedAndSitemapTests(TestCase):
+    """
+    Tests for the RSS/Atom feeds and the monthly sitemap shards.
+    """
+
+    def setUp(self):
+        cache.clear()
+        self.author = User.objects.create_user(username='author', password='secret')
+        self.old = Post.objects.create(
+            title='Old post', body='Words.', author=self.author, status=Post.Status.PUBLISHED,
+            publish=timezone.make_aware(timezone.datetime(2024, 1, 15)),
+        )
+        self.new = Post.objects.create(
+            title='New post', body='Words.', author=self.author, status=Post.Status.PUBLISHED,
+            publish=timezone.make_aware(timezone.datetime(2024, 3, 2)),
+        )
+        self.new.tags.add('django')
+        Post.objects.create(title='Draft post', body='Words.', author=self.author)
+
+    def content(self, response):
+        return b''.join(response.streaming_content) if response.streaming else response.content
+
+    def test_feeds_list_published_posts(self):
+        response = self.client.get(reverse('blog:post_feed', args=['atom']))
+        self.assertTrue(response.streaming)
+        self.assertTrue(response['Content-Type'].startswith('application/atom+xml'))
+        body = self.content(response).decode()
+        self.assertTrue(body.endswith('</feed>'))
+        self.assertLess(body.index('New post'), body.index('Old post'))
+        self.assertNotIn('Draft post', body)
+        self.assertIn('<category term="django"/>', body)
+
+        # the second request is served from the cache
+        with self.assertNumQueries(0):
+            cached = self.client.get(reverse('blog:post_feed', args=['atom']))
+        self.assertEqual(cached.content.decode(), body)
+
+        body = self.content(self.client.get(reverse('blog:post_feed_by_tag', args=['django', 'rss']))).decode()
+        self.assertIn('<title>New post</title>', body)
+        self.assertNotIn('Old post', body)
+        self.assertEqual(self.client.get(reverse('blog:post_feed', args=['json'])).status_code, 404)
+
+    def test_sitemap_is_sharded_by_month(self):
+        index = self.client.get(reverse('sitemap')).content.decode()
+        self.assertIn('/sitemap-2024-01.xml', index)
+        self.assertIn('/sitemap-2024-03.xml', index)
+        # months without posts are left out
+        self.assertNotIn('/sitemap-2024-02.xml', index)
+        self.assertEqual(self.client.get('/sitemap-2024-02.xml').status_code, 404)
+
+        shard = self.content(self.client.get('/sitemap-2024-01.xml')).decode()
+        self.assertIn(self.old.get_absolute_url(), shard)
+        self.assertNotIn(self.new.get_absolute_url(), shard)
+
+    def test_only_the_changed_shard_is_rebuilt(self):
+        for month in ('01', '03'):
+            self.content(self.client.get(f'/sitemap-2024-{month}.xml'))
+
+        self.new.title = 'Renamed post'
+        self.new.slug = 'renamed-post'
+        self.new.save()
+        with self.assertNumQueries(0):
+            self.client.get('/sitemap-2024-01.xml')
+        response = self.client.get('/sitemap-2024-03.xml')
+        self.assertTrue(response.streaming)
+        self.assertIn(b'renamed-post', self.content(response))
+
+        # moving a post leaves its old month too
+        self.new.publish = self.old.publish
+        self.new.save()
+        self.assertEqual(self.client.get('/sitemap-2024-03.xml').status_code, 404)
+        self.assertIn(b'renamed-post', self.content(self.client.get('/sitemap-2024-01.xml')))
+
+
+@no_cache
+class TagStatsTests(TestCase):
+    """
+    Tests for the maintained tag counts, the tag cloud and index, and the tag pages built on them.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user(username='author', password='secret')
+        cls.start = timezone.make_aware(timezone.datetime(2024, 1, 1))
+
+    def publish(self, title, days, *tags):
+        post = Post.objects.create(
+            title=title, body='Words.', author=self.author, status=Post.Status.PUBLISHED,
+            publish=self.start + timedelta(days=days),
+        )
+        post.tags.add(*tags)
+        return post
+
+    def stats(self):
+        return {
+            entry.tag.name: (entry.post_count, entry.latest_publish)
+            for entry in TagStats.objects.select_related('tag')
+        }
+
+    def day(self, days):
+        return self.start + timedelta(days=days)
+
+    def test_counts_follow_posts(self):
+        first = self.publish('First', 1, 'django', 'python')
+        second = self.publish('Second', 2, 'django')
+        Post.objects.create(title='Draft', body='Words.', author=self.author).tags.add('django')
+        self.assertEqual(self.stats(), {'django': (2, self.day(2)), 'python': (1, self.day(1))})
+
+        second.status = Post.Status.DRAFT
+        second.save()
+        self.assertEqual(self.stats()['django'], (1, self.day(1)))
+
+        first.publish = self.day(5)
+        first.save()
+        first.tags.remove('python')
+        self.assertEqual(self.stats(), {'django': (1, self.day(5)), 'python': (0, None)})
+
+        first.delete()
+        self.assertEqual(self.stats()['django'], (0, None))
+        self.assertFalse(TagPost.objects.exists())
+
+    def test_rebuild_matches_the_incremental_counts(self):
+        self.publish('First', 1, 'django', 'python')
+        self.publish('Second', 2, 'django')
+        expected = {name: counts for name, counts in self.stats().items() if counts[0]}
+        TagStats.objects.all().delete()
+        TagPost.objects.all().delete()
+        call_command('rebuild_tag_stats', stdout=StringIO())
+        self.assertEqual(self.stats(), expected)
+        self.assertEqual(TagPost.objects.count(), 3)
+
+    def test_tag_page_pages_through_the_tag(self):
+        posts = [self.publish(f'Post {i}', i, 'django') for i in range(6)]
+        self.publish('Other', 10, 'python')
+        url = reverse('blog:post_list_by_tag', args=['django'])
+        with mock.patch('blog.views.POSTS_PER_PAGE', 4):
+            first = self.client.get(url)
+            second = self.client.get(url, {'cursor': first.context['posts'].next_cursor})
+        self.assertEqual([post.title for post in first.context['posts']], ['Post 5', 'Post 4', 'Post 3', 'Post 2'])
+        self.assertEqual(list(second.context['posts']), [posts[1], posts[0]])
+        self.assertFalse(second.context['posts'].has_next())
+
+    def test_tag_cloud_and_index(self):
+        for i in range(9):
+            self.publish(f'Post {i}', i, 'django', *(['python'] if i < 3 else []))
+        self.publish('Rare', 20, 'rust')
+
+        cloud = {entry.tag.name: entry.size for entry in tagstats.cloud()}
+        self.assertEqual(list(cloud), ['django', 'python', 'rust'])
+        self.assertEqual((cloud['django'], cloud['rust']), (tagstats.CLOUD_SIZES, 1))
+        self.assertContains(self.client.get(reverse('blog:post_list')), 'title="9 posts"')
+
+        response = self.client.get(reverse('blog:tag_index'), {'sort': 'popular'})
+        self.assertEqual([entry.tag.name for entry in response.context['stats']], ['django', 'python', 'rust'])
+        self.assertContains(response, '1 post<')
+
+
+@no_cache
+class AuthorDashboardTests(TestCase):
+    """
+    Tests for the author dashboard and its cached totals.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user(username='author', password='secret')
+        cls.other = User.objects.create_user(username='other', password='secret')
+        start = timezone.make_aware(timezone.datetime(2024, 1, 1))
+        cls.published = [
+            Post.objects.create(
+                title=f'Post {i}', body='one two three', author=cls.author,
+                status=Post.Status.PUBLISHED, publish=start + timedelta(days=i),
+            )
+            for i in range(3)
+        ]
+        cls.draft = Post.objects.create(title='Draft', body='one two', author=cls.author)
+        Post.objects.create(title='Not mine', body='Words.', author=cls.other, status=Post.Status.PUBLISHED)
+        for body in ('Nice', 'Great'):
+            cls.published[0].comments.create(name='Reader', email='r@example.com', body=body)
+        cls.published[0].comments.create(name='Spam', email='s@example.com', body='Buy', active=False)
+
+    def setUp(self):
+        self.client.force_login(self.author)
+
+    def test_totals_in_one_query(self):
+        with self.assertNumQueries(1):
+            totals = authorstats.summarize(self.author.pk)
+        self.assertEqual(totals, {
+            'post_count': 4, 'published_count': 3, 'word_count': 11, 'comment_count': 2,
+            'last_published': self.published[-1].publish,
+        })
+
+    def test_totals_are_refreshed_after_changes(self):
+        response = self.client.get(reverse('blog:profile'))
+        self.assertEqual(response.context['stats'].comment_count, 2)
+
+        self.published[1].comments.create(name='Reader', email='r@example.com', body='Also nice')
+        self.assertTrue(AuthorStats.objects.get(author=self.author).stale)
+        self.draft.status = Post.Status.PUBLISHED
+        self.draft.save()
+        stats = self.client.get(reverse('blog:profile')).context['stats']
+        self.assertEqual((stats.comment_count, stats.published_count, stats.draft_count), (3, 4, 0))
+        self.assertFalse(stats.stale)
+
+    def test_published_and_drafts_are_paged_separately(self):
+        with mock.patch('blog.views.DASHBOARD_POSTS_PER_PAGE', 2):
+            first = self.client.get(reverse('blog:profile'))
+            second = self.client.get(reverse('blog:profile'), {'cursor': first.context['user_posts'].next_cursor})
+            drafts = self.client.get(reverse('blog:profile'), {'status': 'drafts'})
+        self.assertEqual(
+            [post.title for page in (first, second) for post in page.context['user_posts']],
+            ['Post 2', 'Post 1', 'Post 0'],
+        )
+        self.assertEqual([post.comment_count for post in second.context['user_posts']], [2])
+        self.assertEqual(list(drafts.context['user_posts']), [self.draft])
+
+
+class AdminModerationTests(TestCase):
+    """
+    Tests for the cached admin counts, the bulk moderation actions and the moderation queue.
+    """
+
+    def setUp(self):
+        cache.clear()
+        self.staff = User.objects.create_superuser(username='staff', password='secret', email='s@example.com')
+        self.client.force_login(self.staff)
+        self.post = Post.objects.create(
+            title='Post', body='Words.', author=self.staff, status=Post.Status.PUBLISHED,
+        )
+        self.hidden = [
+            self.post.comments.create(name=f'Reader {i}', email='r@example.com', body=f'Hidden {i}', active=False)
+            for i in range(3)
+        ]
+
+    def test_changelist_counts_are_cached(self):
+        url = reverse('admin:blog_post_changelist')
+        with CaptureQueriesContext(connections['default']) as cold:
+            self.client.get(url)
+        with CaptureQueriesContext(connections['default']) as warm:
+            self.client.get(url)
+        self.assertLess(len(warm), len(cold))
+        self.assertFalse([query for query in warm if 'COUNT(' in query['sql']])
+
+        # a new post is counted straight away
+        Post.objects.create(title='Another', body='Words.', author=self.staff)
+        self.assertContains(self.client.get(url), '2 posts')
+
+    def test_bulk_comment_actions_are_one_update(self):
+        with CaptureQueriesContext(connections['default']) as queries:
+            count = moderation.set_comments_active(Comment.objects.filter(post=self.post), True)
+        self.assertEqual(count, 3)
+        # the comments, their posts' comment counts and the authors' totals
+        self.assertEqual([query['sql'].split()[0] for query in queries].count('UPDATE'), 3)
+        self.assertFalse(Comment.objects.filter(active=False).exists())
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.comment_count, self.post.comments.count())
+
+        response = self.client.post(reverse('admin:blog_comment_changelist'), {
+            'action': 'hide_comments', '_selected_action': [self.hidden[0].pk],
+        })
+        self.assertEqual(response.status_code, 302)
+        self.assertFalse(Comment.objects.get(pk=self.hidden[0].pk).active)
+
+    def test_bulk_publish_keeps_derived_data_in_step(self):
+        draft = Post.objects.create(title='Tagged draft', body='Words.', author=self.staff)
+        draft.tags.add('django')
+        self.client.post(reverse('admin:blog_post_changelist'), {
+            'action': 'publish_posts', '_selected_action': [draft.pk, self.post.pk],
+        })
+        draft.refresh_from_db()
+        self.assertEqual(draft.status, Post.Status.PUBLISHED)
+        self.assertEqual(TagStats.objects.get(tag__name='django').post_count, 1)
+        self.assertEqual(moderation.set_posts_status(Post.objects.all(), Post.Status.PUBLISHED), (0, True))
+
+        self.assertEqual(moderation.set_posts_status(Post.objects.filter(pk=draft.pk), Post.Status.DRAFT), (1, True))
+        self.assertEqual(TagStats.objects.get(tag__name='django').post_count, 0)
+        self.assertNotContains(self.client.get(reverse('blog:post_list')), 'Tagged draft')
+
+    def test_large_bulk_publish_leaves_rebuilds_to_the_commands(self):
+        drafts = [Post.objects.create(title=f'Draft {i}', body='Words.', author=self.staff) for i in range(3)]
+        with mock.patch('blog.moderation.REQUEST_CATCH_UP', 2), mock.patch('blog.similar.rebuild') as rebuild:
+            response = self.client.post(reverse('admin:blog_post_changelist'), {
+                'action': 'publish_posts', '_selected_action': [draft.pk for draft in drafts],
+            }, follow=True)
+        rebuild.assert_not_called()
+        self.assertEqual(Post.published.filter(title__startswith='Draft').count(), 3)
+        self.assertContains(response, 'python manage.py rebuild_similar_posts')
+        self.assertTrue(moderation.catch_up([draft.pk for draft in drafts], rebuild=False))
+
+    def test_moderation_queue(self):
+        url = reverse('admin:blog_comment_moderation')
+        # the session, the user and the page with its posts, however many comments are shown
+        with self.assertNumQueries(3):
+            self.client.get(url)
+        with mock.patch('blog.admin.MODERATION_PER_PAGE', 2):
+            first = self.client.get(url)
+            second = self.client.get(url, {'cursor': first.context['page'].next_cursor})
+        self.assertEqual([comment.body for comment in first.context['page']], ['Hidden 2', 'Hidden 1'])
+        self.assertEqual([comment.body for comment in second.context['page']], ['Hidden 0'])
+
+        response = self.client.post(url, {'action': 'approve', 'selected': [self.hidden[0].pk, self.hidden[1].pk]})
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(list(Comment.objects.filter(active=False)), [self.hidden[2]])
+
+
+class ImportPostsTests(TestCase):
+    """
+    Tests for the bulk import of Markdown and JSON Lines archives.
+    """
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.author = User.objects.create_user(username='author', password='secret')
+        Post.objects.create(title='Hello World', body='Already here.', author=self.author)
+
+    def write(self, name, content):
+        path = os.path.join(self.directory, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'w') as handle:
+            handle.write(content)
+        return path
+
+    def test_front_matter(self):
+        fields, body = importer.parse_front_matter(
+            '---\ntitle: "Hello: World"\ntags:\n  - django\n  - Web Dev\nstatus: draft\n---\n# Hi\n'
+        )
+        self.assertEqual(fields, {'title': 'Hello: World', 'tags': ['django', 'Web Dev'], 'status': 'draft'})
+        self.assertEqual(body, '# Hi')
+        self.assertEqual(importer.parse_front_matter('No front matter.'), ({}, 'No front matter.'))
+
+    def test_markdown_directory(self):
+        self.write('posts/first.md', '---\ntitle: Hello World\ndate: 2024-02-03\ntags: [django, python]\n---\n*Hi*\n')
+        self.write('posts/more/second.md', '---\ntitle: Hello World\nauthor: author\ntags: [django]\n---\nAgain.\n')
+        call_command('import_posts', self.directory, author='author', stdout=StringIO())
+
+        first, second = Post.objects.filter(body_format=Post.BodyFormat.MARKDOWN).order_by('id')
+        # collisions get a suffix instead of an IntegrityError
+        self.assertEqual((first.slug, second.slug), ('hello-world-2', 'hello-world-3'))
+        self.assertEqual(first.publish.date().isoformat(), '2024-02-03')
+        self.assertIn('<em>Hi</em>', first.body_html)
+        self.assertEqual(sorted(first.tags.names()), ['django', 'python'])
+        self.assertEqual(TagStats.objects.get(tag__name='django').post_count, 2)
+        self.assertEqual([post.title for post in search.search_posts(Post.published.all(), 'again')], ['Hello World'])
+
+    def test_resumes_from_the_checkpoint(self):
+        lines = [json.dumps({'title': f'Post {i}', 'body': 'Words.', 'tags': ['bulk']}) for i in range(5)]
+        source = self.write('posts.jsonl', '\n'.join(lines[:3] + ['{broken'] + lines[4:]) + '\n')
+        checkpoint = os.path.join(self.directory, 'checkpoint.json')
+        with self.assertRaisesMessage(CommandError, 'posts.jsonl:4'):
+            call_command('import_posts', source, author='author', batch_size=2,
+                         checkpoint=checkpoint, stdout=StringIO())
+        # only whole batches are kept
+        self.assertEqual(importer.load_checkpoint(checkpoint, source), 2)
+        self.assertEqual(Post.objects.filter(title__startswith='Post').count(), 2)
+
+        self.write('posts.jsonl', '\n'.join(lines) + '\n')
+        out = StringIO()
+        call_command('import_posts', source, author='author', batch_size=2, checkpoint=checkpoint, stdout=out)
+        self.assertIn('Resuming after 2 records', out.getvalue())
+        self.assertIn('rows/s', out.getvalue())
+        self.assertEqual(
+            sorted(Post.objects.filter(title__startswith='Post').values_list('title', flat=True)),
+            [f'Post {i}' for i in range(5)],
+        )
+        self.assertEqual(TagStats.objects.get(tag__name='bulk').post_count, 5)
+
+
+class ExportTests(TestCase):
+    """
+    Tests for the streaming export command and endpoint.
+    """
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.author = User.objects.create_user(username='author', password='secret')
+        self.post = Post.objects.create(
+            title='First', body='Words.', author=self.author, status=Post.Status.PUBLISHED,
+        )
+        self.post.tags.add('django', 'python')
+        Comment.objects.create(post=self.post, name='Reader', email='r@example.com', body='Nice.')
+
+    def export(self, *args, **options):
+        path = os.path.join(self.directory, 'export')
+        call_command('export_data', *args, output=path, stderr=StringIO(), **options)
+        with open(path, 'rb') as handle:
+            content = handle.read()
+        return gzip.decompress(content) if options.get('gzip') else content
+
+    def test_posts_come_out_the_way_import_posts_reads_them(self):
+        rows = [json.loads(line) for line in self.export('posts').decode().splitlines()]
+        self.assertEqual(len(rows), 1)
+        self.assertEqual(rows[0]['author'], 'author')
+        self.assertEqual(rows[0]['tags'], ['django', 'python'])
+        self.assertEqual(rows[0]['status'], 'PB')
+
+        content = self.export('posts', format='csv', gzip=True, chunk_size=1).decode()
+        header, row = content.splitlines()
+        self.assertTrue(header.startswith('id,title,slug,author,'))
+        self.assertTrue(row.endswith('"django,python"'))
+
+    def test_watermark_exports_only_changes(self):
+        watermark = os.path.join(self.directory, 'watermark.json')
+        Comment.objects.update(updated=timezone.now() - timedelta(hours=1))
+        self.assertEqual(len(self.export('comments', watermark=watermark).splitlines()), 1)
+        self.assertEqual(self.export('comments', watermark=watermark), b'')
+
+        Comment.objects.create(post=self.post, name='Other', email='o@example.com', body='Hi.')
+        rows = [json.loads(line) for line in self.export('comments', watermark=watermark).splitlines()]
+        self.assertEqual([row['name'] for row in rows], ['Other'])
+
+        # stamped before the last watermark but committed after it, it is exported by the overlap
+        with open(watermark) as handle:
+            since = exporter.parse_since(json.load(handle)['comments'])
+        late = Comment.objects.create(post=self.post, name='Late', email='l@example.com', body='Hi.')
+        Comment.objects.filter(pk=late.pk).update(updated=since - timedelta(minutes=1))
+        rows = [json.loads(line) for line in self.export('comments', watermark=watermark).splitlines()]
+        self.assertEqual([row['name'] for row in rows], ['Other', 'Late'])
+
+    def test_endpoint_streams_for_staff_only(self):
+        url = reverse('blog:export', args=['tags'])
+        self.client.force_login(self.author)
+        self.assertEqual(self.client.get(url).status_code, 302)
+
+        self.author.is_staff = True
+        self.author.save()
+        response = self.client.get(url, {'format': 'csv'})
+        self.assertTrue(response.streaming)
+        self.assertIn('X-Export-Watermark', response)
+        self.assertEqual(b''.join(response.streaming_content).decode().splitlines(), [
+            'id,name,slug,post_count', *(f'{tag.id},{tag.name},{tag.slug},1' for tag in self.post.tags.order_by('id')),
+        ])
+
+        since = response['X-Export-Watermark']
+        Post.objects.update(updated=timezone.now() - timedelta(hours=1))
+        response = self.client.get(reverse('blog:export', args=['posts']), {'since': since, 'gzip': '1'})
+        self.assertEqual(response['Content-Disposition'], 'attachment; filename="posts.jsonl.gz"')
+        self.assertEqual(gzip.decompress(b''.join(response.streaming_content)), b'')
+        self.assertEqual(self.client.get(url, {'format': 'xml'}).status_code, 400)
+        self.assertEqual(self.client.get(reverse('blog:export', args=['users'])).status_code, 404)
+
+
+class JsonApiTests(TestCase):
+    """
+    Tests for the read-only JSON API.
+    """
+
+    def setUp(self):
+        cache.clear()
+        self.author = User.objects.create_user(username='author', password='secret')
+        self.posts = []
+        for number in range(3):
+            post = Post.objects.create(
+                title=f'Post {number}', body='Some words.', author=self.author, status=Post.Status.PUBLISHED,
+                publish=timezone.now() - timedelta(days=number),
+            )
+            post.tags.add('django')
+            self.posts.append(post)
+        Post.objects.create(title='Draft', body='Hidden.', author=self.author)
+
+    def get_json(self, url, **params):
+        response = self.client.get(url, params)
+        self.assertEqual(response.status_code, 200)
+        return response, json.loads(response.content)
+
+    def test_posts_are_paged_with_cursors(self):
+        url = reverse('blog:api_post_list')
+        # the page and the tags of its posts
+        with self.assertNumQueries(2):
+            response, data = self.get_json(url, limit=2)
+        self.assertEqual([post['title'] for post in data['results']], ['Post 0', 'Post 1'])
+        self.assertEqual(data['results'][0]['author'], 'author')
+        self.assertEqual(data['results'][0]['tags'], ['django'])
+        self.assertTrue(data['results'][0]['url'].endswith(self.posts[0].get_absolute_url()))
+        self.assertIsNone(data['previous'])
+
+        response, data = self.get_json(data['next'])
+        self.assertEqual([post['title'] for post in data['results']], ['Post 2'])
+        self.assertIsNone(data['next'])
+
+        response, data = self.get_json(url, tag='django', limit=2)
+        self.assertEqual([post['title'] for post in data['results']], ['Post 0', 'Post 1'])
+
+        # cursors that don't decode or carry unusable values are the client's mistake
+        comments = reverse('blog:api_comment_list', args=[self.posts[0].id])
+        for cursor in ('not-a-cursor', 'WzAsW251bGwsbnVsbF1d'):
+            for target in (url, comments):
+                response = self.client.get(target, {'cursor': cursor})
+                self.assertEqual(response.status_code, 400)
+                self.assertEqual(json.loads(response.content), {'error': 'Invalid cursor.'})
+
+    def test_sparse_fields(self):
+        with self.assertNumQueries(1):
+            response, data = self.get_json(reverse('blog:api_post_list'), fields='title,publish')
+        self.assertEqual(set(data['results'][0]), {'title', 'publish'})
+
+        response = self.client.get(reverse('blog:api_post_list'), {'fields': 'title,password'})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('password', json.loads(response.content)['error'])
+
+    def test_detail_comments_and_tags(self):
+        post = self.posts[0]
+        response, data = self.get_json(reverse('blog:api_post_detail', args=[post.id]))
+        self.assertIn('Some words.', data['body_html'])
+        drafts = Post.objects.filter(status=Post.Status.DRAFT)
+        self.assertEqual(self.client.get(reverse('blog:api_post_detail', args=[drafts.get().id])).status_code, 404)
+
+        Comment.objects.create(post=post, name='Reader', email='r@example.com', body='Nice.')
+        Comment.objects.create(post=post, name='Spam', email='s@example.com', body='Buy.', active=False)
+        response, data = self.get_json(reverse('blog:api_comment_list', args=[post.id]))
+        self.assertEqual([comment['name'] for comment in data['results']], ['Reader'])
+        self.assertNotIn('email', data['results'][0])
+
+        response, data = self.get_json(reverse('blog:api_tag_list'))
+        self.assertEqual(data['results'][0]['name'], 'django')
+        self.assertEqual(data['results'][0]['post_count'], 3)
+
+    def test_etags_and_caching(self):
+        url = reverse('blog:api_post_list')
+        response, data = self.get_json(url)
+        self.assertIn('max-age=60', response['Cache-Control'])
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304)
+            self.assertEqual(self.client.get(url).content, response.content)
+
+        self.posts[0].title = 'Renamed'
+        self.posts[0].save()
+        changed = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(changed.status_code, 200)
+        self.assertEqual(json.loads(changed.content)['results'][0]['title'], 'Renamed')
+
+
+class ThreadedCommentTests(TestCase):
+    """
+    Tests for reply threads, their materialized paths and the denormalized comment count.
+    """
+
+    def setUp(self):
+        cache.clear()
+        self.author = User.objects.create_user(username='author', password='secret')
+        self.post = Post.objects.create(
+            title='Post', body='Words.', author=self.author, status=Post.Status.PUBLISHED,
+        )
+
+    def comment(self, name, parent=None, **fields):
+        return Comment.objects.create(
+            post=self.post, parent=parent, name=name, email='r@example.com', body=f'{name} says hi.', **fields,
+        )
+
+    def test_threads_come_back_in_reading_order_in_one_query(self):
+        first = self.comment('First')
+        second = self.comment('Second')
+        reply = self.comment('Reply', parent=first)
+        self.comment('Nested', parent=reply)
+        self.comment('Late reply', parent=first)
+        with self.assertNumQueries(1):
+            page = threads.page(self.post)
+            shown = [(comment.name, comment.depth) for comment in page]
+        self.assertEqual(shown, [('First', 0), ('Reply', 1), ('Nested', 2), ('Late reply', 1), ('Second', 0)])
+        self.assertEqual(second.path, f'{second.pk:010d}')
+
+    def test_replies_past_the_deepest_level_become_siblings(self):
+        parent = self.comment('Level 0')
+        for depth in range(1, COMMENT_MAX_DEPTH + 1):
+            parent = self.comment(f'Level {depth}', parent=parent)
+        reply = self.comment('Too deep', parent=parent)
+        self.assertEqual(reply.depth, COMMENT_MAX_DEPTH)
+        self.assertEqual(reply.parent_id, parent.parent_id)
+
+    def test_comment_count_follows_the_visible_comments(self):
+        first = self.comment('First')
+        self.comment('Hidden', active=False)
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.comment_count, 1)
+
+        # an edit made from a copy loaded before the comment keeps the count
+        stale = Post.objects.get(pk=self.post.pk)
+        self.comment('Second')
+        stale.title = 'Edited'
+        stale.save()
+        self.post.refresh_from_db()
+        self.assertEqual((self.post.title, self.post.comment_count), ('Edited', 2))
+
+        first.delete()
+        moderation.set_comments_active(self.post.comments.all(), True)
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.comment_count, 2)
+
+    def test_detail_page_posts_and_shows_replies(self):
+        first = self.comment('First')
+        url = self.post.get_absolute_url()
+        self.client.post(url, {'name': 'Replier', 'email': 'r@example.com', 'body': 'Agreed.', 'parent': first.pk})
+        reply = Comment.objects.get(name='Replier')
+        self.assertEqual((reply.parent, reply.depth), (first, 1))
+
+        other = Post.objects.create(title='Other', body='Words.', author=self.author, status=Post.Status.PUBLISHED)
+        foreign = other.comments.create(name='Elsewhere', email='r@example.com', body='Hi.')
+        response = self.client.post(url, {'name': 'Lost', 'email': 'r@example.com', 'body': 'Hm.', 'parent': foreign.pk})
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(Comment.objects.filter(name='Lost').exists())
+
+        moderation.set_comments_active(Comment.objects.filter(pk=first.pk), False)
+        response = self.client.get(url)
+        self.assertContains(response, 'This comment was removed.')
+        self.assertNotContains(response, 'First says hi.')
+        self.assertContains(response, 'Agreed.')
+
+    def test_long_threads_are_paginated(self):
+        first = self.comment('First')
+        self.comment('Reply', parent=first)
+        self.comment('Second')
+        with mock.patch('blog.views.COMMENTS_PER_PAGE', 2):
+            response = self.client.get(self.post.get_absolute_url())
+            self.assertContains(response, 'Reply says hi.')
+            self.assertNotContains(response, 'Second says hi.')
+            self.assertContains(response, 'Comments <span class="text-gray-500 text-lg font-normal">(3)</span>', html=False)
+            cursor = response.context['comments'].next_cursor
+            response = self.client.get(self.post.get_absolute_url(), {'comments': cursor})
+        self.assertContains(response, 'Second says hi.')
+        self.assertNotContains(response, 'First says hi.')
+
+
+class RateLimitTests(TestCase):
+    """
+    Tests for the rate limits on the write endpoints.
+    """
+
+    def setUp(self):
+        cache.clear()
+        metrics.registry.reset()
+        self.author = User.objects.create_user(username='author', password='secret')
+        self.post = Post.objects.create(
+            title='Post', body='Words.', author=self.author, status=Post.Status.PUBLISHED,
+        )
+
+    def comment(self, name, client=None, **extra):
+        return (client or self.client).post(self.post.get_absolute_url(), {
+            'name': name, 'email': 'r@example.com', 'body': 'Hi.',
+        }, **extra)
+
+    def test_window_slides_over_the_previous_one(self):
+        self.assertEqual(ratelimit.parse_rate('5/m'), (5, 60))
+        with self.assertRaises(ValueError):
+            ratelimit.parse_rate('5/fortnight')
+        # 2 a minute: the third request of a window is turned away until the window ends
+        self.assertEqual([ratelimit.hit('test', 'a', 2, 60, now=now) for now in (10, 20, 30)], [0, 0, 30])
+        # the next window still counts the 3 of the previous one by how much it overlaps them
+        self.assertEqual(ratelimit.hit('test', 'a', 2, 60, now=75), 45)
+        self.assertEqual(ratelimit.hit('test', 'b', 2, 60, now=75), 0)
+        self.assertEqual(ratelimit.hit('test', 'a', 2, 60, now=150), 0)
+
+    @override_settings(BLOG_RATE_LIMITS={'comment': '2/m'})
+    def test_comments_past_the_limit_get_429_before_the_view_runs(self):
+        self.assertEqual(self.comment('One').status_code, 302)
+        self.assertEqual(self.comment('Two').status_code, 302)
+        with self.assertNumQueries(0):
+            response = self.comment('Three')
+        self.assertEqual(response.status_code, 429)
+        self.assertGreater(int(response['Retry-After']), 0)
+        self.assertFalse(Comment.objects.filter(name='Three').exists())
+        # reading the post isn't limited
+        self.assertEqual(self.client.get(self.post.get_absolute_url()).status_code, 200)
+
+        self.assertEqual(self.comment('Elsewhere', REMOTE_ADDR='10.0.0.2').status_code, 302)
+        self.client.force_login(self.author)
+        self.assertEqual(self.comment('Logged in').status_code, 302)
+        self.assertIn('blog_ratelimit_rejections_total{scope="comment"} 1', metrics.registry.render())
+
+    @override_settings(BLOG_RATE_LIMITS={'share': '1/m'})
+    def test_shares_past_the_limit_send_nothing(self):
+        url = reverse('blog:post_share', args=[self.post.id])
+        data = {'name': 'Ada', 'email': 'ada@example.com', 'to': 'friend@example.com', 'comments': 'Read it'}
+        self.assertEqual(self.client.post(url, data).status_code, 200)
+        self.assertEqual(self.client.post(url, data).status_code, 429)
+        self.assertEqual(OutboundEmail.objects.count(), 1)
+        self.assertEqual(self.client.get(url).status_code, 200)
+
+    @override_settings(BLOG_RATE_LIMITS={'login': '1/m'}, BLOG_RATELIMIT_IP_HEADER='HTTP_X_FORWARDED_FOR')
+    def test_clients_behind_a_proxy_are_told_apart(self):
+        url = reverse('blog:login_view')
+        data = {'username': 'author', 'password': 'wrong'}
+        self.assertEqual(self.client.post(url, data, HTTP_X_FORWARDED_FOR='1.1.1.1, 10.0.0.1').status_code, 200)
+        # only the hop the proxy saw counts, what the client claims before it doesn't
+        self.assertEqual(self.client.post(url, data, HTTP_X_FORWARDED_FOR='2.2.2.2, 10.0.0.1').status_code, 429)
+        self.assertEqual(self.client.post(url, data, HTTP_X_FORWARDED_FOR='10.0.0.2').status_code, 200)
+
+    @override_settings(BLOG_RATE_LIMITS={'subscribe': '1/m'}, BLOG_RATELIMIT_ENABLED=False)
+    def test_limits_can_be_turned_off(self):
+        for email in ('a@example.com', 'b@example.com'):
+            self.client.post(reverse('blog:subscribe'), {'email': email})
+        self.assertEqual(Subscriber.objects.count(), 2)
@@ -0,0 +1,52 @@
+from django.db.models import CharField, Count, OuterRef, Subquery, Value
+from django.db.models.functions import Cast, Coalesce, LPad
+
+from .models import COMMENT_PATH_STEP, Comment, Post
+from .pagination import KeysetPaginator
+
+
+def page(post, cursor=None, per_page=50):
+    """
+    A page of the post's comment threads in reading order, each reply right after what it answers.
+
+    One query off the (post, path) index, however deep the threads or the
+    page. Long threads simply continue on the next page. Hidden comments
+    are fetched too, to keep the cursors on the rows read: those with a visible
+    reply on the page get placeholder set, so the reply isn't shown under the
+    wrong comment, the others aren't shown at all.
+    """
+    comments = Comment.objects.filter(post=post).only(
+        'id', 'post_id', 'parent_id', 'path', 'name', 'body', 'created', 'active',
+    )
+    result = KeysetPaginator(comments, per_page, ordering=('path',)).get_page(cursor)
+
+    # every ancestor of a visible comment on the page, read off the paths
+    answered = {
+        comment.path[:end]
+        for comment in result if comment.active
+        for end in range(COMMENT_PATH_STEP, len(comment.path), COMMENT_PATH_STEP)
+    }
+    for comment in result:
+        comment.placeholder = not comment.active and comment.path in answered
+    return result
+
+
+def refresh_counts(*post_ids):
+    """
+    Recounts Post.comment_count of the given posts, or of every post when none are given, in one UPDATE.
+    """
+    visible = (
+        Comment.objects.filter(post=OuterRef('pk'), active=True)
+        .values('post').annotate(count=Count('id')).values('count')
+    )
+    posts = Post.objects.filter(pk__in=post_ids) if post_ids else Post.objects.all()
+    return posts.update(comment_count=Coalesce(Subquery(visible), 0))
+
+
+def fill_paths():
+    """
+    Gives new threads written without save(), e.g. with bulk_create, their paths.
+    """
+    return Comment.objects.filter(path='', parent=None).update(
+        path=LPad(Cast('id', CharField()), COMMENT_PATH_STEP, Value('0')),
+    )
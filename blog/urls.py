@@ -5,10 +5,20 @@ app_name = 'blog'
 
 urlpatterns = [
     path('', views.post_list, name='post_list'),
+    path('tags/', views.tag_index, name='tag_index'),
     path('tag/<slug:tag_slug>/', views.post_list, name='post_list_by_tag'),
     path('<int:post_id>/share/', views.post_share, name='post_share'),
     path('<int:id>/<slug:post>/', views.post_detail, name='post_detail'),
+    path('feed/<str:feed_format>/', views.post_feed, name='post_feed'),
+    path('tag/<slug:tag_slug>/feed/<str:feed_format>/', views.post_feed, name='post_feed_by_tag'),
+    path('api/posts/', views.api_post_list, name='api_post_list'),
+    path('api/posts/<int:id>/', views.api_post_detail, name='api_post_detail'),
+    path('api/posts/<int:id>/comments/', views.api_comment_list, name='api_comment_list'),
+    path('api/tags/', views.api_tag_list, name='api_tag_list'),
     path('subscribe/', views.subscribe_view, name='subscribe'),
+    path('cache/stats/', views.cache_stats, name='cache_stats'),
+    path('export/<str:dataset>/', views.export_view, name='export'),
+    path('csrf/', views.csrf_token_view, name='csrf_token'),
 
     path('login/', views.login_view, name='login_view'),
     path('signup/', views.signup_view, name='signup_view'),
@@ -1,13 +1,15 @@
-from django.shortcuts import render, get_object_or_404
+from asgiref.sync import sync_to_async
+from django.shortcuts import render, get_object_or_404, aget_object_or_404
 
 # Create your views here.
-from .models import Post, Subscriber
-from django.core.paginator import EmptyPage, PageNotAnInteger, Paginator
+from .models import Post, Subscriber, TagStats
+from . import (
+    api, authorstats, caching, conditional, exporter, feeds, mail, metrics, ratelimit, routing, search, sitemaps, threads,
+)
+from .pagination import KeysetPaginator
 from .forms import EmailPostForm, CommentForm, LoginForm, SignupForm, SubscribeForm
-from django.core.mail import send_mail
 from django.contrib.auth.decorators import login_required
 from taggit.models import Tag
-from django.db.models import Count, Q
 
 from django.contrib import messages
 from django.shortcuts import redirect
@@ -15,6 +17,7 @@ from django.shortcuts import redirect
 from django.contrib.auth.models import User
 from django.contrib.auth import authenticate, login
 
+from django.conf import settings
 from django.contrib.auth.mixins import LoginRequiredMixin
 from django.views.generic.edit import CreateView
 
@@ -26,52 +29,87 @@ from django.views.generic.edit import DeleteView
 
 
 from django.urls import reverse_lazy
-
+from django.contrib.admin.views.decorators import staff_member_required
+from django.http import Http404, HttpResponse, JsonResponse
+from django.middleware.csrf import get_token
+from django.utils.crypto import constant_time_compare
+from django.utils.functional import SimpleLazyObject
+from django.views.decorators.cache import never_cache
+
+# number of posts on each page of the post list
+POSTS_PER_PAGE = 4
+# number of posts on each page of the author dashboard
+DASHBOARD_POSTS_PER_PAGE = 12
+# comments on each page of a post's threads, hidden ones included
+COMMENTS_PER_PAGE = 50
 
 # view for list page
-def post_list(request, tag_slug=None):
+@routing.read_from_replicas
+@conditional.conditional_page(conditional.list_state, lambda tag_slug=None: ['posts'])
+@caching.cache_page_for_readers('post_list', lambda tag_slug=None: ['posts'])
+async def post_list(request, tag_slug=None):
     """
     Displays a list of published blog posts.
     
-    Supports pagination, filtering by tags, and search.
+    Supports cursor pagination, filtering by tags, and search.
+    Async, the queries run without tying up a thread under ASGI.
     
     Args:
         request: The HTTP request object.
         tag_slug (str, optional): The slug of the tag to filter by.
     """
-    post_list = Post.published.all()
+    # the body is never shown on the list, cards use the stored excerpt
+    post_list = Post.published.for_cards()
     tag = None
     query = request.GET.get('q')
 
     if tag_slug:
-        tag = get_object_or_404(Tag, slug=tag_slug)
-        post_list = post_list.filter(tags__in=[tag])
+        tag = await aget_object_or_404(Tag, slug=tag_slug)
+        # off the (tag, publish) index of TagPost rather than through every tagged item
+        post_list = post_list.tagged(tag)
+
+    if query:
+        # ranked full-text search, best matches first
+        post_list = search.search_posts(post_list, query)
 
+    # keyset pagination with 4 posts per page, no COUNT(*) or OFFSET however deep the page
     if query:
-        post_list = post_list.filter(
-            Q(title__icontains=query) | Q(body__icontains=query)
-        )
-
-    # paginatin with 4 posts per page
-    paginator = Paginator(post_list, 4)
-    page_number = request.GET.get('page', 1) #the int 1 loads the first page if requested page is not available
-    try:
-        posts = paginator.page(page_number)
-    except PageNotAnInteger:
-        posts = paginator.page(1)
-    except EmptyPage:
-        posts = paginator.page(paginator.num_pages)
+        # search results keep their relevance order, the id keeps the cursor unique
+        paginator = KeysetPaginator(post_list, POSTS_PER_PAGE, ordering=('search_rank', '-id'))
+    elif tag:
+        paginator = KeysetPaginator(post_list, POSTS_PER_PAGE, ordering=('-tag_publish', '-tag_post'))
+    else:
+        paginator = KeysetPaginator(post_list, POSTS_PER_PAGE)
+    posts = await paginator.aget_page(request.GET.get('cursor')) #a bad cursor loads the first page
     
     subscribe_form = SubscribeForm()
 
-    return render(request, 'blog/post/list.html', {
+    # templates are sync only, they render in a thread once the data is loaded
+    return await sync_to_async(render)(request, 'blog/post/list.html', {
         'posts': posts, 
         'tag': tag, 
         'query': query,
-        'subscribe_form': subscribe_form
+        'subscribe_form': subscribe_form,
+        'cache_versions': await caching.aversions('tags', 'posts'),
     })
 
 
+@routing.read_from_replicas
+@caching.cache_page_for_readers('tag_index', lambda: ['posts', 'tags'])
+def tag_index(request):
+    """
+    Lists every tag in use with its number of published posts and latest post.
+
+    Read from the maintained TagStats rows, no posts are counted.
+    Sorted by name, or by post count with ``?sort=popular``.
+    """
+    sort = 'popular' if request.GET.get('sort') == 'popular' else 'name'
+    ordering = ('-post_count', 'tag__name') if sort == 'popular' else ('tag__name',)
+    stats = TagStats.objects.filter(post_count__gt=0).select_related('tag').order_by(*ordering)
+    return render(request, 'blog/post/tag_index.html', {'stats': stats, 'sort': sort})
+
+
+@ratelimit.rate_limit('subscribe', '5/m')
 def subscribe_view(request):
     """
     Handles newsletter subscription.
@@ -91,7 +129,12 @@ def subscribe_view(request):
 
 
 # view for detail and rendering comment 
-def post_detail(request, id, post):
+# only the comment POSTs are limited, above the page cache so a rejected one costs nothing else
+@ratelimit.rate_limit('comment', '10/m', key='user')
+@routing.read_from_replicas
+@conditional.conditional_page(conditional.post_state, lambda id, post: ['posts', f'comments:{id}'])
+@caching.cache_page_for_readers('post_detail', lambda id, post: ['posts', f'comments:{id}'])
+async def post_detail(request, id, post):
     """
     Displays a single blog post and its comments.
     
@@ -102,36 +145,46 @@ def post_detail(request, id, post):
         id (int): The ID of the post.
         post (str): The slug of the post.
     """
-    post = get_object_or_404(Post, id=id, status=Post.Status.PUBLISHED, slug=post)
-    comments = post.comments.filter(active=True)
+    # the body is served pre-rendered from body_html
+    post = await aget_object_or_404(Post.published.with_related().defer('body'), id=id, slug=post)
     comment = None
 
     if request.method == 'POST':
-        form = CommentForm(data=request.POST)
-        if form.is_valid():
+        form = CommentForm(post, data=request.POST)
+        # checking the replied to comment queries the database
+        if await sync_to_async(form.is_valid)():
             comment = form.save(commit=False)
             comment.post = post
-            comment.save()
+            await comment.asave()
 
             messages.success(request, "Your comment has been submitted successfully!")
             return redirect('blog:post_detail', id=post.id, post=post.slug)
     else:
-        form = CommentForm()
+        form = CommentForm(post)
 
-    post_tag_ids = post.tags.values_list('id', flat=True)
-    similar_posts = Post.published.filter(tags__in=post_tag_ids).exclude(id=post.id)
-    similar_posts = similar_posts.annotate(same_tags=Count('tags')).order_by('-same_tags', '-publish')[:4]
+    # both stay lazy, they are only queried when their cached fragment is missing
+    comment_cursor = request.GET.get('comments')
+    comments = SimpleLazyObject(lambda: threads.page(post, comment_cursor, COMMENTS_PER_PAGE))
+    similar_posts = Post.published.similar_to(post)
+    versions = await caching.aversions('posts', f'comments:{post.id}')
 
-    return render(request, 'blog/post/detail.html', {
+    # a fragment miss runs its query while rendering, inside the render thread
+    return await sync_to_async(render)(request, 'blog/post/detail.html', {
         'post': post,
         'comments': comments,
         'form': form,
         'comment': comment,
-        'similar_post': similar_posts
+        'comment_cursor': comment_cursor,
+        'similar_post': similar_posts,
+        'cache_versions': {
+            'posts': versions['posts'],
+            'comments': versions[f'comments:{post.id}'],
+        },
     }) 
 
 
-def post_share(request, post_id):
+@ratelimit.rate_limit('share', '5/m', key='user')
+async def post_share(request, post_id):
     """
     Allows users to share a post via email.
     
@@ -140,7 +193,7 @@ def post_share(request, post_id):
         post_id (int): The ID of the post to share.
     """
     # retrieve post by id
-    post = get_object_or_404(Post, id=post_id, status=Post.Status.PUBLISHED)
+    post = await aget_object_or_404(Post, id=post_id, status=Post.Status.PUBLISHED)
     post_url = request.build_absolute_uri(post.get_absolute_url()) #building the absolute url for domain
     sent = False
 
@@ -151,7 +204,8 @@ def post_share(request, post_id):
             subject = f"{cd['name']} recommends you read {post.title}"
             message = f"Read {post.title} at {post_url}\n\n{cd['name']}'s comments: {cd['comments']}"
 
-            send_mail(
+            # queued for the send_queued_mail worker so the request never waits on SMTP
+            await mail.aenqueue(
                 subject=subject,
                 message=message,
                 from_email=None,
@@ -160,10 +214,11 @@ def post_share(request, post_id):
             sent = True
     else:
         form = EmailPostForm()
-    return render(request, 'blog/post/share.html', {'post': post, 'form':form, 'sent': sent, 'post_url': post_url,}) 
+    return await sync_to_async(render)(request, 'blog/post/share.html', {'post': post, 'form':form, 'sent': sent, 'post_url': post_url,}) 
 
 
 # login view 
+@ratelimit.rate_limit('login', '10/m')
 def login_view(request):
     """
     Handles user login.
@@ -189,6 +244,7 @@ def login_view(request):
     return render(request, 'blog/login.html', {'form': form})
 
 # signup view 
+@ratelimit.rate_limit('signup', '5/h')
 def signup_view(request):
     """
     Handles user registration.
@@ -221,12 +277,26 @@ def signup_view(request):
 
 # view for authors blog
 @login_required
+@routing.read_from_replicas
 def profile_view(request):
     """
-    Displays the logged-in user's profile and their posts.
+    The logged-in author's dashboard: their totals, and their published posts
+    or drafts (``?status=drafts``) a page at a time with their comment counts.
     """
-    user_posts = Post.objects.filter(author=request.user)
-    return render(request, 'blog/post/profile.html', {'user_posts': user_posts})
+    status = Post.Status.DRAFT if request.GET.get('status') == 'drafts' else Post.Status.PUBLISHED
+    user_posts = (
+        Post.objects.filter(author=request.user, status=status)
+        .for_cards()
+    )
+    # off the (author, status, publish) index, however many posts the author has
+    posts = KeysetPaginator(user_posts, DASHBOARD_POSTS_PER_PAGE).get_page(request.GET.get('cursor'))
+    # after the posts, recomputing stale totals writes and sends later reads to the primary
+    stats = authorstats.for_author(request.user)
+    return render(request, 'blog/post/profile.html', {
+        'user_posts': posts,
+        'drafts': status == Post.Status.DRAFT,
+        'stats': stats,
+    })
 
 
 # create with django built in view 
@@ -236,7 +306,7 @@ class PostCreateView(LoginRequiredMixin, CreateView):
     Requires login.
     """
     model = Post
-    fields = ['title', 'body', 'image', 'status', 'tags']
+    fields = ['title', 'body', 'body_format', 'image', 'status', 'tags']
     template_name = 'blog/post/post_form.html'
     success_url = reverse_lazy('blog:post_list')  # Change to your desired URL
 
@@ -252,7 +322,7 @@ class PostUpdateView(LoginRequiredMixin, UserPassesTestMixin, UpdateView):
     Requires login and author permission.
     """
     model = Post
-    fields = ['title', 'body', 'image', 'status']
+    fields = ['title', 'body', 'body_format', 'image', 'status']
     template_name = 'blog/post/post_form.html'
 
     def test_func(self):
@@ -272,3 +342,108 @@ class PostDeleteView(LoginRequiredMixin, UserPassesTestMixin, DeleteView):
     def test_func(self):
         post = self.get_object()
         return self.request.user == post.author
+
+
+def post_feed(request, feed_format, tag_slug=None):
+    """
+    RSS or Atom feed of the newest posts, optionally only those with a tag.
+
+    Args:
+        feed_format (str): 'rss' or 'atom'.
+        tag_slug (str, optional): The slug of the tag to filter by.
+    """
+    if feed_format not in feeds.FEED_FORMATS:
+        raise Http404('No such feed format.')
+    tag = get_object_or_404(Tag, slug=tag_slug) if tag_slug else None
+    return feeds.feed_response(request, feed_format, tag)
+
+
+def sitemap_index(request):
+    """
+    Sitemap index pointing at one sitemap per month of posts.
+    """
+    return sitemaps.index_response(request)
+
+
+def sitemap_month(request, year, month):
+    """
+    Sitemap of the posts published in one month.
+    """
+    return sitemaps.shard_response(request, year, month)
+
+
+@routing.read_from_replicas
+def api_post_list(request):
+    """
+    Published posts as JSON, newest first with cursor paging, see blog/api.py.
+    """
+    return api.response(request, 'post_list', api.post_list, ['posts', 'tags'])
+
+
+@routing.read_from_replicas
+def api_post_detail(request, id):
+    """
+    A published post as JSON.
+    """
+    return api.response(request, 'post_detail', api.post_detail, ['posts', 'tags'], id)
+
+
+@routing.read_from_replicas
+def api_comment_list(request, id):
+    """
+    The visible comments of a published post as JSON, oldest first with cursor paging.
+    """
+    return api.response(request, 'comment_list', api.comment_list, ['posts', f'comments:{id}'], id)
+
+
+@routing.read_from_replicas
+def api_tag_list(request):
+    """
+    The tags in use and their post counts as JSON.
+    """
+    return api.response(request, 'tag_list', api.tag_list, ['posts', 'tags'])
+
+
+@staff_member_required
+def cache_stats(request):
+    """
+    Returns the page and fragment cache hit and miss counters of this process as JSON.
+    """
+    return JsonResponse({'backend': settings.CACHES['default']['BACKEND'], 'stats': caching.stats()})
+
+
+@never_cache
+@staff_member_required
+def export_view(request, dataset):
+    """
+    Streams posts, comments, subscribers or tags as JSON Lines or CSV, see blog/exporter.py.
+
+    Args:
+        dataset (str): The name of the dataset, a key of exporter.DATASETS.
+    """
+    if dataset not in exporter.DATASETS:
+        raise Http404('No such dataset.')
+    return exporter.export_response(request, dataset)
+
+
+@never_cache
+def metrics_view(request):
+    """
+    Returns the request metrics of this process in the Prometheus text format.
+
+    Open to scrapers sending the BLOG_METRICS_TOKEN as a bearer token, and to staff.
+    """
+    token = settings.BLOG_METRICS_TOKEN
+    authorization = request.headers.get('Authorization', '')
+    if not (token and constant_time_compare(authorization, f'Bearer {token}')):
+        if not (request.user.is_active and request.user.is_staff):
+            return HttpResponse('Forbidden', status=403, content_type='text/plain')
+    return HttpResponse(metrics.registry.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+@never_cache
+def csrf_token_view(request):
+    """
+    Hands out a CSRF token to forms on pages exported by export_static_site.
+    """
+    return JsonResponse({'token': get_token(request)})
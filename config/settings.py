@@ -11,7 +11,7 @@ https://docs.djangoproject.com/en/5.2/ref/settings/
 """
 import os
 from pathlib import Path
-from decouple import config
+from decouple import Csv, config
 import dj_database_url
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -56,6 +56,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'blog.middleware.MetricsMiddleware',
+    'blog.middleware.ReplicaRoutingMiddleware',
     "django_browser_reload.middleware.BrowserReloadMiddleware",
 
     'django.middleware.security.SecurityMiddleware',
@@ -71,7 +73,8 @@ ROOT_URLCONF = 'config.urls'
 
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        # the Django backend, timing renders for the request metrics
+        'BACKEND': 'blog.metrics.TimedDjangoTemplates',
         'DIRS': [],
         'APP_DIRS': True,
         'OPTIONS': {
@@ -79,6 +82,7 @@ TEMPLATES = [
                 'django.template.context_processors.request',
                 'django.contrib.auth.context_processors.auth',
                 'django.contrib.messages.context_processors.messages',
+                'blog.context_processors.cached_csrf',
             ],
         },
     },
@@ -97,6 +101,20 @@ DATABASES = {
     }
 }
 
+# read replicas as comma separated database urls, e.g. DATABASE_REPLICAS=sqlite:///replica.sqlite3
+# to try it locally, the hot read-only pages read from them, see blog/routing.py
+for number, url in enumerate(config('DATABASE_REPLICAS', default='', cast=Csv()), start=1):
+    # tests run against the primary's test database
+    DATABASES[f'replica{number}'] = {**dj_database_url.parse(url), 'TEST': {'MIRROR': 'default'}}
+
+BLOG_DATABASE_REPLICAS = [alias for alias in DATABASES if alias != 'default']
+DATABASE_ROUTERS = ['blog.routing.ReplicaRouter']
+# replicas further behind than this many seconds are skipped, and readers who
+# just wrote are kept on the primary for as long
+BLOG_REPLICA_MAX_LAG = config('BLOG_REPLICA_MAX_LAG', default=5, cast=float)
+# seconds between checks of each replica's health and lag, per process
+BLOG_REPLICA_CHECK_INTERVAL = 10
+
 # for production
 # DATABASES = {
 #     'default': dj_database_url.config(
@@ -106,6 +124,33 @@ DATABASES = {
 # }
 
 
+# Cache
+# https://docs.djangoproject.com/en/5.2/topics/cache/
+# CACHE_BACKEND=locmem keeps a cache per process, CACHE_BACKEND=file shares one between processes
+
+CACHE_BACKENDS = {
+    'locmem': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'nacos-blog',
+        'OPTIONS': {'MAX_ENTRIES': 5000},
+    },
+    'file': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': config('CACHE_LOCATION', default=str(BASE_DIR / 'cache')),
+        'OPTIONS': {'MAX_ENTRIES': 20000},
+    },
+}
+
+CACHES = {
+    'default': CACHE_BACKENDS[config('CACHE_BACKEND', default='locmem')],
+}
+
+# seconds a rendered page or fragment is kept, invalidation doesn't wait for it
+BLOG_CACHE_TIMEOUT = config('BLOG_CACHE_TIMEOUT', default=600, cast=int)
+# serve whole cached pages to anonymous readers
+BLOG_PAGE_CACHE = config('BLOG_PAGE_CACHE', default=True, cast=bool)
+
+
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
 
@@ -154,9 +199,39 @@ EMAIL_PORT = 587
 EMAIL_USE_TLS = True
 EMAIL_HOST_USER = config('EMAIL_HOST_USER')
 EMAIL_HOST_PASSWORD = config('EMAIL_HOST_PASSWORD')
+EMAIL_TIMEOUT = 30
+
+# used for absolute links in emails sent outside a request
+SITE_URL = config('SITE_URL', default='http://127.0.0.1:8000')
+
+# outbound mail queue, see `python manage.py send_queued_mail`
+# seconds before the first retry of a failed message, doubled on each further attempt
+MAIL_QUEUE_RETRY_DELAY = 60
 
 LOGOUT_REDIRECT_URL = 'blog:post_list'
 
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
+# resized copies made of every post image, see blog/images.py
+BLOG_IMAGE_WIDTHS = [480, 960, 1600]
+BLOG_IMAGE_FORMATS = ['webp', 'jpeg']
+# processes resizing images in the background, 0 resizes inline after the upload is saved
+BLOG_IMAGE_WORKERS = config('BLOG_IMAGE_WORKERS', default=2, cast=int)
+
+# where `python manage.py export_static_site` writes the pre-rendered site
+BLOG_STATIC_SITE_ROOT = os.path.join(BASE_DIR, 'static_site')
+
+# request metrics in the Prometheus text format at /metrics, see blog/metrics.py
+# scrapers send `Authorization: Bearer <token>`, without a token only staff can read them
+BLOG_METRICS_TOKEN = config('BLOG_METRICS_TOKEN', default='')
+# log requests slower than this many milliseconds with their SQL, unset turns the log off
+BLOG_SLOW_REQUEST_MS = config('BLOG_SLOW_REQUEST_MS', default=None, cast=lambda value: float(value) if value else None)
+
+# write endpoints turn away clients past their rate with 429, counts live in the cache, see blog/ratelimit.py
+# exact only on a cache with atomic increments (memcached, redis), approximate on the file and locmem ones
+BLOG_RATELIMIT_ENABLED = config('BLOG_RATELIMIT_ENABLED', default=True, cast=bool)
+# rates per scope overriding the views' own, e.g. {'comment': '20/m'}
+BLOG_RATE_LIMITS = {}
+# where the client address is read, HTTP_X_FORWARDED_FOR behind a proxy (its last entry is used)
+BLOG_RATELIMIT_IP_HEADER = config('BLOG_RATELIMIT_IP_HEADER', default='REMOTE_ADDR')
@@ -15,16 +15,23 @@ Including another URLconf
     2. Add a URL to urlpatterns:  path('blog/', include('blog.urls'))
 """
 from django.contrib import admin
-from django.urls import path, include
+from django.urls import path, include, re_path
 from django.contrib.auth import views as auth_views
 
 from django.conf import settings
 from django.conf.urls.static import static
 
+from blog import views as blog_views
+
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('blog/', include('blog.urls', namespace='blog')),
     path('logout/', auth_views.LogoutView.as_view(), name='logout'),
+    # scraped by Prometheus, kept at the conventional path
+    path('metrics', blog_views.metrics_view, name='metrics'),
+    # sitemaps cover the whole site, so they live at the root
+    path('sitemap.xml', blog_views.sitemap_index, name='sitemap'),
+    re_path(r'^sitemap-(?P<year>\d{4})-(?P<month>\d{2})\.xml$', blog_views.sitemap_month, name='sitemap_month'),
 
     # for brower refeshing
     path("__reload__/", include("django_browser_reload.urls")),